@@ -0,0 +1,555 @@
+"""
+In-process benchmarks for field resolution and serialization.
+
+`imago-bench` times whole requests, where the database dominates. These
+time the layers in between, with no database at all: the objects are
+synthetic and unsaved, with their related objects put in each manager's
+prefetch cache the way `prefetch_related` would, so reading them never
+queries.
+
+For every endpoint in `imago.views`, with its `default_fields`, and for
+each model's `WORST_CASE_FIELDS`, a `Case` times:
+
+     - resolve    | `get_fields` turning the field list into a spec,
+                  | without the endpoint's cache.
+     - plan       | Building the spec's `QueryPlan`.
+     - compile    | Generating the spec's serializer with `imago.codegen`.
+     - restless   | `restless.models.serialize` on the page of objects.
+     - compiled   | The generated serializer on the same page.
+     - encode     | `imago.encoders.dumps` on the serialized page.
+
+The serializing steps are only timed for the models `SyntheticWorld` can
+build: bills, people, organizations and vote events. Run them with
+`manage.py microbench`.
+"""
+
+import collections
+import contextlib
+import itertools
+import json
+import timeit
+import uuid
+
+from django.db import connections
+from django.utils import timezone
+from opencivicdata.models import (Bill, BillAbstract, BillAction, BillActionRelatedEntity,
+                                  BillDocument, BillDocumentLink, BillIdentifier,
+                                  BillSource, BillSponsorship, BillTitle, BillVersion,
+                                  BillVersionLink, Division, Jurisdiction,
+                                  LegislativeSession, Membership, MembershipContactDetail,
+                                  Organization, OrganizationContactDetail,
+                                  OrganizationIdentifier, OrganizationLink,
+                                  OrganizationName, OrganizationSource, Person,
+                                  PersonContactDetail, PersonIdentifier, PersonLink,
+                                  PersonName, PersonSource, PersonVote, Post,
+                                  RelatedBill, VoteCount, VoteEvent, VoteSource)
+from restless.models import serialize
+
+from . import encoders, views
+from .codegen import compile_serializer
+from .helpers import FieldSpecMixin, get_fields
+from .plan import QueryPlan
+
+
+# Every field a client could ask for on each model, down to the deepest
+# relations the specs allow that `SyntheticWorld` fills in.
+WORST_CASE_FIELDS = {
+    Bill: [
+        'id', 'identifier', 'title', 'classification', 'subject', 'extras',
+        'created_at', 'updated_at', 'from_organization_id',
+
+        'legislative_session.identifier',
+        'legislative_session.classification',
+        'legislative_session.jurisdiction.id',
+        'legislative_session.jurisdiction.name',
+        'legislative_session.jurisdiction.division.id',
+
+        'from_organization.id',
+        'from_organization.name',
+        'from_organization.classification',
+        'from_organization.jurisdiction.id',
+        'from_organization.jurisdiction.name',
+        'from_organization.parent.id',
+        'from_organization.parent.name',
+
+        'abstracts.abstract', 'abstracts.note',
+        'other_titles.title', 'other_titles.note',
+        'other_identifiers.identifier', 'other_identifiers.scheme',
+        'other_identifiers.note',
+
+        'actions.description',
+        'actions.date',
+        'actions.classification',
+        'actions.order',
+        'actions.organization.id',
+        'actions.organization.name',
+        'actions.organization.jurisdiction.id',
+        'actions.related_entities.name',
+        'actions.related_entities.entity_type',
+        'actions.related_entities.organization_id',
+        'actions.related_entities.person_id',
+
+        'sponsorships.primary', 'sponsorships.classification',
+        'sponsorships.entity_name', 'sponsorships.entity_type',
+        'sponsorships.entity_id',
+
+        'documents.note', 'documents.date',
+        'documents.links.media_type', 'documents.links.url',
+        'versions.note', 'versions.date',
+        'versions.links.media_type', 'versions.links.url',
+
+        'related_bills.identifier', 'related_bills.relation_type',
+        'related_bills.bill.id',
+
+        'votes.id', 'votes.result', 'votes.motion_text', 'votes.start_date',
+        'votes.motion_classification', 'votes.created_at',
+        'votes.counts.option', 'votes.counts.value',
+        'votes.votes.option', 'votes.votes.voter_name', 'votes.votes.note',
+
+        'sources.url', 'sources.note',
+    ],
+    Person: [
+        'id', 'name', 'given_name', 'family_name', 'sort_name', 'image',
+        'gender', 'summary', 'national_identity', 'biography', 'birth_date',
+        'death_date', 'created_at', 'updated_at', 'extras',
+
+        'identifiers.identifier', 'identifiers.scheme',
+        'other_names.name', 'other_names.note',
+        'other_names.start_date', 'other_names.end_date',
+        'contact_details.type', 'contact_details.value',
+        'contact_details.note', 'contact_details.label',
+        'links.url', 'links.note',
+        'sources.url', 'sources.note',
+
+        'memberships.label',
+        'memberships.role',
+        'memberships.start_date',
+        'memberships.end_date',
+        'memberships.contact_details.type',
+        'memberships.contact_details.value',
+        'memberships.organization.id',
+        'memberships.organization.name',
+        'memberships.organization.classification',
+        'memberships.organization.parent.name',
+        'memberships.organization.jurisdiction.id',
+        'memberships.organization.jurisdiction.name',
+        'memberships.organization.jurisdiction.division.name',
+        'memberships.post.id',
+        'memberships.post.label',
+        'memberships.post.role',
+        'memberships.post.division.id',
+        'memberships.post.division.name',
+        'memberships.on_behalf_of.name',
+    ],
+    Organization: [
+        'id', 'name', 'image', 'classification', 'founding_date',
+        'dissolution_date', 'created_at', 'updated_at', 'extras',
+        'jurisdiction_id',
+
+        'identifiers.identifier', 'identifiers.scheme',
+        'other_names.name', 'other_names.note',
+        'contact_details.type', 'contact_details.value',
+        'links.url', 'links.note',
+        'sources.url', 'sources.note',
+
+        'parent.id', 'parent.name', 'parent.jurisdiction.name',
+
+        'jurisdiction.id',
+        'jurisdiction.name',
+        'jurisdiction.url',
+        'jurisdiction.feature_flags',
+        'jurisdiction.division.id',
+        'jurisdiction.legislative_sessions.identifier',
+
+        'children.id', 'children.name', 'children.classification',
+
+        'posts.id', 'posts.label', 'posts.role', 'posts.division_id',
+        'posts.division.name',
+
+        'memberships.label',
+        'memberships.role',
+        'memberships.start_date',
+        'memberships.end_date',
+        'memberships.person.id',
+        'memberships.person.name',
+        'memberships.person.image',
+        'memberships.post.id',
+        'memberships.post.label',
+        'memberships.contact_details.value',
+    ],
+    VoteEvent: [
+        'id', 'identifier', 'motion_text', 'motion_classification',
+        'created_at', 'updated_at', 'start_date', 'end_date', 'extras',
+        'result', 'organization_id', 'bill_id',
+
+        'legislative_session.identifier',
+        'legislative_session.jurisdiction.id',
+        'legislative_session.jurisdiction.name',
+
+        'organization.id', 'organization.name', 'organization.classification',
+        'organization.parent.name',
+
+        'bill.id', 'bill.identifier', 'bill.title', 'bill.classification',
+        'bill.legislative_session.identifier',
+        'bill.from_organization.name',
+        'bill.actions.description',
+        'bill.actions.date',
+
+        'counts.option', 'counts.value',
+        'votes.option', 'votes.voter_name', 'votes.note',
+        'sources.url', 'sources.note',
+    ],
+}
+
+
+_ids = itertools.count(1)
+
+
+def _uuid():
+    return uuid.UUID(int=next(_ids))
+
+
+def _ocd_id(kind):
+    return 'ocd-{}/{}'.format(kind, _uuid())
+
+
+def _cache_name(manager):
+    # the key `prefetch_related` stores a related manager's objects under
+    if hasattr(manager, 'prefetch_cache_name'):
+        return manager.prefetch_cache_name
+    return manager.field.related_query_name()
+
+
+def set_related(obj, name, objects):
+    """
+    Make `obj.<name>.all()` return `objects`, like `prefetch_related`
+    does, so reading them doesn't query. Returns `objects`.
+    """
+    manager = getattr(obj, name)
+    queryset = manager.get_queryset()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    if not hasattr(obj, '_prefetched_objects_cache'):
+        obj._prefetched_objects_cache = {}
+    obj._prefetched_objects_cache[_cache_name(manager)] = queryset
+    return objects
+
+
+def make(model, **attrs):
+    """
+    An unsaved `model` with `attrs`, and every one of its related
+    managers set to nothing until `set_related` fills it in.
+    """
+    names = set(field.name for field in model._meta.concrete_fields)
+    now = timezone.now()
+    for name in ('created_at', 'updated_at'):
+        if name in names:
+            attrs.setdefault(name, now)
+    if 'extras' in names:
+        attrs.setdefault('extras', {'source': 'imago.benchmarks'})
+    obj = model(**attrs)
+    for field in model._meta.get_fields():
+        if field.auto_created and not field.concrete and (
+                field.one_to_many or field.many_to_many):
+            set_related(obj, field.get_accessor_name(), [])
+    return obj
+
+
+class SyntheticWorld(object):
+    """
+    A synthetic, unsaved graph around one state legislature. `size` sets
+    how many of everything there is: posts and committees, members,
+    memberships per person, actions per bill, voters per vote event.
+    Reading any relation the benchmark field lists follow makes no
+    queries.
+    """
+
+    def __init__(self, size=50):
+        self.size = size
+        self.state = self.division('ocd-division/country:us/state:ex', 'Example')
+        self.jurisdiction = make(
+            Jurisdiction, id='ocd-jurisdiction/country:us/state:ex/government',
+            name='Example State', url='http://example.com/',
+            classification='government', feature_flags=['subjects'],
+            division=self.state)
+        set_related(self.state, 'jurisdictions', [self.jurisdiction])
+        self.session = make(
+            LegislativeSession, jurisdiction=self.jurisdiction, identifier='2017',
+            name='2017 Regular Session', classification='primary',
+            start_date='2017-01-09', end_date='2017-06-30')
+        set_related(self.jurisdiction, 'legislative_sessions', [self.session])
+
+        self.legislature = self.organization('Example State Legislature', 'legislature')
+        self.chambers = [
+            self.organization('Example State Senate', 'upper', parent=self.legislature),
+            self.organization('Example State House', 'lower', parent=self.legislature),
+        ]
+        self.committees = [
+            self.organization('Committee on Topic {}'.format(i), 'committee',
+                              parent=self.chambers[i % 2])
+            for i in range(size)
+        ]
+        set_related(self.legislature, 'children', self.chambers)
+        for chamber in self.chambers:
+            set_related(chamber, 'children', [committee for committee in self.committees
+                                              if committee.parent is chamber])
+
+        self.posts = []
+        for chamber in self.chambers:
+            posts = [self.post(chamber, i + 1) for i in range(size)]
+            set_related(chamber, 'posts', posts)
+            self.posts.extend(posts)
+
+        self.people = [self.person(i) for i in range(size)]
+        self.memberships = collections.defaultdict(list)
+        for i, person in enumerate(self.people):
+            orgs = [self.chambers[i % 2]] + [
+                self.committees[(i + j) % len(self.committees)] for j in range(size - 1)]
+            memberships = [self.membership(person, org, self.posts[i] if j == 0 else None)
+                           for j, org in enumerate(orgs)]
+            set_related(person, 'memberships', memberships)
+            for membership in memberships:
+                self.memberships[membership.organization].append(membership)
+        for org, memberships in self.memberships.items():
+            set_related(org, 'memberships', memberships)
+
+    def division(self, id_, name):
+        division = make(Division, id=id_, name=name, **Division.subtypes_from_id(id_)[0])
+        # read by `imago.serialize.division_children` instead of querying
+        division._children = []
+        return division
+
+    def organization(self, name, classification, parent=None):
+        org = make(Organization, name=name, classification=classification,
+                   jurisdiction=self.jurisdiction, parent=parent,
+                   image='http://example.com/seal.png')
+        set_related(org, 'identifiers', [make(
+            OrganizationIdentifier, organization=org, scheme='example',
+            identifier=str(next(_ids)))])
+        set_related(org, 'other_names', [make(
+            OrganizationName, organization=org, name=name.upper(), note='caps')])
+        set_related(org, 'contact_details', [make(
+            OrganizationContactDetail, organization=org, type='voice',
+            value='555-0100', note='Capitol office', label='Office')])
+        set_related(org, 'links', [make(
+            OrganizationLink, organization=org, url='http://example.com/org', note='home')])
+        set_related(org, 'sources', [make(
+            OrganizationSource, organization=org, url='http://example.com/src', note='')])
+        return org
+
+    def post(self, chamber, district):
+        division = self.division('{}/sld{}:{}'.format(
+            self.state.id, chamber.classification[0], district),
+            'District {}'.format(district))
+        post = make(Post, organization=chamber, label=str(district), role='member',
+                    division=division)
+        set_related(division, 'posts', [post])
+        return post
+
+    def person(self, i):
+        name = 'Legislator {}'.format(i)
+        person = make(Person, name=name, sort_name='{}, Legislator'.format(i),
+                      given_name='Legislator', family_name=str(i), gender='female',
+                      image='http://example.com/{}.jpg'.format(i),
+                      biography='Has served since {}.'.format(2000 + i % 17),
+                      birth_date='1970-01-01')
+        set_related(person, 'identifiers', [make(
+            PersonIdentifier, person=person, scheme='example', identifier=str(i))])
+        set_related(person, 'other_names', [make(
+            PersonName, person=person, name=name.upper(), note='caps')])
+        set_related(person, 'contact_details', [
+            make(PersonContactDetail, person=person, type=type_, value=value,
+                 note='Capitol office', label='')
+            for type_, value in (('voice', '555-0101'), ('email', 'l@example.com'),
+                                 ('address', '1 Capitol Way'))])
+        set_related(person, 'links', [make(
+            PersonLink, person=person, url='http://example.com/p', note='')])
+        set_related(person, 'sources', [make(
+            PersonSource, person=person, url='http://example.com/src', note='')])
+        return person
+
+    def membership(self, person, org, post=None):
+        membership = make(Membership, person=person, organization=org, post=post,
+                          role='member', label='', start_date='2017-01-09')
+        set_related(membership, 'contact_details', [make(
+            MembershipContactDetail, membership=membership, type='voice',
+            value='555-0102', note='', label='')])
+        return membership
+
+    def organizations(self, count):
+        return (self.chambers + self.committees)[:count]
+
+    def bills(self, count):
+        return [self.bill(i) for i in range(count)]
+
+    def bill(self, i):
+        chamber = self.chambers[i % 2]
+        bill = make(Bill, identifier='HB {}'.format(i + 1),
+                    title='An act concerning topic {}'.format(i),
+                    legislative_session=self.session, from_organization=chamber,
+                    classification=['bill'], subject=['Topic', 'Other topic'])
+        set_related(bill, 'abstracts', [make(
+            BillAbstract, bill=bill, abstract='Concerns a topic.', note='')])
+        set_related(bill, 'other_titles', [make(
+            BillTitle, bill=bill, title='Topic act', note='short title')])
+        set_related(bill, 'other_identifiers', [make(
+            BillIdentifier, bill=bill, scheme='', identifier='HB{}'.format(i + 1), note='')])
+
+        actions = []
+        for order in range(self.size):
+            action = make(BillAction, bill=bill, order=order,
+                          organization=self.chambers[(i + order) % 2],
+                          description='Action {}'.format(order),
+                          date='2017-02-{:02d}'.format(order % 28 + 1),
+                          classification=['committee-passage'])
+            set_related(action, 'related_entities', [
+                make(BillActionRelatedEntity, action=action, entity_type='person',
+                     name=person.name, person=person)
+                for person in self.people[order % self.size:][:3]])
+            actions.append(action)
+        set_related(bill, 'actions', actions)
+
+        set_related(bill, 'sponsorships', [
+            make(BillSponsorship, bill=bill, primary=(n == 0), classification='primary',
+                 entity_type='person', name=person.name, person=person)
+            for n, person in enumerate(self.people[:max(self.size // 5, 1)])])
+
+        for name, model, link_model, key in (
+                ('documents', BillDocument, BillDocumentLink, 'document'),
+                ('versions', BillVersion, BillVersionLink, 'version')):
+            items = []
+            for n in range(5):
+                item = make(model, bill=bill, note='{} {}'.format(name, n), date='2017-02-01')
+                set_related(item, 'links', [
+                    make(link_model, url='http://example.com/{}.{}'.format(n, ext),
+                         media_type=media_type, **{key: item})
+                    for ext, media_type in (('pdf', 'application/pdf'),
+                                            ('html', 'text/html'))])
+                items.append(item)
+            set_related(bill, name, items)
+
+        set_related(bill, 'related_bills', [make(
+            RelatedBill, bill=bill, identifier='SB {}'.format(i + 1),
+            legislative_session=self.session.identifier, relation_type='companion')])
+        set_related(bill, 'votes', [self.vote(bill, n) for n in range(3)])
+        set_related(bill, 'sources', [make(
+            BillSource, bill=bill, url='http://example.com/bill', note='')])
+        return bill
+
+    def votes(self, count):
+        return [self.vote(self.bill(i), i) for i in range(count)]
+
+    def vote(self, bill, i):
+        vote = make(VoteEvent, identifier='', motion_text='Motion {}'.format(i),
+                    motion_classification=['passage'], start_date='2017-03-01',
+                    result='pass', organization=bill.from_organization,
+                    legislative_session=self.session, bill=bill)
+        set_related(vote, 'counts', [
+            make(VoteCount, vote_event=vote, option=option, value=value)
+            for option, value in (('yes', self.size * 2), ('no', self.size),
+                                  ('abstain', 1), ('absent', 2),
+                                  ('not voting', 0), ('excused', 3))])
+        set_related(vote, 'votes', [
+            make(PersonVote, vote_event=vote, option='yes' if n % 3 else 'no',
+                 voter_name=person.name, voter=person, note='')
+            for n, person in enumerate(self.people * 2)])
+        set_related(vote, 'sources', [make(
+            VoteSource, vote_event=vote, url='http://example.com/vote', note='')])
+        return vote
+
+    def objects(self, model, count):
+        """ `count` objects of `model`, or None if it isn't one we build. """
+        builders = {
+            Bill: self.bills,
+            Organization: self.organizations,
+            Person: lambda count: self.people[:count],
+            VoteEvent: self.votes,
+        }
+        if model not in builders:
+            return None
+        return builders[model](count)
+
+
+def endpoints():
+    """ The (name, class) of every endpoint in `imago.views`. """
+    return sorted(
+        (name, view) for name, view in vars(views).items()
+        if isinstance(view, type) and issubclass(view, FieldSpecMixin)
+        and view.__module__ == views.__name__)
+
+
+Case = collections.namedtuple('Case', ['name', 'endpoint', 'fields'])
+
+
+def cases():
+    """
+    A `Case` for every endpoint's `default_fields`, and for the worst
+    case field list of each model, on the list endpoint.
+    """
+    found = []
+    for name, view in endpoints():
+        found.append(Case(name, view, list(view.default_fields)))
+    for name, view in endpoints():
+        if view.model in WORST_CASE_FIELDS and name.endswith('List'):
+            found.append(Case(name + ':worst', view, WORST_CASE_FIELDS[view.model]))
+    return found
+
+
+def best(fn, repeat, number=1):
+    """ Best-of-`repeat` seconds per call of `fn`, over `number` calls each. """
+    return min(timeit.Timer(fn).repeat(repeat=repeat, number=number)) / number
+
+
+@contextlib.contextmanager
+def no_queries():
+    """
+    Fail on any query, so an object missing from the synthetic graph
+    doesn't go to the database unnoticed. Django before 2.0 has no hook
+    for this; there, a query fails only if there isn't a database.
+    """
+    def refuse(execute, sql, params, many, context):
+        raise AssertionError('benchmark made a query: {}'.format(sql))
+
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            if hasattr(connection, 'execute_wrapper'):
+                stack.enter_context(connection.execute_wrapper(refuse))
+        yield
+
+
+def run_case(case, world, count=20, repeat=5, number=20):
+    """
+    Time `case` as described above, returning a dict of seconds for each
+    step, along with the page size, and whether the compiled serializer's
+    output matched restless'. Field resolution steps are timed `number`
+    times per run, since they're quick.
+    """
+    model = case.endpoint.model
+    serialize_config = case.endpoint.serialize_config
+    _, config = get_fields(serialize_config, case.fields)
+    native_datetimes = encoders.native_datetimes()
+
+    result = collections.OrderedDict()
+    result['resolve'] = best(lambda: get_fields(serialize_config, case.fields),
+                             repeat, number)
+    result['plan'] = best(lambda: QueryPlan(model, config), repeat, number)
+    result['compile'] = best(lambda: compile_serializer(
+        config, model=model, native_datetimes=native_datetimes), repeat)
+
+    objects = world.objects(model, count)
+    if objects is None:
+        return result
+
+    compiled = compile_serializer(config, model=model, native_datetimes=native_datetimes)
+    restless = lambda obj: serialize(obj, **config)
+    with no_queries():
+        page = [compiled(obj) for obj in objects]
+        # compiled output may leave datetimes to the encoder, so compare JSON
+        result['matches'] = (json.loads(encoders.dumps(page).decode('utf-8')) ==
+                             json.loads(encoders.dumps(
+                                 [restless(obj) for obj in objects]).decode('utf-8')))
+        result['objects'] = len(objects)
+        result['restless'] = best(lambda: [restless(obj) for obj in objects], repeat)
+        result['compiled'] = best(lambda: [compiled(obj) for obj in objects], repeat)
+        result['encode'] = best(lambda: encoders.dumps(page), repeat)
+    return result
@@ -0,0 +1,209 @@
+"""
+Caches shared by the public endpoints.
+
+These are deliberately simple: a bounded, thread-safe LRU with hit and miss
+counters, so the cost of a hot path can be checked at runtime, and a cache
+of rendered responses on top of either that or a Django cache backend.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+class LRUCache(object):
+    """
+    A bounded mapping that evicts the least recently used entries once
+    the stored entries weigh more than `maxsize`. By default every entry
+    weighs 1; pass `weigh` to bound by something else, like bytes.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=256, weigh=None):
+        self.maxsize = maxsize
+        self.weigh = weigh or (lambda value: 1)
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.weight -= self.weigh(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.weight += self.weigh(value)
+            while self.weight > self.maxsize and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self.weight -= self.weigh(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self.weight -= self.weigh(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "weight": self.weight,
+            "maxsize": self.maxsize,
+        }
+
+
+class LocalResponseStore(object):
+    """
+    The bits of the Django cache API `ResponseCache` uses, kept in this
+    process and bounded by the total size of the cached bodies.
+    """
+
+    def __init__(self, maxbytes):
+        self.lru = LRUCache(maxbytes, weigh=self._weigh)
+
+    @staticmethod
+    def _weigh(item):
+        expires, value = item
+        if isinstance(value, dict):
+            return len(value.get('content', b''))
+        return 1
+
+    def get(self, key, default=None):
+        item = self.lru.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires is not None and expires < time.time():
+            self.lru.delete(key)
+            return default
+        return value
+
+    def get_many(self, keys):
+        ret = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                ret[key] = value
+        return ret
+
+    def set(self, key, value, timeout=None):
+        expires = None if timeout is None else time.time() + timeout
+        self.lru.set(key, (expires, value))
+
+
+class ResponseCache(object):
+    """
+    Rendered response bodies of the public endpoints, keyed on the
+    endpoint, path, and canonicalized request parameters.
+
+    Entries live in the Django cache named by the `IMAGO_RESPONSE_CACHE`
+    setting, so a memcached or Redis cache can share them between workers.
+    Without that setting, each process keeps its own LRU, capped at
+    `IMAGO_RESPONSE_CACHE_MAX_BYTES` bytes of bodies, which nothing outside
+    the process can invalidate; its entries only expire.
+
+    Invalidation bumps a generation number that's part of every key, either
+    for one endpoint or for all of them, so stale entries are never read
+    again and simply age out.
+    """
+
+    GENERATION_KEY = 'imago:response:generation'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._backend = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            alias = getattr(settings, 'IMAGO_RESPONSE_CACHE', None)
+            if alias:
+                self._backend = caches[alias]
+            else:
+                self._backend = LocalResponseStore(
+                    getattr(settings, 'IMAGO_RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        return self._backend
+
+    def shared(self):
+        """
+        Whether other processes see this cache, so that invalidating it
+        from one (like `./manage.py invalidatecache`) reaches them all.
+        """
+        return not isinstance(self.backend, (LocalResponseStore, LocMemCache))
+
+    def key(self, endpoint, path, params):
+        generation_key = '%s:%s' % (self.GENERATION_KEY, endpoint)
+        generations = self.backend.get_many([self.GENERATION_KEY, generation_key])
+        payload = json.dumps([path, sorted(params.items())], separators=(',', ':'))
+        return 'imago:response:%s:%s:%s:%s' % (
+            endpoint,
+            generations.get(self.GENERATION_KEY, 0),
+            generations.get(generation_key, 0),
+            hashlib.sha1(payload.encode('utf-8')).hexdigest(),
+        )
+
+    def get(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry, timeout):
+        self.backend.set(key, entry, timeout)
+
+    def invalidate(self, endpoint=None):
+        """
+        Drop every cached response of `endpoint` (a view class, or its
+        name), or of every endpoint if it's None.
+        """
+        key = self.GENERATION_KEY
+        if endpoint is not None:
+            key = '%s:%s' % (key, getattr(endpoint, '__name__', endpoint))
+        self.backend.set(key, uuid.uuid4().hex, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_responses(endpoint=None):
+    """
+    Invalidate cached API responses; call this after importing new data.
+    See `ResponseCache.invalidate`.
+    """
+    response_cache.invalidate(endpoint)
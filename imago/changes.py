@@ -0,0 +1,129 @@
+"""
+Incremental change feeds for mirrors.
+
+A list request with `updated_since=<timestamp>` returns the objects
+updated since then, oldest first, along with the ids of those deleted
+since then, paged by an (updated_at, id) cursor. Keep the last page's
+`sync_cursor`, and pass it as `cursor` (along with `updated_since`) on
+the next sync to pick up exactly where this one stopped.
+
+Deletes are recorded as `Tombstone` rows by a trigger on each feed's
+table, and the feeds page through `updated_at` in index order;
+`./manage.py setupchangefeed` installs both (`--sql` prints the SQL
+instead, for running by hand). Each tombstone keeps a copy of the deleted
+row, so a feed only lists the deletes matching its filters, as far as
+`tombstone_filters` can tell.
+
+A table's `TombstoneHorizon` is when its tombstones start: when its
+trigger was installed, or up to where `setupchangefeed --prune` deleted
+them. A feed from before then can't list every delete, so it answers
+410 Gone, and the mirror has to start over.
+
+`updated_at` is set when an object is saved, not when the transaction
+saving it commits, so an import that runs in a long transaction can
+commit rows older than a mirror's cursor. Set IMAGO_CHANGES_SETTLE_SECONDS
+to at least the longest such transaction to hold back rows updated more
+recently than that, until they can't be overtaken.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION imago_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO imago_tombstone (table_name, object_id, deleted_at, data)
+        VALUES (TG_TABLE_NAME, OLD.id, now(), row_to_json(OLD)::jsonb);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+""".strip()
+
+
+def settle_seconds():
+    return getattr(settings, 'IMAGO_CHANGES_SETTLE_SECONDS', 0)
+
+
+def cutoff():
+    """ The latest change a feed may show now, or None for no limit. """
+    if not settle_seconds():
+        return None
+    return timezone.now() - datetime.timedelta(seconds=settle_seconds())
+
+
+def parse_since(value):
+    """
+    Parse an `updated_since` param, an ISO 8601 date or datetime, taken
+    to be UTC without an offset. Returns None if it's neither.
+    """
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            if date is None:
+                return None
+            since = datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        return None
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.utc)
+    return since
+
+
+def tombstone_filters(model, filters):
+    """
+    The part of a list's `filters` on `model` (its `filter` kwargs, after
+    `adjust_filters`) that can be checked against a tombstone's copy of
+    the deleted row, as `Tombstone` filter kwargs: equality on a text
+    column or a foreign key to one, and `contains` on an array column.
+    The other filters are left out, so deletes that may have matched them
+    are listed anyway.
+    """
+    matched = {}
+    for key, value in filters.items():
+        name, _, lookup = key.partition('__')
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not field.concrete or field.column is None:
+            continue
+        target = field.target_field if field.is_relation else field
+        if lookup in ('', 'exact') and isinstance(value, str) and \
+                isinstance(target, (models.CharField, models.TextField)):
+            matched['data__%s' % (field.column)] = value
+        elif lookup == 'contains' and isinstance(value, list) and \
+                isinstance(field, ArrayField):
+            matched['data__%s__contains' % (field.column)] = value
+    return matched
+
+
+def index_sql(model):
+    """ The index a feed on `model` pages through. """
+    table = model._meta.db_table
+    return ('CREATE INDEX CONCURRENTLY IF NOT EXISTS {0}_changes_idx '
+            'ON {0} (updated_at, id);'.format(table))
+
+
+def trigger_sql(model):
+    """ The statements recording `model`'s deletes as tombstones. """
+    table = model._meta.db_table
+    return [
+        'DROP TRIGGER IF EXISTS imago_tombstone ON {0};'.format(table),
+        'CREATE TRIGGER imago_tombstone AFTER DELETE ON {0} '
+        'FOR EACH ROW EXECUTE PROCEDURE imago_tombstone();'.format(table),
+    ]
+
+
+def horizon_sql(model):
+    """ The statement starting `model`'s tombstones now, unless they have. """
+    return ("INSERT INTO imago_tombstonehorizon (table_name, complete_since) "
+            "VALUES ('{0}', now()) ON CONFLICT (table_name) DO NOTHING;".format(
+                model._meta.db_table))
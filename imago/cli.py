@@ -1,57 +1,337 @@
-import requests
+"""
+imago-bench: replay a mix of API requests against a running imago server,
+and report latency percentiles, throughput and queries per request for
+each endpoint.
+
+The request mix is a JSONL file, one request per line, either
+{"path": "/people/", "params": {"fields": "id,name"}} or
+{"url": "/bills/?fields=id"}, optionally with a "weight" for sampling.
+
+Every distinct request is first sent once, one at a time: that's the
+"cold" phase, which pays for empty caches. The mix is then replayed with
+`--concurrency` clients, for the "warm" numbers. Results can be saved as
+JSON with `--output`, and compared against an earlier run with `--compare`.
+
+imago-profiles: add up the hottest functions across the request profiles
+a server wrote to its `IMAGO_PROFILE_DIR` (see `imago.profiling`).
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
 import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
 
+import requests
 
-def debug():
-    url, *fields = sys.argv[1:]
-    if fields == []:
-        print("")
-        print("Baseline Benchmark:")
-        print("")
-        benchmark(url)
 
-    field_param = []
-    for field in fields:
-        field_param.append(field)
-        print("")
-        print(" With fields: %s" % (", ".join(field_param)))
-        print("")
-        benchmark(url, fields=field_param)
+Result = collections.namedtuple('Result', ['endpoint', 'seconds', 'status', 'queries'])
 
 
-def benchmark(url, **kwargs):
-    total_time = 0
-    count = 40
+def load_requests(path):
+    """ Read the request mix as a list of (path, params, weight). """
+    mix = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if 'url' in entry:
+                url = urlsplit(entry['url'])
+                path, params = url.path, dict(parse_qsl(url.query, keep_blank_values=True))
+            else:
+                path, params = entry['path'], entry.get('params', {})
+            mix.append((path, params, float(entry.get('weight', 1))))
+    return mix
 
-    response = requests.get(url, params=kwargs).json()
-    meta, results, debug = [response[x] for x in ['meta', 'results', 'debug']]
 
-    if meta['count'] != len(results):
-        print("Meta count != result length!")
-        print("")
+def endpoint_name(path):
+    """ Group detail URLs by type, like "/ocd-person/{id}/". """
+    return re.sub(r'^/?(ocd-[a-z]+)/.+$', r'/\1/{id}/', path)
 
-    connection = debug['connection']
-    queries = connection['query']['list']
 
-    print("Made %s queries" % (connection['query']['count']))
-    print("Sorted by time:")
-    print("")
-    for query in sorted(queries, reverse=True, key=lambda x: float(x['time'])):
-        sql = query['sql']
-        if len(sql) >= 80:
-            sql = sql[:80] + "..."
-        print("  %s:   %s" % (query['time'], sql))
+def percentile(values, pct):
+    """ The nearest-rank percentile of `values`, which must be sorted. """
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def query_count(response):
+    """
+    How many queries the server made, if it says: in its Server-Timing
+    header, or in the debug output with DEBUG on.
+    """
+    match = re.search(r'(?:^|,)\s*db;[^,]*desc="(\d+) queries"',
+                      response.headers.get('Server-Timing', ''))
+    if match:
+        return int(match.group(1))
+    try:
+        debug = response.json().get('debug') or {}
+        return debug['connection']['query']['count']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+_local = threading.local()
+
+
+def fetch(base_url, path, params):
+    if not hasattr(_local, 'session'):
+        _local.session = requests.Session()
+    start = time.time()
+    try:
+        response = _local.session.get(base_url + path, params=params)
+    except requests.RequestException:
+        return Result(endpoint_name(path), time.time() - start, None, None)
+    seconds = time.time() - start
+    return Result(endpoint_name(path), seconds, response.status_code, query_count(response))
+
+
+def run_phase(base_url, requests_, concurrency):
+    """ Send every request, `concurrency` at a time; returns (results, seconds). """
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda r: fetch(base_url, r[0], r[1]), requests_))
+    return results, time.time() - start
+
+
+def summarize(results, elapsed):
+    """ Per endpoint (and "all") latency, throughput and query stats. """
+    groups = collections.defaultdict(list)
+    for result in results:
+        groups[result.endpoint].append(result)
+        groups['all'].append(result)
+
+    summary = {}
+    for endpoint, group in groups.items():
+        times = sorted(r.seconds * 1000 for r in group)
+        queries = [r.queries for r in group if r.queries is not None]
+        summary[endpoint] = {
+            "requests": len(group),
+            "errors": sum(1 for r in group if r.status != 200 and r.status != 304),
+            "p50_ms": percentile(times, 50),
+            "p95_ms": percentile(times, 95),
+            "p99_ms": percentile(times, 99),
+            "mean_ms": sum(times) / len(times),
+            "throughput": len(group) / elapsed if elapsed else None,
+            "queries": sum(queries) / float(len(queries)) if queries else None,
+        }
+    return summary
+
+
+def print_summary(title, summary):
     print("")
-    print("Prefetched Fields:")
-    for field in debug['prefetch_fields']:
-        print("  %s" % (field))
-    for x in range(count):
-        time = requests.get(url, params=kwargs).json().get(
-            "debug")['time']['seconds']
-
-        total_time += time
-        sys.stdout.write(".")
-        sys.stdout.flush()
+    print(title)
+    print("  {:<28} {:>6} {:>6} {:>9} {:>9} {:>9} {:>8} {:>8}".format(
+        "endpoint", "reqs", "errors", "p50 ms", "p95 ms", "p99 ms", "req/s", "queries"))
+    for endpoint in sorted(summary, key=lambda x: (x == 'all', x)):
+        stats = summary[endpoint]
+        print("  {:<28} {:>6} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1f} {:>8}".format(
+            endpoint, stats['requests'], stats['errors'], stats['p50_ms'],
+            stats['p95_ms'], stats['p99_ms'], stats['throughput'] or 0,
+            '-' if stats['queries'] is None else '{:.1f}'.format(stats['queries'])))
+
+
+def compare(current, baseline, threshold):
+    """
+    Lines describing each warm p50 / p95 that got more than `threshold`
+    percent slower than in `baseline`.
+    """
+    regressions = []
+    for endpoint, stats in sorted(current['warm'].items()):
+        old = baseline.get('warm', {}).get(endpoint)
+        if not old:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if old[key] and stats[key] > old[key] * (1 + threshold / 100.0):
+                regressions.append("{} {}: {:.1f} -> {:.1f} ({:+.0f}%)".format(
+                    endpoint, key, old[key], stats[key],
+                    (stats[key] / old[key] - 1) * 100))
+    return regressions
+
+
+def start_server(manage, address):
+    """ Run `manage.py runserver` on `address`, and wait for it to listen. """
+    server = subprocess.Popen([sys.executable, manage, 'runserver', '--noreload', address])
+    host, port = address.rsplit(':', 1)
+    for _ in range(100):
+        try:
+            socket.create_connection((host, int(port)), timeout=1).close()
+            return server
+        except (socket.error, OSError):
+            if server.poll() is not None:
+                raise SystemExit("runserver exited with {}".format(server.returncode))
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit("runserver didn't start listening on {}".format(address))
+
+
+def bench(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('mix', help='JSONL file of requests to replay')
+    parser.add_argument('--url', default='http://127.0.0.1:8000',
+                        help='base URL of the server (default %(default)s)')
+    parser.add_argument('--manage', help='start `manage.py runserver` from this '
+                        'manage.py for the run, on the --url address')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=None,
+                        help='sample this many requests from the mix by weight, '
+                        'rather than replaying it once in order')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-cold', action='store_true',
+                        help='skip the one-at-a-time cold phase')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='compare against results saved earlier')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percent slowdown counted as a regression (default 10)')
+    args = parser.parse_args(argv)
+
+    mix = load_requests(args.mix)
+    if not mix:
+        raise SystemExit("no requests in {}".format(args.mix))
+    base_url = args.url.rstrip('/')
+
+    if args.requests:
+        rng = random.Random(args.seed)
+        replay = []
+        weights = [weight for _, _, weight in mix]
+        total = sum(weights)
+        for _ in range(args.requests):
+            pick = rng.uniform(0, total)
+            for entry, weight in zip(mix, weights):
+                pick -= weight
+                if pick <= 0:
+                    break
+            replay.append(entry)
+    else:
+        replay = mix
+
+    server = None
+    if args.manage:
+        server = start_server(args.manage, base_url.split('://', 1)[-1])
+
+    try:
+        results = {"url": base_url, "concurrency": args.concurrency,
+                   "started": time.time()}
+        if not args.no_cold:
+            distinct = collections.OrderedDict(
+                (json.dumps([path, params], sort_keys=True), (path, params, 1))
+                for path, params, _ in replay)
+            cold, elapsed = run_phase(base_url, list(distinct.values()), 1)
+            results['cold'] = summarize(cold, elapsed)
+            print_summary("Cold ({} distinct requests, one at a time)".format(len(distinct)),
+                          results['cold'])
+
+        warm, elapsed = run_phase(base_url, replay, args.concurrency)
+        results['warm'] = summarize(warm, elapsed)
+        print_summary("Warm ({} requests, {} at a time, {:.1f}s)".format(
+            len(replay), args.concurrency, elapsed), results['warm'])
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        print("")
+        if regressions:
+            print("Regressions against {}:".format(args.compare))
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("No regressions against {}.".format(args.compare))
+
+
+def load_profiles(directory, endpoint=None):
+    """ The profiles saved in `directory`, optionally of one endpoint only. """
+    found = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            profile = json.load(f)
+        if endpoint is None or profile.get('endpoint') == endpoint:
+            found.append(profile)
+    return found
+
+
+def hot_functions(profiles):
+    """
+    Self and total seconds of every function, summed across `profiles`,
+    along with how many of them it's in, as a dict by function.
+    """
+    functions = collections.defaultdict(lambda: {"self": 0.0, "total": 0.0, "profiles": 0})
+    for profile in profiles:
+        for function in profile['functions']:
+            stats = functions[function['function']]
+            stats['self'] += function['self']
+            stats['total'] += function['total']
+            stats['profiles'] += 1
+    return functions
+
+
+def short_function(name):
+    """ Drop the install location from a function's filename. """
+    return re.sub(r'^.*/(site-packages|dist-packages|lib/python[0-9.]+)/', '', name)
+
+
+def profiles(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Add up the hottest functions across saved request profiles.')
+    parser.add_argument('directory', help='the IMAGO_PROFILE_DIR profiles were saved to')
+    parser.add_argument('--endpoint', help='only read profiles of this endpoint, '
+                        'like BillDetail')
+    parser.add_argument('--top', type=int, default=25,
+                        help='how many functions to list (default %(default)s)')
+    parser.add_argument('--sort', choices=('self', 'total'), default='self',
+                        help='sort functions by their own time, or by their time '
+                        'including what they call (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    found = load_profiles(args.directory, args.endpoint)
+    if not found:
+        raise SystemExit("no profiles in {}".format(args.directory))
+
+    by_endpoint = collections.defaultdict(list)
+    for profile in found:
+        by_endpoint[profile['endpoint']].append(profile)
+    print("  {:<24} {:>8} {:>9} {:>8}  {}".format(
+        "endpoint", "profiles", "mean ms", "queries", "mean stage ms"))
+    for endpoint, group in sorted(by_endpoint.items()):
+        stages = collections.OrderedDict()
+        for profile in group:
+            for stage, seconds in sorted(profile.get('stages', {}).items()):
+                stages[stage] = stages.get(stage, 0) + seconds
+        queries = [p['queries'] for p in group if p.get('queries') is not None]
+        print("  {:<24} {:>8} {:>9.1f} {:>8}  {}".format(
+            endpoint, len(group), sum(p['seconds'] for p in group) * 1000 / len(group),
+            '-' if not queries else '{:.1f}'.format(sum(queries) / float(len(queries))),
+            ', '.join('{} {:.1f}'.format(stage, seconds * 1000 / len(group))
+                      for stage, seconds in stages.items())))
+
+    elapsed = sum(profile['seconds'] for profile in found)
+    functions = sorted(hot_functions(found).items(), key=lambda x: -x[1][args.sort])
     print("")
-    print("Total time (s):  %s" % (total_time))
-    print("Per request (s)  %s" % (total_time / count))
+    print("  {:>9} {:>6} {:>9} {:>8}  {}".format(
+        "self s", "self%", "total s", "profiles", "function"))
+    for function, stats in functions[:args.top]:
+        print("  {:>9.3f} {:>5.1f}% {:>9.3f} {:>8}  {}".format(
+            stats['self'], stats['self'] * 100 / elapsed if elapsed else 0,
+            stats['total'], stats['profiles'], short_function(function)))
@@ -0,0 +1,167 @@
+# Copyright (c) Sunlight Foundation, 2014, under the BSD-3 License.
+
+"""
+Compile serialize specs into plain Python functions.
+
+`restless.models.serialize` re-walks the spec and type-checks every value it
+sees, for every object on every request. The specs coming out of
+`imago.helpers.get_fields` never change, so we can instead generate one
+function per spec that reads the attributes directly, and reuse it.
+
+The generated code mirrors what `serialize` would do with the same spec;
+anything it doesn't understand is handed back to `serialize`.
+
+With `native_datetimes`, the output is meant for an encoder that prints
+datetimes like `imago.serialize.dout` (see `imago.encoders`): `dout`
+fields are passed through as they are, and other datetime columns are
+formatted here like DjangoJSONEncoder would, to keep the output the same.
+"""
+
+import keyword
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from restless.models import serialize
+
+
+class UnsupportedSpec(Exception):
+    pass
+
+
+def _dispatch(src, fn):
+    """
+    Runtime fallback for a nested spec whose relation type we couldn't
+    work out ahead of time; the same type checks `serialize` does.
+    """
+    if isinstance(src, models.Manager):
+        return [_dispatch(x, fn) for x in src.all()]
+    elif isinstance(src, (list, set, models.query.QuerySet)):
+        return [_dispatch(x, fn) for x in src]
+    elif isinstance(src, dict):
+        return dict((k, _dispatch(v, fn)) for k, v in src.items())
+    elif isinstance(src, models.Model):
+        return fn(src)
+    return src
+
+
+def _get_field(model, name):
+    if model is None:
+        return None
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+_django_default = DjangoJSONEncoder().default
+
+
+def _django_datetime(value):
+    return None if value is None else _django_default(value)
+
+
+class _Builder(object):
+
+    def __init__(self, native_datetimes=False):
+        self.native_datetimes = native_datetimes
+        self.lines = []
+        self.namespace = {
+            '_dispatch': _dispatch,
+            '_serialize': serialize,
+            '_django_datetime': _django_datetime,
+        }
+        self.memo = {}
+
+    def constant(self, value, prefix):
+        name = '_%s%d' % (prefix, len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def build(self, fields, model):
+        key = (id(fields), model)
+        if key in self.memo:
+            return self.memo[key]
+        name = '_s%d' % (len(self.memo))
+        self.memo[key] = name
+
+        body = []
+        for field in fields:
+            if not isinstance(field, tuple):
+                raise UnsupportedSpec(field)
+            attr, spec = field
+            if attr.isidentifier() and not keyword.iskeyword(attr):
+                value = 'obj.%s' % (attr)
+            else:
+                value = 'getattr(obj, %r)' % (attr)
+            target = 'data[%r]' % (attr)
+
+            if callable(spec) and self.native_datetimes \
+                    and hasattr(spec, 'dout_attr'):
+                body.append('%s = getattr(obj, %r)' % (target, spec.dout_attr))
+            elif callable(spec):
+                body.append('%s = %s(obj)' % (target, self.constant(spec, 'c')))
+            elif not isinstance(spec, dict):
+                raise UnsupportedSpec(field)
+            elif set(spec) != {'fields'}:
+                body.append(self.leaf(target, value, spec, _get_field(model, attr)))
+            else:
+                body.extend(self.nested(target, value, spec['fields'],
+                                        _get_field(model, attr)))
+
+        self.lines.append('def %s(obj):' % (name))
+        self.lines.append('    data = {}')
+        self.lines.extend('    ' + line for line in body)
+        self.lines.append('    return data')
+        self.lines.append('')
+        return name
+
+    def leaf(self, target, value, spec, field):
+        if spec == {} and field is not None and not field.is_relation:
+            if self.native_datetimes and isinstance(
+                    field, (models.DateTimeField, models.TimeField)):
+                return '%s = _django_datetime(%s)' % (target, value)
+            # plain column; `serialize` hands scalars back untouched and
+            # only rebuilds lists / dicts of scalars, which encode the same.
+            return '%s = %s' % (target, value)
+        return '%s = _serialize(%s, **%s)' % (target, value,
+                                             self.constant(spec, 'spec'))
+
+    def nested(self, target, value, fields, field):
+        if field is None or not field.is_relation:
+            fn = self.build(fields, None)
+            return ['%s = _dispatch(%s, %s)' % (target, value, fn)]
+
+        fn = self.build(fields, field.related_model)
+        if field.many_to_many or field.one_to_many:
+            return ['%s = [%s(x) for x in %s.all()]' % (target, fn, value)]
+        return [
+            'value = %s' % (value),
+            '%s = None if value is None else %s(value)' % (target, fn),
+        ]
+
+
+def compile_serializer(config, model=None, native_datetimes=False):
+    """
+    Return a function taking a single object and returning the same thing
+    as `serialize(obj, **config)`, where `config` is the spec returned by
+    `get_fields`.
+
+    If `model` is passed, relations are resolved against it, so that
+    to-one relations and related managers are accessed without any runtime
+    type checks. See above for `native_datetimes`.
+    """
+    if set(config) != {'fields'}:
+        return lambda obj: serialize(obj, **config)
+
+    builder = _Builder(native_datetimes=native_datetimes)
+    try:
+        name = builder.build(config['fields'], model)
+    except UnsupportedSpec:
+        return lambda obj: serialize(obj, **config)
+
+    source = '\n'.join(builder.lines)
+    exec(compile(source, '<imago serializer>', 'exec'), builder.namespace)
+    fn = builder.namespace[name]
+    fn.source = source
+    return fn
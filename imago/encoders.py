@@ -0,0 +1,149 @@
+"""
+JSON encoding for API responses.
+
+By default responses are encoded like restless' `Http200` does, with
+`json.dumps` and Django's encoder. The `IMAGO_JSON_ENCODER` setting picks another path:
+
+     - json    | The default, as above.
+     - orjson  | Encode with orjson, which handles datetimes, dates and
+               | UUIDs natively. Compiled serializers then skip `dout`,
+               | since orjson prints UTC datetimes the same way, and
+               | pre-format the other datetime columns the way Django's
+               | encoder does, so the output doesn't change.
+     - compare | Send the same bytes as `json`, but also serialize each
+               | object the way `orjson` would, encode it with orjson, and
+               | log a warning for any that isn't the same, bar whitespace
+               | and escaping (see `compare`). This is for checking a
+               | deployment before switching it to `orjson`.
+
+Without orjson installed, both `orjson` and `compare` act like `json`.
+Both need compiled serializers (`IMAGO_COMPILE_SERIALIZERS`), which are
+what format datetimes to match.
+
+With any of them, `RawJSON` values are put into the output as they are, so JSON
+we've stored pre-encoded, like boundary shapes, isn't decoded and encoded
+again on every request.
+"""
+
+import json
+import logging
+import re
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'application/json; charset=utf-8'
+
+# orjson `default` hook, encoding what orjson doesn't know (Decimal, lazy
+# strings, timedelta...) the way DjangoJSONEncoder would.
+django_default = DjangoJSONEncoder().default
+
+
+class RawJSON(object):
+    """ Already encoded JSON, to be output as it is. """
+
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        self.content = content
+
+
+class Splicer(object):
+    """
+    A `default` hook that encodes each `RawJSON` as a placeholder string,
+    and `splice`, which swaps the placeholders in the output for the JSON.
+    Placeholders start with a NUL, which both encoders escape, and a random
+    nonce, so they can't clash with real strings.
+    """
+
+    def __init__(self):
+        self.fragments = []
+        self.nonce = None
+
+    def default(self, obj):
+        if not isinstance(obj, RawJSON):
+            return django_default(obj)
+        if self.nonce is None:
+            self.nonce = uuid.uuid4().hex
+        self.fragments.append(obj.content)
+        return '\x00%s:%d' % (self.nonce, len(self.fragments) - 1)
+
+    def splice(self, content):
+        if not self.fragments:
+            return content
+        pattern = re.compile(('"\\\\u0000%s:(\\d+)"' % (self.nonce)).encode('ascii'))
+        return pattern.sub(lambda m: self.fragments[int(m.group(1))], content)
+
+
+def encoder_name():
+    name = getattr(settings, 'IMAGO_JSON_ENCODER', 'json')
+    if name not in ('json', 'orjson', 'compare'):
+        raise ValueError("Unknown IMAGO_JSON_ENCODER: %s" % (name))
+    if orjson is None:
+        return 'json'
+    if name != 'json' and not getattr(settings, 'IMAGO_COMPILE_SERIALIZERS', True):
+        raise ImproperlyConfigured("IMAGO_JSON_ENCODER = %r needs "
+                                   "IMAGO_COMPILE_SERIALIZERS" % (name))
+    return name
+
+
+def native_datetimes():
+    """
+    Whether the encoder formats datetimes itself, the way `dout` does.
+    """
+    return encoder_name() == 'orjson'
+
+
+def dumps(data, encoder=None):
+    """
+    Encode `data` with `encoder`, by default the configured one, returning
+    bytes.
+    """
+    splicer = Splicer()
+    if (encoder or encoder_name()) == 'orjson':
+        content = orjson.dumps(data, default=splicer.default,
+                               option=orjson.OPT_NAIVE_UTC)
+    else:
+        content = json.dumps(data, cls=DjangoJSONEncoder,
+                             default=splicer.default).encode('utf-8')
+    return splicer.splice(content)
+
+
+def compare(data, native):
+    """
+    Check that the `orjson` setting would send the same bytes as `json`,
+    apart from whitespace and escaping: `native`, an object as serialized
+    for orjson, encoded the way `dumps` does with orjson, against `data`,
+    the same object as serialized for json, encoded by the stock encoder
+    with orjson's compact separators and without escaping non-ASCII.
+    """
+    splicer = Splicer()
+    expected = splicer.splice(json.dumps(
+        data, cls=DjangoJSONEncoder, default=splicer.default,
+        separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    fast = dumps(native, 'orjson')
+    if fast != expected:
+        log.warning("orjson output differs from json: %r != %r", fast, expected)
+        return False
+    return True
+
+
+def json_response(data):
+    """
+    A 200 response with `data` as the JSON body, encoded according to
+    `IMAGO_JSON_ENCODER`.
+    """
+    return HttpResponse(dumps(data), content_type=CONTENT_TYPE)
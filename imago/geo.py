@@ -0,0 +1,326 @@
+"""
+In-process answers to "which divisions contain this point?"
+
+The lat/lon filters on /divisions/ and /people/ otherwise turn into a PostGIS
+join through DivisionGeometry -> Boundary -> BoundarySet on every request.
+
+Lookups can be cached by coordinates rounded to `IMAGO_GEO_CACHE_PRECISION`
+decimal places. Since nearby points share an entry, what we cache for a
+cell is the set of divisions whose boundaries contain the whole cell, plus
+the few boundaries that cross it; only the latter need checking against
+the exact point, so results are exact.
+
+When `IMAGO_SPATIAL_INDEX` is on, each process also keeps every mapped
+boundary in memory as a prepared GEOS geometry, bucketed into a grid of
+`IMAGO_SPATIAL_INDEX_CELL_SIZE` degree cells, and answers point lookups
+from that instead of PostGIS. The cache is only on by default then: a
+miss without the index takes two PostGIS queries, and sometimes a third for
+the edges, where the uncached lookup takes one.
+
+`loadmappings` calls `invalidate()` when it's done, which bumps a version
+stamp in the `IMAGO_GEO_CACHE_BACKEND` Django cache; processes check it
+every `IMAGO_GEO_VERSION_CHECK_INTERVAL` seconds and reload when it changed.
+For that to reach every worker, that cache must be shared between them.
+"""
+
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.gis.geos import Point, Polygon
+from django.core.cache import caches
+from django.db.models import Q
+
+from .cache import LRUCache
+from .models import DivisionGeometry
+
+
+VERSION_KEY = 'imago:geo:version'
+
+
+def _cache():
+    return caches[getattr(settings, 'IMAGO_GEO_CACHE_BACKEND', 'default')]
+
+
+def current_version():
+    return _cache().get(VERSION_KEY)
+
+
+def invalidate():
+    """
+    Mark every process' in-memory geo data as stale. Call this after the
+    division-boundary mappings change.
+    """
+    _cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+    _state.reset()
+
+
+def in_date_range(start_date, end_date, date):
+    return ((start_date is None or start_date <= date) and
+            (end_date is None or end_date >= date))
+
+
+class IndexedBoundary(object):
+    __slots__ = ('division_id', 'boundary_id', 'shape', 'prepared',
+                 'extent', 'start_date', 'end_date')
+
+    def __init__(self, division_id, boundary_id, shape, start_date, end_date):
+        self.division_id = division_id
+        self.boundary_id = boundary_id
+        self.shape = shape
+        self.prepared = shape.prepared
+        self.extent = shape.extent
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def covers(self, x, y):
+        xmin, ymin, xmax, ymax = self.extent
+        return xmin <= x <= xmax and ymin <= y <= ymax
+
+
+class SpatialIndex(object):
+    """
+    A uniform grid of boundaries, keyed by cell. Each boundary is listed
+    in every cell its extent overlaps, so a point only has to be tested
+    against the few boundaries near it.
+    """
+
+    def __init__(self, cell_size=0.5, version=None):
+        self.cell_size = cell_size
+        self.version = version
+        self.cells = {}
+        self.size = 0
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)),
+                int(math.floor(y / self.cell_size)))
+
+    def add(self, boundary):
+        xmin, ymin, xmax, ymax = boundary.extent
+        x0, y0 = self.cell(xmin, ymin)
+        x1, y1 = self.cell(xmax, ymax)
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self.cells.setdefault((x, y), []).append(boundary)
+        self.size += 1
+
+    def candidates(self, x, y):
+        return [b for b in self.cells.get(self.cell(x, y), ())
+                if b.covers(x, y)]
+
+    def boundaries_in(self, xmin, ymin, xmax, ymax, date=None):
+        """ Boundaries whose extents overlap the box, in effect on `date`. """
+        x0, y0 = self.cell(xmin, ymin)
+        x1, y1 = self.cell(xmax, ymax)
+        found = {}
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                for b in self.cells.get((x, y), ()):
+                    bxmin, bymin, bxmax, bymax = b.extent
+                    if (bxmin <= xmax and xmin <= bxmax and
+                            bymin <= ymax and ymin <= bymax and
+                            (date is None or
+                             in_date_range(b.start_date, b.end_date, date))):
+                        found[id(b)] = b
+        return list(found.values())
+
+    def boundaries_at(self, lat, lon, date=None):
+        point = Point(lon, lat, srid=4326)
+        return [b for b in self.candidates(lon, lat)
+                if (date is None or in_date_range(b.start_date, b.end_date, date))
+                and b.prepared.contains(point)]
+
+    def division_ids_at(self, lat, lon, date=None):
+        return {b.division_id for b in self.boundaries_at(lat, lon, date)}
+
+    @classmethod
+    def load(cls, cell_size=0.5, version=None):
+        index = cls(cell_size=cell_size, version=version)
+        rows = DivisionGeometry.objects.values_list(
+            'division_id', 'boundary_id', 'boundary__shape',
+            'boundary__set__start_date', 'boundary__set__end_date',
+        )
+        for division_id, boundary_id, shape, start_date, end_date in rows.iterator():
+            index.add(IndexedBoundary(division_id, boundary_id, shape,
+                                      start_date, end_date))
+        return index
+
+
+class CellEntry(object):
+    """
+    What we know about one cell of the lookup cache: the ids of divisions
+    with a boundary properly containing the whole cell, and the
+    (division id, boundary) pairs whose boundaries cross the cell. The
+    boundary is an `IndexedBoundary` if the spatial index is on, and a
+    boundary id otherwise.
+    """
+    __slots__ = ('inside', 'edges')
+
+    def __init__(self, inside, edges):
+        self.inside = frozenset(inside)
+        self.edges = tuple(edges)
+
+    @classmethod
+    def from_index(cls, index, box, date=None):
+        inside, edges = set(), []
+        for b in index.boundaries_in(*box.extent, date=date):
+            if b.prepared.contains_properly(box):
+                inside.add(b.division_id)
+            elif b.prepared.intersects(box):
+                edges.append((b.division_id, b))
+        return cls(inside, edges)
+
+    @classmethod
+    def from_database(cls, box, date=None):
+        mappings = DivisionGeometry.objects.all()
+        if date is not None:
+            mappings = mappings.filter(
+                Q(boundary__set__start_date__lte=date) | Q(boundary__set__start_date=None),
+                Q(boundary__set__end_date__gte=date) | Q(boundary__set__end_date=None),
+            )
+        inside = set(mappings.filter(boundary__shape__contains_properly=box)
+                     .values_list('division_id', flat=True))
+        edges = [(division_id, boundary_id) for division_id, boundary_id in
+                 mappings.filter(boundary__shape__intersects=box)
+                 .values_list('division_id', 'boundary_id')
+                 if division_id not in inside]
+        return cls(inside, edges)
+
+    def division_ids_at(self, point):
+        found = set(self.inside)
+        edges = [(d, b) for d, b in self.edges if d not in found]
+        if not edges:
+            return found
+
+        _state.edge_checks += 1
+        if isinstance(edges[0][1], IndexedBoundary):
+            found.update(d for d, b in edges if b.prepared.contains(point))
+        else:
+            _state.edge_queries += 1
+            found.update(DivisionGeometry.objects.filter(
+                boundary_id__in=[b for d, b in edges],
+                boundary__shape__contains=point,
+            ).values_list('division_id', flat=True))
+        return found
+
+
+class _State(object):
+    """
+    The per-process index and lookup cache, and when we last checked they
+    were current.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cells = LRUCache(getattr(settings, 'IMAGO_GEO_CACHE_SIZE', 100000))
+        self.reset()
+
+    def reset(self):
+        self.index = None
+        self.version = None
+        self.checked_at = 0
+        self.edge_checks = 0
+        self.edge_queries = 0
+        self.cells.clear()
+
+    def refresh(self):
+        interval = getattr(settings, 'IMAGO_GEO_VERSION_CHECK_INTERVAL', 60)
+        now = time.time()
+        if now - self.checked_at < interval:
+            return
+
+        with self.lock:
+            version = current_version()
+            if version != self.version:
+                self.reset()
+                self.version = version
+            self.checked_at = now
+
+    def get_index(self):
+        self.refresh()
+        if self.index is None:
+            with self.lock:
+                if self.index is None:
+                    self.index = SpatialIndex.load(
+                        cell_size=getattr(settings, 'IMAGO_SPATIAL_INDEX_CELL_SIZE', 0.5),
+                        version=self.version,
+                    )
+        return self.index
+
+
+_state = _State()
+
+
+def get_spatial_index():
+    """
+    Return this process' spatial index, loading it if it's missing or
+    stale, or None if `IMAGO_SPATIAL_INDEX` is off.
+    """
+    if not getattr(settings, 'IMAGO_SPATIAL_INDEX', False):
+        return None
+    return _state.get_index()
+
+
+def cache_precision():
+    """
+    The `IMAGO_GEO_CACHE_PRECISION` setting, which defaults to 3 with the
+    spatial index and to None, no cache, without it.
+    """
+    default = 3 if getattr(settings, 'IMAGO_SPATIAL_INDEX', False) else None
+    return getattr(settings, 'IMAGO_GEO_CACHE_PRECISION', default)
+
+
+def cell_box(lat, lon, precision):
+    """
+    The cell of the lookup cache holding a point: its key coordinates,
+    and the box (as a Polygon) every point rounding to them falls in.
+    """
+    lat, lon = round(lat, precision), round(lon, precision)
+    half = 0.5 * 10 ** -precision
+    return (lat, lon), Polygon.from_bbox((lon - half, lat - half,
+                                          lon + half, lat + half))
+
+
+def division_ids_at(lat, lon, date=None):
+    """
+    Return the set of ids of divisions whose boundaries contain the point,
+    restricted to boundary sets in effect on `date` if it's given. Returns
+    None if there's no in-process way to answer, in which case callers
+    should fall back to a PostGIS query.
+    """
+    index = get_spatial_index()
+    precision = cache_precision()
+    if precision is None:
+        if index is None:
+            return None
+        return index.division_ids_at(lat, lon, date)
+
+    _state.refresh()
+    (clat, clon), box = cell_box(lat, lon, precision)
+    key = (clat, clon, date)
+    entry = _state.cells.get(key)
+    if entry is None:
+        box.srid = 4326
+        if index is not None:
+            entry = CellEntry.from_index(index, box, date)
+        else:
+            entry = CellEntry.from_database(box, date)
+        _state.cells.set(key, entry)
+    return entry.division_ids_at(Point(lon, lat, srid=4326))
+
+
+def stats():
+    """
+    Hit rates for the lookup cache: `edge_checks` is how many lookups
+    needed an exact point test, and `edge_queries` how many of those went
+    to PostGIS.
+    """
+    ret = _state.cells.stats()
+    ret.update({
+        "edge_checks": _state.edge_checks,
+        "edge_queries": _state.edge_queries,
+        "spatial_index": _state.index.size if _state.index is not None else None,
+    })
+    return ret
@@ -3,17 +3,41 @@
 #    - Paul R. Tagliamonte <paultag@sunlightfoundation.com>
 
 
-from django.core.paginator import Paginator, EmptyPage
-from django.core.exceptions import FieldError, ObjectDoesNotExist
+from django.core.paginator import EmptyPage
+from django.core.cache import caches
+from django.core.exceptions import (FieldError, FieldDoesNotExist,
+                                    ImproperlyConfigured, ObjectDoesNotExist)
 from restless.modelviews import ListEndpoint, DetailEndpoint
 from restless.models import serialize
-from restless.http import HttpError, Http200
-from collections import defaultdict
+from restless.http import Http200, Http500, HttpError
+from restless.views import Endpoint
+from collections import defaultdict, OrderedDict
 from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils import timezone
 from django.db import connections
-
+from django.db.models import Model, Q, prefetch_related_objects
+from django.db.models.sql.datastructures import EmptyResultSet
+from .cache import LRUCache, response_cache
+from .codegen import compile_serializer
+from .plan import QueryPlan
+from .models import Tombstone, TombstoneHorizon
+from . import changes, encoders, metrics, parallel, profiling
+
+import base64
+import binascii
+import calendar
 import datetime
+import decimal
+import hashlib
+import json
 import math
+import traceback
+import uuid
 
 
 def get_field_list(model, without=None):
@@ -106,6 +130,195 @@ def get_fields(root, fields):
     return (prefetch, fwrap(ret))
 
 
+def normalize_fields(fields):
+    """
+    Turn a list of requested fields into a hashable key. Duplicates are
+    dropped, but order is kept, since it decides the key order of the
+    serialized output.
+    """
+    return tuple(OrderedDict.fromkeys(fields))
+
+
+field_spec_cache = LRUCache(getattr(settings, 'IMAGO_FIELD_CACHE_SIZE', 512))
+serializer_cache = LRUCache(getattr(settings, 'IMAGO_FIELD_CACHE_SIZE', 512))
+
+
+class FieldSpecMixin(object):
+
+    def resolve_fields(self, fields):
+        """
+        Memoized `get_fields` for this endpoint's `serialize_config`,
+        returning the `QueryPlan` for loading the related objects the spec
+        touches, along with the spec itself.
+
+        The result is cached by (endpoint class, normalized fields), so the
+        default field sets are only ever resolved once per process.
+        """
+        key = (type(self), normalize_fields(fields))
+        spec = field_spec_cache.get(key)
+        if spec is None:
+            _, config = get_fields(self.serialize_config, fields=key[1])
+            spec = (QueryPlan(self.model, config), config)
+            field_spec_cache.set(key, spec)
+        return spec
+
+    def load(self, plan, objects):
+        """
+        Load whatever else the objects about to be serialized need, after
+        they've been fetched with `plan`; by default, the plan's batch
+        loaders.
+        """
+        plan.load(objects)
+
+    def get_serializer(self, fields, config):
+        """
+        Return a function serializing one object with `config`, the spec
+        `resolve_fields` returned for `fields`.
+
+        Unless `IMAGO_COMPILE_SERIALIZERS` is off, this is a function
+        generated by `imago.codegen` once per endpoint and field list. In
+        the `compare` encoder mode, it also checks each object against the
+        serializer the `orjson` mode would use.
+        """
+        if encoders.encoder_name() == 'compare':
+            serializer = self.compiled_serializer(fields, config, False)
+            native = self.compiled_serializer(fields, config, True)
+
+            def compared(obj):
+                data = serializer(obj)
+                encoders.compare(data, native(obj))
+                return data
+            return compared
+
+        if not getattr(settings, 'IMAGO_COMPILE_SERIALIZERS', True):
+            return lambda obj: serialize(obj, **config)
+        return self.compiled_serializer(fields, config, encoders.native_datetimes())
+
+    def compiled_serializer(self, fields, config, native_datetimes):
+        key = (type(self), normalize_fields(fields), native_datetimes)
+        serializer = serializer_cache.get(key)
+        if serializer is None:
+            serializer = compile_serializer(config, model=self.model,
+                                            native_datetimes=native_datetimes)
+            serializer_cache.set(key, serializer)
+        return serializer
+
+
+def hash_params(params):
+    """
+    Stable digest of a dict of request parameters, for use in cache keys.
+    """
+    payload = json.dumps(sorted(params.items()), separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_count(data):
+    """
+    Return the Postgres planner's estimate of how many rows the query set
+    would return, or None if the database isn't Postgres.
+    """
+    connection = connections[data.db]
+    if connection.vendor != 'postgresql':
+        return None
+    try:
+        sql, params = data.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _cursor_default(obj):
+    # unlike DjangoJSONEncoder, keep full precision, since cursor values
+    # are compared for equality against the database.
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    raise TypeError(repr(obj))
+
+
+def encode_cursor(keys, values):
+    """
+    Pack the sort keys and the last row's values for them into an opaque,
+    URL-safe cursor string.
+    """
+    payload = json.dumps([keys, values], default=_cursor_default,
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverse `encode_cursor`, returning the (keys, values) pair.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        keys, values = json.loads(payload.decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        raise HttpError(400, "Error: Invalid cursor.")
+    if not isinstance(keys, list) or not isinstance(values, list) \
+            or len(keys) != len(values):
+        raise HttpError(400, "Error: Invalid cursor.")
+    return keys, values
+
+
+def _sort_value(obj, key):
+    for attr in key.lstrip('-').split('__'):
+        obj = getattr(obj, attr)
+        if obj is None:
+            break
+    if isinstance(obj, Model):
+        return obj.pk
+    return obj
+
+
+def _nullable(model, key):
+    name = key.lstrip('-')
+    if name == 'pk':
+        return False
+    if '__' in name:
+        return True
+    try:
+        return model._meta.get_field(name).null
+    except FieldDoesNotExist:
+        return True
+
+
+def seek_filter(model, keys, values):
+    """
+    Build the Q object matching every row that sorts after `values` when
+    ordering by `keys` (Django `order_by` syntax).
+
+    This follows the Postgres defaults of NULLs sorting last ascending, and
+    first descending. The last key must be unique for this to be stable.
+    """
+    query = None
+    for key, value in reversed(list(zip(keys, values))):
+        descending = key.startswith('-')
+        name = key.lstrip('-')
+        if value is None:
+            equal = Q(**{name + '__isnull': True})
+            after = Q(**{name + '__isnull': False}) if descending else None
+        else:
+            equal = Q(**{name: value})
+            after = Q(**{name + ('__lt' if descending else '__gt'): value})
+            if not descending and _nullable(model, key):
+                after |= Q(**{name + '__isnull': True})
+
+        if query is None:
+            query = after if after is not None else Q(pk__in=[])
+        elif after is None:
+            query = equal & query
+        else:
+            query = after | (equal & query)
+    return query
+
+
 def cachebusterable(fn):
     """
     Allow front-end tools to pass a "_" pararm with different arguments
@@ -123,6 +336,72 @@ def cachebusterable(fn):
     return _
 
 
+def cached_response(fn):
+    """
+    Serve repeated requests from the rendered response cache, for
+    endpoints with a cache TTL (see `ResponseCacheMixin`).
+
+    This has to wrap the view inside `authenticated` and `cachebusterable`,
+    so "apikey" and "_" are already out of the params it keys on.
+    """
+    def _(self, request, *args, **kwargs):
+        ttl = self.get_cache_ttl()
+        if not ttl or settings.DEBUG:
+            return fn(self, request, *args, **kwargs)
+
+        key = response_cache.key(type(self).__name__, request.path, request.params)
+        entry = response_cache.get(key)
+        if entry is not None:
+            last_modified = None
+            if entry['last_modified'] is not None:
+                last_modified = datetime.datetime.fromtimestamp(
+                    entry['last_modified'], timezone.utc)
+            response = self.not_modified(request, entry['etag'], last_modified)
+            if response is None:
+                response = HttpResponse(entry['content'],
+                                        content_type=entry['content_type'])
+                self.set_validators(response, entry['etag'], last_modified)
+                response['Access-Control-Allow-Origin'] = "*"
+            return response
+
+        response = fn(self, request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            response_cache.set(key, {
+                "content": response.content,
+                "content_type": response['Content-Type'],
+                "etag": response.get('ETag'),
+                "last_modified": parse_http_date_safe(response.get('Last-Modified', '')),
+            }, ttl)
+        return response
+    return _
+
+
+def profiled(fn):
+    """
+    Profile a sample of requests, and slow ones, see `imago.profiling`.
+
+    This goes inside `authenticated` and `cachebusterable`, so "apikey"
+    and "_" aren't in the params saved with the profile.
+    """
+    def _(self, request, *args, **kwargs):
+        profile = profiling.start()
+        if profile is None:
+            return fn(self, request, *args, **kwargs)
+
+        # the view pops them
+        params = dict(request.params)
+        try:
+            response = fn(self, request, *args, **kwargs)
+        finally:
+            profile.stop()
+        fields = self.default_fields
+        if 'fields' in params:
+            fields = params['fields'].split(",")
+        profile.save(type(self).__name__, request.path, params, fields, timer=self.timer)
+        return response
+    return _
+
+
 def no_authentication_or_is_authenticated(request):
     return (not hasattr(settings, 'USE_LOCKSMITH') or not settings.USE_LOCKSMITH
             or hasattr(request, 'apikey') and request.apikey.status == 'A')
@@ -177,7 +456,171 @@ class DebugMixin(object):
             }
 
 
-class PublicListEndpoint(ListEndpoint, DebugMixin):
+class MetricsMixin(object):
+    """
+    Time every request and count its queries, for the `Server-Timing`
+    header and the histograms in `imago.metrics`. Views mark out the
+    stages of a request with `with self.stage(name):`.
+    """
+
+    timer = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not metrics.enabled():
+            return super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+
+        self.timer = metrics.RequestTimer()
+        with self.timer.recording():
+            response = super(MetricsMixin, self).dispatch(request, *args, **kwargs)
+        self.timer.finish()
+        # for a streaming response, this is the time to its first byte
+        response['Server-Timing'] = self.timer.server_timing()
+        if response.streaming:
+            response.streaming_content = self.recorded(response.streaming_content)
+        else:
+            metrics.record(type(self).__name__, self.timer)
+        return response
+
+    def recorded(self, content):
+        """
+        Stream `content`, counting the queries made while it's read, and
+        add the request to the histograms once it's all been sent.
+        """
+        try:
+            with self.timer.recording(), self.stage('stream'):
+                for chunk in content:
+                    yield chunk
+        finally:
+            self.timer.finish()
+            metrics.record(type(self).__name__, self.timer)
+
+    def stage(self, name):
+        if self.timer is None:
+            return metrics.nothing()
+        return self.timer.stage(name)
+
+
+class StreamingMixin(object):
+    """
+    restless' `Endpoint.dispatch`, except that a `StreamingHttpResponse`
+    passes through as it is. restless JSON-encodes whatever a view returns
+    that isn't an `HttpResponse`, and a streaming response isn't one.
+
+    This has to come before restless' endpoint classes in the bases.
+    """
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        request.content_type = request.META.get('CONTENT_TYPE', 'text/plain')
+        request.params = dict((k, v) for (k, v) in request.GET.items())
+        request.data = None
+        request.raw_data = request.body
+
+        try:
+            self._parse_body(request)
+            authentication_required = self._process_authenticate(request)
+            if authentication_required:
+                return authentication_required
+
+            # Django's dispatch, past restless'
+            response = super(Endpoint, self).dispatch(request, *args, **kwargs)
+        except HttpError as err:
+            response = err.response
+        except Exception as ex:
+            if settings.DEBUG:
+                response = Http500(str(ex), traceback=traceback.format_exc())
+            else:
+                raise
+
+        if not isinstance(response, HttpResponseBase):
+            response = Http200(response)
+        return response
+
+
+class ResponseCacheMixin(object):
+    """
+    Opt an endpoint into the rendered response cache, for `cache_ttl`
+    seconds, or per the IMAGO_RESPONSE_CACHE_TTLS setting, which maps view
+    class names to TTLs.
+    """
+
+    cache_ttl = None
+
+    def get_cache_ttl(self):
+        ttls = getattr(settings, 'IMAGO_RESPONSE_CACHE_TTLS', {})
+        return ttls.get(type(self).__name__, self.cache_ttl)
+
+
+class ConditionalMixin(object):
+    """
+    HTTP conditional request support, for endpoints whose model has an
+    `updated_at` column: responses carry an ETag (and for details, a
+    Last-Modified) derived from it, and requests whose If-None-Match /
+    If-Modified-Since match get a 304 before we prefetch or serialize
+    anything. The validators come from the rows the response is built
+    from, so they cost no queries of their own.
+
+    This trusts `updated_at` to change when the object (or anything we
+    serialize along with it) does.
+    """
+
+    conditional = True
+
+    def supports_conditional(self):
+        if not self.conditional:
+            return False
+        try:
+            self.model._meta.get_field('updated_at')
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def is_conditional(self, request):
+        """ Whether the request has validators we might answer with a 304. """
+        return ('HTTP_IF_NONE_MATCH' in request.META or
+                'HTTP_IF_MODIFIED_SINCE' in request.META)
+
+    def make_etag(self, *parts):
+        payload = ":".join(str(x) for x in (type(self).__name__,) + parts)
+        return 'W/"%s"' % (hashlib.sha1(payload.encode('utf-8')).hexdigest())
+
+    def not_modified(self, request, etag, last_modified):
+        """
+        Return a 304 response if the request's validators still match
+        `etag` / `last_modified`, otherwise None.
+        """
+        if etag is None:
+            return None
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            # weak comparison, see RFC 7232 section 2.3.2
+            tags = {x.strip() for x in if_none_match.split(',')}
+            tags = {x[2:] if x.startswith('W/') else x for x in tags}
+            matched = '*' in tags or etag[2:] in tags
+        else:
+            since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            matched = (since is not None and last_modified is not None and
+                       calendar.timegm(last_modified.utctimetuple()) <= since)
+
+        if not matched:
+            return None
+        response = HttpResponseNotModified()
+        self.set_validators(response, etag, last_modified)
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
+
+    def set_validators(self, response, etag, last_modified):
+        if etag is not None:
+            response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(
+                calendar.timegm(last_modified.utctimetuple()))
+
+
+class PublicListEndpoint(MetricsMixin, StreamingMixin, ListEndpoint,
+                         FieldSpecMixin, ConditionalMixin, ResponseCacheMixin,
+                         DebugMixin):
     """
     Imago public list API helper class.
 
@@ -209,12 +652,25 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
          - filter         | Filter the resulting query set.
          - sort           | Sort the filtered query set
          - paginate       | Paginate the sorted query set
+         - seek           | Paginate by `cursor`, rather than `page`
+         - changes        | Page through the `updated_since` change feed
+         - export         | Stream all results, for `format=ndjson`
 
 
         [ Object Properties ]
          - model            | Django ORM Model / class to query using.
          - per_page         | Objects to show per-page.
 
+         - count_strategy   | How `total_count` is worked out, see `count`.
+                            | Overridable in the IMAGO_COUNT_STRATEGIES
+                            | setting, by view class name.
+
+         - conditional      | Send ETag / Last-Modified, and answer
+                            | conditional requests with a 304.
+
+         - cache_ttl        | Cache rendered responses for this many
+                            | seconds, see `ResponseCacheMixin`.
+
          - default_fields   | If no `fields` param is passed in, use this
                             | to limit the `serialize_config`.
 
@@ -226,6 +682,11 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
     max_per_page = 100
     serialize_config = {}
     default_fields = []
+    count_strategy = 'exact'
+    count_cache_ttl = 300
+    count_estimate_threshold = 100000
+    export_chunk_size = 500
+    applied_filters = None
 
     def adjust_filters(self, params):
         """
@@ -238,9 +699,11 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         Filter the Django query set.
 
         THe kwargs will be unpacked into Django directly, letting you
-        use full Django query syntax here.
+        use full Django query syntax here. They're kept, once adjusted, as
+        `applied_filters`.
         """
         kwargs = self.adjust_filters(kwargs)
+        self.applied_filters = kwargs
         try:
             return data.filter(**kwargs)
         except FieldError:
@@ -255,24 +718,265 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         """
         return data.order_by(*sort_by)
 
-    def paginate(self, data, page, per_page):
+    def get_count_strategy(self):
+        strategies = getattr(settings, 'IMAGO_COUNT_STRATEGIES', {})
+        return strategies.get(type(self).__name__, self.count_strategy)
+
+    def count(self, data, params):
+        """
+        Count the rows in the filtered query set, according to the
+        endpoint's count strategy:
+
+            exact    | COUNT(*) on every request.
+            cached   | COUNT(*), cached for `count_cache_ttl` seconds by the
+                     | filter params, in the IMAGO_COUNT_CACHE Django cache.
+            estimate | The Postgres planner's row estimate, unless it's under
+                     | `count_estimate_threshold`, where we COUNT(*) anyway.
+            none     | Don't count. This returns None.
+        """
+        strategy = self.get_count_strategy()
+        data = data.order_by()
+
+        if strategy == 'exact':
+            return data.count()
+        elif strategy == 'none':
+            return None
+        elif strategy == 'cached':
+            cache = caches[getattr(settings, 'IMAGO_COUNT_CACHE', 'default')]
+            key = 'imago:count:{}:{}'.format(type(self).__name__, hash_params(params))
+            count = cache.get(key)
+            if count is None:
+                count = data.count()
+                cache.set(key, count, self.count_cache_ttl)
+            return count
+        elif strategy == 'estimate':
+            estimate = estimate_count(data)
+            if estimate is not None and estimate >= self.count_estimate_threshold:
+                return estimate
+            return data.count()
+
+        raise ImproperlyConfigured("Unknown count strategy {} for {}".format(
+            strategy, type(self).__name__))
+
+    def paginate(self, data, page, per_page, count=None):
+        """
+        Slice a page out of the sorted Django query set. If `count` is
+        passed, it must be the exact number of rows, and is used to find
+        out of range pages; otherwise one extra row is fetched to tell if
+        there's a next page.
+
+        This returns the objects on the page, and whether there are more
+        pages after it.
+        """
+        if page < 1:
+            raise EmptyPage
+        offset = (page - 1) * per_page
+
+        if count is not None:
+            if page > 1 and offset >= count:
+                raise EmptyPage
+            objects = list(data[offset:offset + per_page])
+            return objects, offset + len(objects) < count
+
+        objects = list(data[offset:offset + per_page + 1])
+        if page > 1 and not objects:
+            raise EmptyPage
+        return objects[:per_page], len(objects) > per_page
+
+    def list_validators(self, query, count, objects, more):
+        """
+        Return the (ETag, Last-Modified) pair for a page of a list: a hash
+        of every request parameter, the count, whether there are more rows
+        after the page, and the id and `updated_at` of each object on it.
+        A row deleted before or on the page changes the ids, and one after
+        it the count.
+
+        Last-Modified is always None here. The newest `updated_at` doesn't
+        move when a row is deleted, so it can't tell a page has changed.
+        """
+        if not self.supports_conditional():
+            return None, None
+        etag = self.make_etag(hash_params(query), count, bool(more), *[
+            '%s@%s' % (obj.pk, obj.updated_at.isoformat()) for obj in objects])
+        return etag, None
+
+    def seek(self, data, sort_by, cursor, per_page):
+        """
+        Keyset-paginate the Django query set. Rather than an OFFSET, this
+        filters on the sort keys (plus `id`, as a tie breaker) of the last
+        row of the previous page, so deep pages cost the same as the first.
+
+        An empty `cursor` starts at the first row. This returns the objects
+        on the page, and the cursor for the next one (None on the last).
+        """
+        keys = list(sort_by)
+        if not {'id', '-id', 'pk', '-pk'} & set(keys):
+            keys.append('id')
+        data = self.sort(data, keys)
+
+        if cursor:
+            cursor_keys, values = decode_cursor(cursor)
+            if cursor_keys != keys:
+                raise HttpError(400, "Error: This cursor was made for a "
+                                "different sort order.")
+            data = data.filter(seek_filter(self.model, keys, values))
+
+        objects = list(data[:per_page + 1])
+        next_cursor = None
+        if len(objects) > per_page:
+            objects = objects[:per_page]
+            next_cursor = encode_cursor(keys, [_sort_value(objects[-1], key)
+                                               for key in keys])
+        return objects, next_cursor
+
+    def supports_changes(self):
+        """ Whether the model has the `updated_at` a change feed needs. """
+        try:
+            self.model._meta.get_field('updated_at')
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def changes(self, data, since, cursor, per_page, filters=None):
+        """
+        Page through the change feed (see `imago.changes`): the rows of
+        the Django query set, and the tombstones of deleted ones matching
+        `filters` (the query set's), ordered by (`updated_at`, `id`) (or
+        `deleted_at` for tombstones) and merged. The feed starts after
+        `cursor`, or at `since` without one. It's a 410 if tombstones from
+        then on may have been pruned, and a 501 if none were ever recorded
+        (`setupchangefeed` hasn't been run).
+
+        This returns the objects on the page, the deleted ids, the cursor
+        for the next page (None on the last) and the cursor for after this
+        page, which a later sync can start from.
+        """
+        keys = ['updated_at', 'id']
+        if cursor:
+            cursor_keys, position = decode_cursor(cursor)
+            if cursor_keys != keys:
+                raise HttpError(400, "Error: This cursor isn't from an "
+                                "`updated_since` feed.")
+        else:
+            # sorts before every id updated at `since`
+            position = [since, '']
+
+        table = self.model._meta.db_table
+        start = position[0]
+        if not isinstance(start, datetime.datetime):
+            start = changes.parse_since(str(start))
+            if start is None:
+                raise HttpError(400, "Error: Invalid cursor.")
+        horizon = TombstoneHorizon.objects.filter(table_name=table).values_list(
+            'complete_since', flat=True).first()
+        if horizon is None:
+            # no trigger has recorded deletes, so any feed would miss them
+            raise HttpError(501, "Error: The change feed isn't set up for this "
+                            "endpoint; run `./manage.py setupchangefeed`.")
+        if start < horizon:
+            raise HttpError(410, "Error: Deletes before {} are no longer recorded. "
+                            "Sync again without `updated_since`, then follow the "
+                            "feed from when that started.".format(horizon.isoformat()))
+
+        tombstones = Tombstone.objects.filter(
+            table_name=table, **changes.tombstone_filters(self.model, filters or {}))
+        cutoff = changes.cutoff()
+        if cutoff is not None:
+            data = data.filter(updated_at__lt=cutoff)
+            tombstones = tombstones.filter(deleted_at__lt=cutoff)
+
+        data = self.sort(data, keys).filter(seek_filter(self.model, keys, position))
+        tombstone_keys = ['deleted_at', 'object_id']
+        tombstones = tombstones.order_by(*tombstone_keys).filter(
+            seek_filter(Tombstone, tombstone_keys, position))
+
+        # each side can fill the page on its own; merge the two
+        merged = sorted([((obj.updated_at, obj.pk), obj)
+                         for obj in data[:per_page + 1]] +
+                        [((tombstone.deleted_at, tombstone.object_id), tombstone)
+                         for tombstone in tombstones[:per_page + 1]],
+                        key=lambda change: change[0])
+
+        next_cursor = None
+        if len(merged) > per_page:
+            merged = merged[:per_page]
+            next_cursor = encode_cursor(keys, list(merged[-1][0]))
+        if merged:
+            sync_cursor = encode_cursor(keys, list(merged[-1][0]))
+        else:
+            sync_cursor = cursor or encode_cursor(keys, position)
+
+        objects = [obj for _, obj in merged if not isinstance(obj, Tombstone)]
+        deleted = [{"id": obj.object_id, "deleted_at": obj.deleted_at}
+                   for _, obj in merged if isinstance(obj, Tombstone)]
+        return objects, deleted, next_cursor, sync_cursor
+
+    def export(self, data, plan, serializer):
         """
-        Paginate the Django response. It will default to
-        `self.per_page` as the `per_page` argument to the built-in
-        Django `Paginator`. This will return `paginator.page` for the
-        page number passed in.
+        Stream every object in the sorted Django query set as newline
+        delimited JSON. Rows are read off a server-side cursor, with the
+        plan's joins, and its prefetches are done `export_chunk_size` rows
+        at a time, so memory use stays flat no matter how many rows match.
         """
-        paginator = Paginator(data, per_page=per_page)
-        return paginator.page(page)
+        data = plan.queryset(data)
+        prefetches = plan.prefetches()
+
+        def chunks():
+            chunk = []
+            for obj in data.iterator():
+                chunk.append(obj)
+                if len(chunk) == self.export_chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        def lines():
+            for chunk in chunks():
+                prefetch_related_objects(chunk, *prefetches)
+                self.load(plan, chunk)
+                for obj in chunk:
+                    yield encoders.dumps(serializer(obj)) + b"\n"
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        response['Access-Control-Allow-Origin'] = "*"
+        return response
 
     @authenticated
     @cachebusterable
+    @profiled
+    @cached_response
     def get(self, request, *args, **kwargs):
         """
         Default 'GET' class-based view.
         """
 
         params = request.params
+        query = dict(params)
+
+        cursor = params.pop('cursor', None)
+        if cursor is not None and 'page' in params:
+            raise HttpError(400, "Error: Pass either `page` or `cursor`, not both.")
+
+        format_ = params.pop('format', 'json')
+        if format_ not in ('json', 'ndjson'):
+            raise HttpError(400, "Error: Unknown format: %s" % (format_))
+        if params.pop('stream', None) and format_ != 'ndjson':
+            raise HttpError(400, "Error: `stream` is only supported with format=ndjson")
+        if format_ == 'ndjson' and cursor is not None:
+            raise HttpError(400, "Error: `cursor` can't be used with format=ndjson")
+
+        since = params.pop('updated_since', None)
+        if since is not None:
+            if not self.supports_changes():
+                raise HttpError(400, "Error: This endpoint has no `updated_since` feed.")
+            if 'page' in params or 'sort' in params or format_ != 'json':
+                raise HttpError(400, "Error: `updated_since` can't be used with "
+                                "`page`, `sort` or `format`.")
+            since = changes.parse_since(since)
+            if since is None:
+                raise HttpError(400, "Error: `updated_since` must be an ISO 8601 "
+                                "date or datetime.")
 
         # default to page 1
         page = int(params.pop('page', 1))
@@ -286,12 +990,14 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         if 'fields' in params:
             fields = params.pop('fields').split(",")
 
-        data = self.get_query_set(request, *args, **kwargs)
-        data = self.filter(data, **params)
-        data = self.sort(data, sort_by)
+        with self.stage('filter'):
+            data = self.get_query_set(request, *args, **kwargs)
+            data = self.filter(data, **params)
+            if cursor is None and since is None:
+                data = self.sort(data, sort_by)
 
         try:
-            related, config = get_fields(self.serialize_config, fields=fields)
+            plan, config = self.resolve_fields(fields)
         except FieldKeyError as e:
             raise HttpError(400, "Error: You've asked for a field ({}) that "
                             "is invalid. Valid fields are: {}".format(
@@ -300,45 +1006,120 @@ class PublicListEndpoint(ListEndpoint, DebugMixin):
         except KeyError as e:
             raise HttpError(400, "Error: Invalid field: %s" % (e))
 
-        data = data.prefetch_related(*related)
-
-        try:
-            data_page = self.paginate(data, page, per_page)
-        except EmptyPage:
-            raise HttpError(404, 'No such page (heh, literally - its out of bounds)')
+        serializer = self.get_serializer(fields, config)
+        if format_ == 'ndjson':
+            return self.export(data, plan, serializer)
 
         self.start_debug()
 
-        count = data_page.paginator.count
-
-        response = {
-            "meta": {
-                "count": len(data_page.object_list),
+        # Without IMAGO_QUERY_WORKERS, the count comes first, and an exact
+        # count lets the page query skip its extra row; with them, it runs
+        # alongside the page query (see imago.parallel).
+        count = None
+        counting = None
+        if cursor is None and since is None:
+            if parallel.enabled():
+                counting = parallel.submit(self.timer, self.count, data, params)
+            else:
+                with self.stage('count'):
+                    count = self.count(data, params)
+
+        # fetching the page, which is all a conditional request may need
+        with self.stage('prefetch'):
+            data = plan.queryset(data, columns=sort_by + ['updated_at'])
+
+            if since is not None:
+                objects, deleted, next_cursor, sync_cursor = self.changes(
+                    data, since, cursor, per_page, self.applied_filters)
+                meta = {
+                    "count": len(objects),
+                    "deleted_count": len(deleted),
+                    "per_page": per_page,
+                    "next_cursor": next_cursor,
+                    "sync_cursor": sync_cursor,
+                }
+            elif cursor is not None:
+                objects, next_cursor = self.seek(data, sort_by, cursor, per_page)
+                has_next = next_cursor is not None
+                meta = {
+                    "count": len(objects),
+                    "per_page": per_page,
+                    "next_cursor": next_cursor,
+                }
+            else:
+                exact = None
+                if self.get_count_strategy() == 'exact':
+                    exact = count
+                try:
+                    objects, has_next = self.paginate(data, page, per_page, count=exact)
+                except EmptyPage:
+                    raise HttpError(404, 'No such page (heh, literally - its out of bounds)')
+
+        # a conditional request waits for the count, to answer with a 304
+        # before the prefetches; otherwise it carries on alongside them
+        if counting is not None and self.is_conditional(request):
+            with self.stage('count'):
+                count = counting.result()
+            counting = None
+        # the feed's validators would have to cover its tombstones too
+        etag = last_modified = None
+        if counting is None and since is None:
+            etag, last_modified = self.list_validators(query, count, objects, has_next)
+            not_modified = self.not_modified(request, etag, last_modified)
+            if not_modified is not None:
+                return not_modified
+
+        # the page's joins are in; now its prefetches and batch loaders
+        with self.stage('prefetch'):
+            parallel.prefetch(self.timer, objects, plan.prefetches())
+            self.load(plan, objects)
+
+        if counting is not None:
+            # whatever's left of it
+            with self.stage('count'):
+                count = counting.result()
+            etag, last_modified = self.list_validators(query, count, objects, has_next)
+
+        if cursor is None and since is None:
+            meta = {
+                "count": len(objects),
                 "page": page,
                 "per_page": per_page,
-                "max_page": math.ceil(count / per_page),
+                "max_page": None if count is None else math.ceil(count / per_page),
                 "total_count": count,
-            }, "results": [
-                serialize(x, **config) for x in data_page.object_list
-            ]
-        }
+                "has_next": has_next,
+            }
+
+        with self.stage('serialize'):
+            response = {
+                "meta": meta,
+                "results": [serializer(x) for x in objects],
+            }
+            if since is not None:
+                response['deleted'] = deleted
 
         if settings.DEBUG:
             response['debug'] = self.get_debug()
             response['debug'].update({
-                "prefetch_fields": list(related),
+                "select_related": plan.select_related,
+                "prefetch_fields": [path for path, _ in plan.prefetch_related],
+                "query_plan": plan.describe(),
+                "field_cache": field_spec_cache.stats(),
                 "page": page,
                 "sort": sort_by,
                 "field": fields,
             })
 
-        response = Http200(response)
+        with self.stage('encode'):
+            response = encoders.json_response(response)
+        self.set_validators(response, etag, last_modified)
 
         response['Access-Control-Allow-Origin'] = "*"
         return response
 
 
-class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
+class PublicDetailEndpoint(MetricsMixin, DetailEndpoint, FieldSpecMixin,
+                           ConditionalMixin, ResponseCacheMixin, DebugMixin):
     """
     Imago public detail view API helper class.
 
@@ -364,12 +1145,31 @@ class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
 
          - serialize_config | Object serializion to use. Many are in
                             | the imago.serialize module
+
+         - conditional      | Send ETag / Last-Modified, and answer
+                            | conditional requests with a 304.
+
+         - cache_ttl        | Cache rendered responses for this many
+                            | seconds, see `ResponseCacheMixin`.
     """
 
     methods = ['GET']
 
+    def detail_validators(self, obj, fields):
+        """
+        Return the (ETag, Last-Modified) pair for `obj`: its `updated_at`
+        and the requested fields. Both are None if we can't tell.
+        """
+        if not self.supports_conditional() or obj.updated_at is None:
+            return None, None
+        etag = self.make_etag(obj.pk, ",".join(normalize_fields(fields)),
+                              obj.updated_at.isoformat())
+        return etag, obj.updated_at
+
     @authenticated
     @cachebusterable
+    @profiled
+    @cached_response
     def get(self, request, pk, *args, **kwargs):
         params = request.params
 
@@ -377,21 +1177,161 @@ class PublicDetailEndpoint(DetailEndpoint, DebugMixin):
         if 'fields' in params:
             fields = params.pop('fields').split(",")
 
-        related, config = get_fields(self.serialize_config, fields=fields)
+        plan, config = self.resolve_fields(fields)
 
         self.start_debug()
 
-        try:
-            obj = self.model.objects.prefetch_related(*related).get(pk=pk)
-        except ObjectDoesNotExist as e:
-            raise HttpError(404, "Error: {}".format(e))
-        except Exception:
-            raise HttpError(500, "Error: Something went wrong with your request")
-
-        serialized = serialize(obj, **config)
+        # as in the list view, a conditional request can be answered once
+        # the object itself is loaded, before its prefetches
+        with self.stage('prefetch'):
+            try:
+                obj = plan.queryset(self.model.objects, columns=['updated_at']).get(pk=pk)
+            except ObjectDoesNotExist as e:
+                raise HttpError(404, "Error: {}".format(e))
+            except Exception:
+                raise HttpError(500, "Error: Something went wrong with your request")
+
+        etag, last_modified = self.detail_validators(obj, fields)
+        not_modified = self.not_modified(request, etag, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        with self.stage('prefetch'):
+            parallel.prefetch(self.timer, [obj], plan.prefetches())
+            self.load(plan, [obj])
+
+        with self.stage('serialize'):
+            serialized = self.get_serializer(fields, config)(obj)
         serialized['debug'] = self.get_debug()
 
-        response = Http200(serialized)
+        with self.stage('encode'):
+            response = encoders.json_response(serialized)
+        self.set_validators(response, etag, last_modified)
+        response['Access-Control-Allow-Origin'] = "*"
+
+        return response
+
+
+class PublicBatchEndpoint(MetricsMixin, Endpoint, DebugMixin):
+    """
+    Imago public batch detail view API helper class: many objects of one
+    type, as their detail views would show them, in one request.
+
+    The ids are passed as a comma separated `ids` param, or POSTed, either
+    as a JSON list, as a JSON object with an `ids` list, or as a url-encoded
+    form with an `ids` field. `fields` works as it does on the detail views.
+
+    The objects are fetched with a single `pk__in` query, and share one
+    prefetch for each relation. The response maps each requested id to
+    its object, or to null if there's no such object.
+
+    The 'get' class-based view method uses the following object properties:
+
+         - details          | Map of id types, like "ocd-person", to the
+                            | detail view whose fields and serialization
+                            | to use for them.
+
+         - max_ids          | The most ids a request may ask for; the
+                            | IMAGO_BATCH_MAX_IDS setting by default.
+    """
+
+    methods = ['GET', 'POST']
+    details = {}
+    max_ids = None
+    # for `profiled`; each type uses its detail view's default fields
+    default_fields = ()
+
+    def get_max_ids(self):
+        if self.max_ids is not None:
+            return self.max_ids
+        return getattr(settings, 'IMAGO_BATCH_MAX_IDS', 100)
+
+    def get_ids(self, request):
+        """ The requested ids, in order, without duplicates. """
+        ids = request.params.pop('ids', None)
+        data = request.data
+        if isinstance(data, dict):
+            fields = data.get('fields')
+            if isinstance(fields, list):
+                fields = ",".join(fields)
+            if fields and 'fields' not in request.params:
+                request.params['fields'] = fields
+            data = data.get('ids')
+        if data:
+            ids = data
+        if isinstance(ids, bytes):
+            ids = ids.decode('utf-8')
+        if isinstance(ids, str):
+            ids = ids.split(",")
+        if not isinstance(ids, list) or not all(isinstance(pk, str) for pk in ids):
+            raise HttpError(400, "Error: pass the ids to fetch as `ids`")
+
+        ids = list(OrderedDict((pk.strip(), None) for pk in ids if pk.strip()))
+        if not ids:
+            raise HttpError(400, "Error: pass the ids to fetch as `ids`")
+        if len(ids) > self.get_max_ids():
+            raise HttpError(400, "Error: at most {} ids per request".format(
+                self.get_max_ids()))
+        return ids
+
+    def get_detail(self, ids):
+        """ The detail view for `ids`, which all have to be of one type. """
+        types = set(pk.split("/", 1)[0] for pk in ids)
+        if len(types) > 1:
+            raise HttpError(400, "Error: ids must all be of one type, got {}".format(
+                ", ".join(sorted(types))))
+        id_type = types.pop()
+        if id_type not in self.details:
+            raise HttpError(400, "Error: can't fetch {} ids, only {}".format(
+                id_type, ", ".join(sorted(self.details))))
+        detail = self.details[id_type]()
+        detail.timer = self.timer
+        return detail
+
+    @authenticated
+    @cachebusterable
+    @profiled
+    def get(self, request, *args, **kwargs):
+        ids = self.get_ids(request)
+        detail = self.get_detail(ids)
+        params = request.params
+
+        fields = detail.default_fields
+        if 'fields' in params:
+            fields = params.pop('fields').split(",")
+
+        plan, config = detail.resolve_fields(fields)
+
+        self.start_debug()
+
+        with self.stage('prefetch'):
+            try:
+                if parallel.enabled():
+                    objects = list(plan.queryset(detail.model.objects).filter(pk__in=ids))
+                    parallel.prefetch(self.timer, objects, plan.prefetches())
+                else:
+                    objects = list(plan.apply(detail.model.objects).filter(pk__in=ids))
+            except Exception:
+                raise HttpError(500, "Error: Something went wrong with your request")
+
+            detail.load(plan, objects)
+
+        with self.stage('serialize'):
+            serializer = detail.get_serializer(fields, config)
+            found = dict((obj.pk, serializer(obj)) for obj in objects)
+            results = OrderedDict((pk, found.get(pk)) for pk in ids)
+
+        with self.stage('encode'):
+            response = encoders.json_response({
+                "meta": {
+                    "count": len(found),
+                    "missing": [pk for pk in ids if pk not in found],
+                },
+                "results": results,
+                "debug": self.get_debug(),
+            })
         response['Access-Control-Allow-Origin'] = "*"
 
         return response
+
+    post = get
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...cache import invalidate_responses, response_cache
+
+
+class Command(BaseCommand):
+    help = 'invalidate cached API responses, e.g. after an import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint',
+            action='append',
+            dest='endpoints',
+            default=[],
+            help='Only invalidate this view, like BillList. May be repeated.')
+
+    def handle(self, *args, **options):
+        if not response_cache.shared():
+            raise CommandError(
+                "The response cache is kept in each server process, which this "
+                "can't reach. Set IMAGO_RESPONSE_CACHE to a shared Django cache, "
+                "like memcached or Redis, or wait for the cached responses to expire.")
+        for endpoint in options['endpoints'] or [None]:
+            invalidate_responses(endpoint)
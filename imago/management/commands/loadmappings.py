@@ -1,27 +1,111 @@
+import io
+import itertools
+import json
+import multiprocessing
+import os
 import re
-from optparse import make_option
-from django.db import transaction
-from django.core.management.base import BaseCommand
+import shutil
+import tempfile
+import time
+from django.db import connections, router, transaction
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from ...models import DivisionGeometry
+from ... import geo, shapes
 from opencivicdata.divisions import Division
-from boundaries.models import BoundarySet
+from boundaries.models import Boundary, BoundarySet
 
 
-def load_mapping(boundary_set_id, key, prefix, boundary_key='external_id', ignore=None, quiet=False):
+def build_index(keys):
+    """
+    Map the values of each of the division properties in `keys` to the
+    division ids having them, walking the country's division tree once.
+    Divisions without a value are mapped from their own id.
+    """
+    index = dict((key, {}) for key in keys)
+    for div in Division.get('ocd-division/country:' + settings.IMAGO_COUNTRY).children(levels=100):
+        for key, geoid_mapping in index.items():
+            if div.attrs[key]:
+                geoid_mapping[div.attrs[key]] = div.id
+            else:
+                geoid_mapping[div.id] = div.id
+    return index
+
+
+# bump when the index file's format changes
+INDEX_VERSION = 1
+
+
+def division_source():
+    """
+    The CSV file the division tree is read from, if it isn't downloaded
+    (see `opencivicdata.divisions`).
+    """
+    path = os.environ.get('OCD_DIVISION_CSV')
+    if path:
+        return path.format(settings.IMAGO_COUNTRY)
+    return None
+
+
+def index_key(keys):
+    """
+    What a stored index must have been built from to be reused: the
+    country, the property keys, and the division CSV's path, mtime and
+    size, if there is one.
+    """
+    source = division_source()
+    stat = None
+    if source:
+        try:
+            stat = os.stat(source)
+        except OSError as e:
+            raise CommandError("can't read OCD_DIVISION_CSV {}: {}".format(
+                source, e.strerror))
+    return [INDEX_VERSION, settings.IMAGO_COUNTRY, sorted(keys), source,
+            stat and stat.st_mtime, stat and stat.st_size]
+
+
+def load_index(keys, rebuild=False):
+    """
+    `build_index`, stored in the `IMAGO_DIVISION_INDEX_FILE` JSON file and
+    reused by later runs while the division CSV is unchanged. A downloaded
+    division list is reused for `IMAGO_DIVISION_INDEX_MAX_AGE` seconds.
+    """
+    path = getattr(settings, 'IMAGO_DIVISION_INDEX_FILE', os.path.join(
+        tempfile.gettempdir(), 'imago-division-index-{}.json'.format(settings.IMAGO_COUNTRY)))
+    max_age = getattr(settings, 'IMAGO_DIVISION_INDEX_MAX_AGE', 24 * 60 * 60)
+    key = index_key(keys)
+
+    if path and not rebuild:
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+            if stored['key'] == key and (key[3] or time.time() - stored['created'] < max_age):
+                print('using division index', path)
+                return stored['index']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+
+    index = build_index(keys)
+    if path:
+        tmp = '{}.{}'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'created': time.time(), 'index': index}, f,
+                      separators=(',', ':'))
+        os.replace(tmp, path)
+    return index
+
+
+def match_mapping(boundary_set_id, geoid_mapping, prefix, boundary_key='external_id',
+                  ignore=None, quiet=False, **kwargs):
+    """
+    Yield the (division id, boundary id) pairs mapping the boundaries of
+    the set to divisions, through `geoid_mapping`, as they're matched.
+    """
     if ignore:
         ignore = re.compile(ignore)
     ignored = 0
-    geoid_mapping = {}
-
-    division_geometries = []
 
-    for div in Division.get('ocd-division/country:' + settings.IMAGO_COUNTRY).children(levels=100):
-        if div.attrs[key]:
-            geoid_mapping[div.attrs[key]] = div.id
-        else:
-            geoid_mapping[div.id] = div.id
-    
     print('processing', boundary_set_id)
 
     boundary_set = BoundarySet.objects.get(pk=boundary_set_id)
@@ -29,27 +113,228 @@ def load_mapping(boundary_set_id, key, prefix, boundary_key='external_id', ignor
         fields = []
     else:
         fields = [boundary_key]
-    for boundary in boundary_set.boundaries.values('id', 'name', *fields):
+    for boundary in boundary_set.boundaries.values('id', 'name', *fields).iterator():
         if callable(boundary_key):
             boundary_property = boundary_key(boundary)
         else:
             boundary_property = boundary[boundary_key]
         ocd_id = geoid_mapping.get(prefix + boundary_property)
         if ocd_id:
-            division_geometries.append(DivisionGeometry(division_id=ocd_id,
-                                                        boundary_id=boundary['id']))
+            yield ocd_id, boundary['id']
         elif not ignore or not ignore.match(boundary['name']):
             if not quiet:
                 print('unmatched external id', boundary['name'], boundary_property)
         else:
             ignored += 1
 
-    DivisionGeometry.objects.bulk_create(division_geometries)
-
     if ignored:
         print('ignored {} unmatched external ids'.format(ignored))
 
 
+def _copy_text(value):
+    # escape a value for COPY's text format
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+_COPY_ESCAPES = {'t': '\t', 'n': '\n', 'r': '\r'}
+
+
+def _copy_value(text):
+    # the reverse of `_copy_text`
+    return re.sub(r'\\(.)', lambda m: _COPY_ESCAPES.get(m.group(1), m.group(1)), text)
+
+
+def _mapping_columns(connection):
+    meta = DivisionGeometry._meta
+    return (connection.ops.quote_name(meta.get_field('division').column),
+            connection.ops.quote_name(meta.get_field('boundary').column))
+
+
+class MappingSpool(object):
+    """
+    (division id, boundary id) pairs, written to a temporary file in COPY's
+    text format as they're added, so they never have to be held in memory
+    all at once. Iterating reads the pairs back.
+
+    A worker process hands the pairs it matched to the parent by writing
+    them to a named file and returning what `attach` needs to read it.
+    """
+
+    def __init__(self, file=None, count=0):
+        self.file = file if file is not None else tempfile.TemporaryFile('w+')
+        self.count = count
+
+    @classmethod
+    def named(cls):
+        """ A spool in a file another process can `attach` by its path. """
+        return cls(tempfile.NamedTemporaryFile('w+', delete=False))
+
+    @classmethod
+    def attach(cls, path, count):
+        """ The spool of `count` pairs in `path`, which is removed. """
+        spool = cls(open(path, 'r+'), count)
+        os.unlink(path)
+        return spool
+
+    def detach(self):
+        """ Close a `named` spool, returning its path and count. """
+        self.file.close()
+        return self.file.name, self.count
+
+    def extend(self, pairs):
+        for division_id, boundary_id in pairs:
+            self.file.write('{}\t{}\n'.format(_copy_text(division_id), _copy_text(boundary_id)))
+            self.count += 1
+
+    def append(self, spool):
+        """ Add the pairs of another spool, and close it. """
+        spool.file.seek(0)
+        self.file.seek(0, os.SEEK_END)
+        shutil.copyfileobj(spool.file, self.file)
+        self.count += spool.count
+        spool.close()
+
+    def batches(self, batch_size):
+        """ Lists of up to `batch_size` of the spooled lines. """
+        self.file.seek(0)
+        while True:
+            lines = list(itertools.islice(self.file, batch_size))
+            if not lines:
+                break
+            yield lines
+
+    def __iter__(self):
+        for lines in self.batches(10000):
+            for line in lines:
+                division_id, boundary_id = line.rstrip('\n').split('\t')
+                yield _copy_value(division_id), int(_copy_value(boundary_id))
+
+    def close(self):
+        self.file.close()
+
+
+def copy_spool(spool, table, connection, batch_size=10000, quiet=False):
+    """
+    Insert the pairs in the `MappingSpool` into the division and boundary
+    columns of `table`, `batch_size` rows at a time, so memory use doesn't
+    grow with the number of rows. On Postgres, each batch is streamed in
+    with `COPY ... FROM STDIN`; elsewhere, it's an `executemany`. Returns
+    how many rows were inserted.
+    """
+    columns = _mapping_columns(connection)
+    if connection.vendor == 'postgresql':
+        sql = 'COPY {} ({}, {}) FROM STDIN'.format(table, *columns)
+    else:
+        sql = 'INSERT INTO {} ({}, {}) VALUES (%s, %s)'.format(table, *columns)
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        for lines in spool.batches(batch_size):
+            if connection.vendor == 'postgresql':
+                cursor.copy_expert(sql, io.StringIO(''.join(lines)))
+            else:
+                cursor.executemany(sql, [(_copy_value(division_id), int(_copy_value(boundary_id)))
+                                         for division_id, boundary_id in
+                                         (line.rstrip('\n').split('\t') for line in lines)])
+            inserted += len(lines)
+            if not quiet:
+                print('inserted {} of {} mappings'.format(inserted, spool.count))
+    return inserted
+
+
+def insert_spool(spool, batch_size=10000, quiet=False):
+    """
+    Insert a DivisionGeometry for each pair in the `MappingSpool`,
+    `batch_size` at a time (see `copy_spool`). Returns how many rows were
+    inserted.
+    """
+    connection = connections[router.db_for_write(DivisionGeometry)]
+    start = time.time()
+    inserted = copy_spool(spool, connection.ops.quote_name(DivisionGeometry._meta.db_table),
+                          connection, batch_size=batch_size, quiet=quiet)
+    _report(inserted, start)
+    return inserted
+
+
+def _report(inserted, start):
+    elapsed = time.time() - start
+    if inserted:
+        print('inserted {} mappings in {:.1f}s ({:.0f} rows/s)'.format(
+            inserted, elapsed, inserted / elapsed if elapsed else float(inserted)))
+
+
+# `save_mapping` compares a set's mappings with the new ones in a
+# temporary table; each %s is the set's id
+CREATE_NEW_MAPPINGS_SQL = ('CREATE TEMPORARY TABLE {new} AS '
+                           'SELECT {division}, {boundary} FROM {table} WHERE 1 = 0')
+DELETE_MAPPINGS_SQL = ('DELETE FROM {table} WHERE {in_set} AND NOT EXISTS ('
+                       'SELECT 1 FROM {new} WHERE {new}.{division} = {table}.{division} '
+                       'AND {new}.{boundary} = {table}.{boundary})')
+INSERT_MAPPINGS_SQL = ('INSERT INTO {table} ({division}, {boundary}) '
+                       'SELECT {division}, {boundary} FROM {new} EXCEPT '
+                       'SELECT {division}, {boundary} FROM {table} WHERE {in_set}')
+
+
+def save_mapping(boundary_set_id, spool, quiet=False):
+    """
+    Make the set's mappings match the pairs in the `MappingSpool`,
+    inserting and deleting only the rows that changed, in one short
+    transaction. The pairs are copied into a temporary table and compared
+    with the existing rows there, rather than in memory. Returns how many
+    rows were added and removed.
+    """
+    connection = connections[router.db_for_write(DivisionGeometry)]
+    qn = connection.ops.quote_name
+    names = dict(zip(('division', 'boundary'), _mapping_columns(connection)),
+                 table=qn(DivisionGeometry._meta.db_table), new=qn('imago_new_mappings'))
+    names['in_set'] = '{} IN (SELECT {} FROM {} WHERE {} = %s)'.format(
+        names['boundary'], qn(Boundary._meta.pk.column), qn(Boundary._meta.db_table),
+        qn(Boundary._meta.get_field('set').column))
+
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_NEW_MAPPINGS_SQL.format(**names))
+            copy_spool(spool, names['new'], connection, quiet=True)
+            cursor.execute(DELETE_MAPPINGS_SQL.format(**names), [boundary_set_id])
+            removed = cursor.rowcount
+            cursor.execute(INSERT_MAPPINGS_SQL.format(**names), [boundary_set_id])
+            added = cursor.rowcount
+            cursor.execute('DROP TABLE {new}'.format(**names))
+    print('{}: {} added, {} removed, {} unchanged'.format(
+        boundary_set_id, added, removed, spool.count - added))
+    return added, removed
+
+
+# set in each worker process by `_init_worker`
+_index = None
+_quiet = False
+
+
+def _init_worker(index, quiet):
+    global _index, _quiet
+    _index = index
+    _quiet = quiet
+
+
+def _match_set(set_id, spool):
+    d = settings.IMAGO_BOUNDARY_MAPPINGS[set_id]
+    spool.extend(match_mapping(set_id, _index[d['key']], quiet=_quiet, **d))
+    return spool
+
+
+def _match_set_to_file(set_id):
+    # in a worker: the pairs go back to the parent through a named file
+    spool = MappingSpool.named()
+    try:
+        _match_set(set_id, spool)
+    except BaseException:
+        spool.close()
+        os.unlink(spool.file.name)
+        raise
+    return (set_id,) + spool.detach()
+
+
 class Command(BaseCommand):
     help = 'load in division-boundary mappings'
 
@@ -59,9 +344,101 @@ class Command(BaseCommand):
             dest='quiet',
             default=False,
             help='Be somewhat quiet.')
+        parser.add_argument('--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Only insert and delete the mappings that changed, one '
+                 'boundary set per transaction, rather than reloading '
+                 'everything in a single transaction.')
+        parser.add_argument('--sets',
+            dest='sets',
+            default=None,
+            help='Only load these boundary sets (comma separated slugs).')
+        parser.add_argument('--rebuild-index',
+            action='store_true',
+            dest='rebuild_index',
+            default=False,
+            help="Rebuild the division index even if it's up to date.")
+        parser.add_argument('--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help='Match boundary sets in this many processes in parallel.')
 
     def handle(self, *args, **options):
-        with transaction.atomic():
-            DivisionGeometry.objects.all().delete()
-            for set_id, d in settings.IMAGO_BOUNDARY_MAPPINGS.items():
-                load_mapping(set_id, quiet=options['quiet'], **d)
+        mappings = settings.IMAGO_BOUNDARY_MAPPINGS
+        set_ids = list(mappings)
+        if options['sets']:
+            set_ids = options['sets'].split(',')
+            unknown = set(set_ids) - set(mappings)
+            if unknown:
+                raise CommandError('not in IMAGO_BOUNDARY_MAPPINGS: {}'.format(
+                    ', '.join(sorted(unknown))))
+
+        # index every key, so runs for other sets can reuse it
+        index = load_index(set(d['key'] for d in mappings.values()),
+                           rebuild=options['rebuild_index'])
+        matches = self.match(set_ids, index, options['workers'], options['quiet'])
+
+        if options['incremental']:
+            changed = False
+            for set_id, spool in matches:
+                try:
+                    added, removed = save_mapping(set_id, spool, quiet=options['quiet'])
+                finally:
+                    spool.close()
+                changed = changed or bool(added or removed)
+            if changed:
+                geo.invalidate()
+            shapes.prune()
+            shapes.refresh(shapes.unencoded(), quiet=options['quiet'])
+            return
+
+        # match everything before taking the lock, spooling the pairs to disk
+        spool = MappingSpool()
+        try:
+            for _, matched in matches:
+                spool.append(matched)
+            with transaction.atomic():
+                if options['sets']:
+                    DivisionGeometry.objects.filter(boundary__set_id__in=set_ids).delete()
+                else:
+                    DivisionGeometry.objects.all().delete()
+                insert_spool(spool, quiet=options['quiet'])
+        finally:
+            spool.close()
+        geo.invalidate()
+        if options['sets']:
+            shapes.prune()
+            shapes.refresh(DivisionGeometry.objects.filter(
+                boundary__set_id__in=set_ids).values_list('boundary_id', flat=True),
+                quiet=options['quiet'])
+        else:
+            shapes.refresh(quiet=options['quiet'])
+
+    def match(self, set_ids, index, workers, quiet):
+        """
+        Yield (set id, `MappingSpool`) for every boundary set, matched in
+        `workers` processes. The division index is handed to each worker
+        once.
+        """
+        if workers <= 1 or len(set_ids) <= 1:
+            _init_worker(index, quiet)
+            for set_id in set_ids:
+                yield set_id, _match_set(set_id, MappingSpool())
+            return
+
+        # connections can't be shared with forked workers
+        for connection in connections.all():
+            connection.close()
+        context = multiprocessing
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        pool = context.Pool(min(workers, len(set_ids)), _init_worker, (index, quiet))
+        try:
+            for set_id, path, count in pool.imap_unordered(_match_set_to_file, set_ids):
+                yield set_id, MappingSpool.attach(path, count)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,101 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ...benchmarks import SyntheticWorld, cases, run_case
+
+
+STEPS = ('resolve', 'plan', 'compile', 'restless', 'compiled', 'encode')
+
+
+def compare(results, baseline, threshold):
+    """
+    Lines describing each step that got more than `threshold` percent
+    slower than in `baseline`.
+    """
+    regressions = []
+    for name, steps in sorted(results.items()):
+        old = baseline.get(name, {})
+        for step in STEPS:
+            if old.get(step) and step in steps and \
+                    steps[step] > old[step] * (1 + threshold / 100.0):
+                regressions.append('{} {}: {:.1f} -> {:.1f} us ({:+.0f}%)'.format(
+                    name, step, old[step] * 1e6, steps[step] * 1e6,
+                    (steps[step] / old[step] - 1) * 100))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'time field resolution and serialization on synthetic objects, without a database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cases',
+            nargs='*',
+            help='Only run these cases, like BillList or PeopleList:worst.')
+        parser.add_argument('--size',
+            type=int,
+            dest='size',
+            default=50,
+            help='How many related objects to build of each kind.')
+        parser.add_argument('--count',
+            type=int,
+            dest='count',
+            default=20,
+            help='How many objects to serialize per page.')
+        parser.add_argument('--repeat',
+            type=int,
+            dest='repeat',
+            default=5,
+            help='How many timing runs to take the best of.')
+        parser.add_argument('--output',
+            dest='output',
+            default=None,
+            help='Save the results to this JSON file.')
+        parser.add_argument('--compare',
+            dest='compare',
+            default=None,
+            help='Compare against results saved earlier with --output.')
+        parser.add_argument('--threshold',
+            type=float,
+            dest='threshold',
+            default=20,
+            help='Percent slowdown counted as a regression.')
+
+    def handle(self, *args, **options):
+        selected = cases()
+        if options['cases']:
+            selected = [case for case in selected if case.name in options['cases']]
+            unknown = set(options['cases']) - set(case.name for case in selected)
+            if unknown:
+                raise CommandError('unknown cases: {}'.format(', '.join(sorted(unknown))))
+
+        world = SyntheticWorld(size=options['size'])
+        results = {}
+        self.stdout.write('{:<28} {:>5} {}'.format('case (us)', 'objs', ' '.join(
+            '{:>10}'.format(step) for step in STEPS)))
+        for case in selected:
+            result = run_case(case, world, count=options['count'], repeat=options['repeat'])
+            results[case.name] = result
+            self.stdout.write('{:<28} {:>5} {}'.format(
+                case.name, result.get('objects', '-'), ' '.join(
+                    '{:>10.1f}'.format(result[step] * 1e6) if step in result
+                    else '{:>10}'.format('-') for step in STEPS)))
+
+        mismatched = [name for name, result in sorted(results.items())
+                      if result.get('matches') is False]
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if mismatched:
+            raise CommandError('compiled serializer output differs from restless: {}'.format(
+                ', '.join(mismatched)))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                regressions = compare(results, json.load(f), options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stdout.write('  ' + line)
+                raise CommandError('{} regressions against {}'.format(
+                    len(regressions), options['compare']))
+            self.stdout.write('No regressions against {}.'.format(options['compare']))
@@ -0,0 +1,73 @@
+import datetime
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ...changes import FUNCTION_SQL, horizon_sql, index_sql, trigger_sql
+from ...helpers import PublicListEndpoint
+from ...models import Tombstone, TombstoneHorizon
+from ... import views
+
+
+def feed_models():
+    """ The models of every list view with an `updated_since` feed. """
+    models = []
+    for view in vars(views).values():
+        if isinstance(view, type) and issubclass(view, PublicListEndpoint) and \
+                view.model is not None and view().supports_changes() and \
+                view.model not in models:
+            models.append(view.model)
+    return sorted(models, key=lambda model: model._meta.db_table)
+
+
+class Command(BaseCommand):
+    help = 'install the indexes and delete triggers behind the updated_since change feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql',
+            action='store_true',
+            dest='sql',
+            default=False,
+            help='Print the SQL rather than running it.')
+        parser.add_argument('--prune',
+            type=int,
+            dest='prune',
+            default=None,
+            help='Delete tombstones older than this many days instead. '
+                 'Feeds from before then answer 410 Gone.')
+
+    def handle(self, *args, **options):
+        if options['prune'] is not None:
+            before = timezone.now() - datetime.timedelta(days=options['prune'])
+            with transaction.atomic():
+                for model in feed_models():
+                    horizon, created = TombstoneHorizon.objects.get_or_create(
+                        table_name=model._meta.db_table,
+                        defaults={'complete_since': before})
+                    if horizon.complete_since < before:
+                        horizon.complete_since = before
+                        horizon.save()
+                tombstones = Tombstone.objects.filter(deleted_at__lt=before)
+                count = tombstones.count()
+                tombstones.delete()
+            self.stdout.write('Deleted {} tombstones.'.format(count))
+            return
+
+        statements = [FUNCTION_SQL]
+        for model in feed_models():
+            statements.extend(trigger_sql(model))
+            statements.append(horizon_sql(model))
+            statements.append(index_sql(model))
+
+        if options['sql']:
+            for statement in statements:
+                self.stdout.write(statement)
+            return
+
+        if connection.vendor != 'postgresql':
+            raise CommandError('the change feed triggers need Postgres')
+        # CREATE INDEX CONCURRENTLY can't run in a transaction, so this
+        # relies on autocommit; each statement can be rerun safely.
+        with connection.cursor() as cursor:
+            for statement in statements:
+                self.stdout.write(statement.splitlines()[0])
+                cursor.execute(statement)
@@ -0,0 +1,208 @@
+"""
+Request timing and query counts that are cheap enough to leave on.
+
+`DebugMixin` only reports anything with `DEBUG` on, when Django logs every
+query. Instead, every request to a public endpoint gets a `RequestTimer`,
+which counts queries and their time with a database execute wrapper, and
+times the stages the endpoint marks with `stage()`: for lists, filter,
+count, prefetch, serialize and encode.
+
+The timings are sent back in a `Server-Timing` header, and added to
+per-endpoint histograms, which `render` prints in the Prometheus text
+format for the `/metrics/` view. The histograms are kept per process, so
+with several workers each one has to be scraped.
+
+Settings:
+
+     - IMAGO_METRICS             | Turn all of this off with False.
+     - IMAGO_METRICS_BUCKETS     | Histogram buckets for durations, in
+                                 | seconds.
+     - IMAGO_METRICS_ALLOWED_IPS | Addresses allowed to read `/metrics/`;
+                                 | by default, only localhost.
+
+Django before 2.0 has no execute wrappers; there, queries are only counted
+when Django logs them, which is with `DEBUG` on.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connections
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def enabled():
+    return getattr(settings, 'IMAGO_METRICS', True)
+
+
+def allowed_ips():
+    return getattr(settings, 'IMAGO_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+
+
+@contextlib.contextmanager
+def nothing():
+    yield
+
+
+class RequestTimer(object):
+    """
+    Wall clock time of a request, of its named stages, and of the queries
+    it made. Each stage's time includes the queries run during it. Queries
+    can be recorded from several threads at once (see `imago.parallel`).
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.seconds = None
+        self.stages = OrderedDict()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.time() - start
+
+    def __call__(self, execute, sql, params, many, context):
+        # the execute wrapper
+        start = time.time()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.queries += 1
+                self.query_seconds += time.time() - start
+
+    @contextlib.contextmanager
+    def recording(self):
+        """ Count the queries run on every connection while in the block. """
+        with contextlib.ExitStack() as stack:
+            logged = []
+            for connection in connections.all():
+                if hasattr(connection, 'execute_wrapper'):
+                    stack.enter_context(connection.execute_wrapper(self))
+                elif connection.queries_logged:
+                    logged.append((connection, len(connection.queries_log)))
+            try:
+                yield
+            finally:
+                for connection, start in logged:
+                    for query in list(connection.queries_log)[start:]:
+                        self.queries += 1
+                        self.query_seconds += float(query['time'])
+
+    def finish(self):
+        self.seconds = time.time() - self.start
+
+    def server_timing(self):
+        """ The timings as a `Server-Timing` header value, in milliseconds. """
+        metrics = ['{};dur={:.1f}'.format(name, seconds * 1000)
+                   for name, seconds in self.stages.items()]
+        metrics.append('db;dur={:.1f};desc="{} queries"'.format(
+            self.query_seconds * 1000, self.queries))
+        metrics.append('total;dur={:.1f}'.format(self.seconds * 1000))
+        return ', '.join(metrics)
+
+
+def _format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + sorted(extra.items())
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Histogram(object):
+    """
+    A Prometheus histogram, with a set of cumulative bucket counts, a sum
+    and a count for each combination of `labels`. Safe to share between
+    threads.
+    """
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, values, value):
+        """ Add `value` to the series for the label `values`. """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help_text),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((values, list(counts), total, count)
+                            for values, (counts, total, count) in self._series.items())
+        for values, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(self.labels, values,
+                                              le=_format_number(bound)), cumulative))
+            labels = _format_labels(self.labels, values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, _format_number(total)))
+            lines.append('{}_count{} {}'.format(self.name, labels, count))
+        return lines
+
+
+_buckets = getattr(settings, 'IMAGO_METRICS_BUCKETS', DEFAULT_BUCKETS)
+
+request_seconds = Histogram(
+    'imago_request_seconds', 'Time spent handling requests.',
+    ['endpoint'], _buckets)
+stage_seconds = Histogram(
+    'imago_request_stage_seconds', 'Time spent in each stage of a request.',
+    ['endpoint', 'stage'], _buckets)
+query_seconds = Histogram(
+    'imago_request_query_seconds', 'Time spent in database queries per request.',
+    ['endpoint'], _buckets)
+query_count = Histogram(
+    'imago_request_queries', 'Database queries made per request.',
+    ['endpoint'], QUERY_BUCKETS)
+
+HISTOGRAMS = [request_seconds, stage_seconds, query_seconds, query_count]
+
+
+def record(endpoint, timer):
+    """ Add a finished request's timings to the histograms. """
+    request_seconds.observe((endpoint,), timer.seconds)
+    for stage, seconds in timer.stages.items():
+        stage_seconds.observe((endpoint, stage), seconds)
+    query_seconds.observe((endpoint,), timer.query_seconds)
+    query_count.observe((endpoint,), timer.queries)
+
+
+def render():
+    """ Every histogram, in the Prometheus text format. """
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    return '\n'.join(lines) + '\n'
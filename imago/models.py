@@ -1,4 +1,5 @@
 from django.contrib.gis.db import models
+from django.contrib.postgres.fields import JSONField
 from django.core.urlresolvers import reverse
 from boundaries.models import Boundary
 from opencivicdata.models import Division
@@ -10,3 +11,53 @@ class DivisionGeometry(models.Model):
 
     def __unicode__(self):
         return '{0} - {1} - {2}'.format(self.division, self.boundary)
+
+
+class BoundaryShape(models.Model):
+    """
+    A boundary's shape encoded as GeoJSON, as it is (tolerance 0), or
+    simplified to a tolerance in degrees. Filled in by `loadmappings`.
+    """
+    boundary = models.ForeignKey(Boundary, related_name='encoded_shapes')
+    tolerance = models.FloatField()
+    geojson = models.TextField()
+
+    class Meta:
+        unique_together = (('boundary', 'tolerance'),)
+
+    def __unicode__(self):
+        return '{0} - {1}'.format(self.boundary_id, self.tolerance)
+
+
+class Tombstone(models.Model):
+    """
+    A deleted object, for the `updated_since` change feeds. Rows are
+    added by the delete triggers `setupchangefeed` installs on each of the
+    feeds' tables, so deletes are recorded whatever makes them. `data` is
+    the deleted row, as JSON, which feeds match their filters against.
+    """
+    table_name = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=300)
+    deleted_at = models.DateTimeField()
+    data = JSONField(null=True)
+
+    class Meta:
+        index_together = [
+            ['table_name', 'deleted_at', 'object_id'],
+        ]
+
+    def __unicode__(self):
+        return '{0} - {1}'.format(self.table_name, self.object_id)
+
+
+class TombstoneHorizon(models.Model):
+    """
+    How far back a table's tombstones go: deletes from before
+    `complete_since`, when `setupchangefeed` installed the table's trigger
+    or last pruned its tombstones, may not have one.
+    """
+    table_name = models.CharField(max_length=100, unique=True)
+    complete_since = models.DateTimeField()
+
+    def __unicode__(self):
+        return '{0} - {1}'.format(self.table_name, self.complete_since)
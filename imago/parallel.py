@@ -0,0 +1,104 @@
+"""
+Run a request's independent queries at the same time.
+
+A list request makes its COUNT, its page query and one query per
+prefetched relation one after another, on one connection. With
+`IMAGO_QUERY_WORKERS` set to a number of threads, the public endpoints
+instead hand the COUNT to a shared thread pool while they fetch the page,
+then run each of the page's top-level prefetches in the pool as well, so a request takes about as
+long as its slowest chain of queries rather than all of them added up.
+
+Django keeps a connection per thread, so every worker thread has its own,
+which it keeps for `CONN_MAX_AGE` like any other; set that, or each
+query handed to the pool opens a new connection. The pool's connections
+count against the database's connection limit, on top of the ones
+serving requests.
+
+The queries run outside of the request's transaction (if there is one),
+each in its own, so on a busy database the count may not match the page
+exactly; neither does it without this, between two requests.
+
+Django has no async views before 3.1, so this uses threads rather than
+an ASGI event loop, which gets the same overlap for queries.
+"""
+
+import concurrent.futures
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import prefetch_related_objects
+
+
+def workers():
+    return getattr(settings, 'IMAGO_QUERY_WORKERS', 0)
+
+
+def enabled():
+    return workers() > 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers())
+        return _pool
+
+
+def submit(timer, fn, *args):
+    """
+    Call `fn(*args)` in the pool, returning a future. Its queries are
+    counted by `timer`, the request's `imago.metrics.RequestTimer`, if it
+    isn't None.
+    """
+    def task():
+        close_old_connections()
+        try:
+            if timer is None:
+                return fn(*args)
+            with timer.recording():
+                return fn(*args)
+        finally:
+            close_old_connections()
+    return pool().submit(task)
+
+
+def prefetch(timer, objects, prefetches):
+    """
+    `prefetch_related_objects`, with the `Prefetch` objects in `prefetches`
+    running in the pool at once. Each of them may have nested prefetches,
+    which run in the same thread, one after the other.
+    Without a pool, this is just `prefetch_related_objects`.
+
+    Prefetches through the same relation of `objects`, like
+    `organization__posts` and `organization__children` under a joined
+    `organization`, share a thread: both would set up the
+    `_prefetched_objects_cache` of the same related objects, and
+    concurrently one of them could replace the other's.
+    """
+    groups = []
+    for lookup in prefetches:
+        first = lookup.prefetch_through.split('__')[0]
+        for group in groups:
+            if group[0] == first:
+                group[1].append(lookup)
+                break
+        else:
+            groups.append((first, [lookup]))
+
+    if not enabled() or len(groups) < 2 or not objects:
+        prefetch_related_objects(objects, *prefetches)
+        return
+    # each prefetch adds to this dict; make sure they all add to the same one
+    for obj in objects:
+        if not hasattr(obj, '_prefetched_objects_cache'):
+            obj._prefetched_objects_cache = {}
+    futures = [submit(timer, prefetch_related_objects, objects, *lookups)
+               for _, lookups in groups]
+    for future in futures:
+        future.result()
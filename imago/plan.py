@@ -0,0 +1,180 @@
+"""
+Work out how to load everything a serialize spec will touch.
+
+`get_fields` only knows the spec, so it hands back dotted paths for
+`prefetch_related`, which costs a query per level even for a single-valued
+relation like `from_organization.jurisdiction`. A `QueryPlan` walks the
+same spec against the models instead, and loads forward foreign keys and
+one-to-ones with `select_related` joins, leaving `prefetch_related` for the
+reverse and many-to-many relations.
+
+Every prefetched relation gets a plan of its own, which becomes the query
+set of its `Prefetch` object: joins for the foreign keys below it, nested
+`Prefetch` objects for the relations below those, and the model's default
+ordering, as `prefetch_related` would have, so
+`memberships.organization.jurisdiction.name` is one query for memberships
+joined to their organization and its jurisdiction, rather than three.
+
+Since it knows which attributes the spec reads, each plan also limits its
+query to those columns with `only()`. A model is loaded in full whenever
+the spec reads something that isn't a column we can name, like a callable
+under a key that isn't a field, or a whole related object.
+
+Spec functions marked with `imago.serialize.batched` bring their own
+loader, which `QueryPlan.load` runs on the page of root objects once
+they're fetched. Those functions should only need the primary key.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+
+
+def get_field(model, name):
+    """ The field `name` on `model`, or None if there isn't one. """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def is_single(field):
+    """ Whether a relation can be loaded with a join. """
+    return (field.related_model is not None and
+            not (field.many_to_many or field.one_to_many))
+
+
+def all_columns(model):
+    return set(field.name for field in model._meta.concrete_fields)
+
+
+class QueryPlan(object):
+    """
+    How to load `model` for serializing with `fields`, the field list of a
+    spec from `get_fields` (or the whole spec; None serializes the whole
+    object): the `select_related` joins, the columns to load (None for all
+    of them), and a sub-plan for each relation to prefetch. `required`
+    columns are always loaded.
+    """
+
+    def __init__(self, model, fields, required=()):
+        if isinstance(fields, dict):
+            fields = fields.get('fields', [])
+        self.model = model
+        self.select_related = []
+        self.prefetch_related = []
+        self.loaders = []
+        columns = None
+        if fields is not None:
+            columns = self._walk(model, fields, '')
+        self.only = None if columns is None else sorted(columns.union(required))
+
+    def _walk(self, model, fields, prefix):
+        """
+        Plan the relations in `fields`, joined to the query set through
+        `prefix`, and return the columns of `model` (again, relative to the
+        query set) needed to serialize them, or None for all of them.
+        """
+        columns = set([model._meta.pk.name])
+        prunable = True
+        for field in fields:
+            if not isinstance(field, tuple):
+                prunable = False
+                continue
+            name, spec = field
+            if callable(spec) and hasattr(spec, 'batch'):
+                if prefix == '' and spec.batch not in self.loaders:
+                    self.loaders.append(spec.batch)
+                continue
+            relation = get_field(model, name)
+            if relation is None:
+                prunable = False
+                continue
+            if relation.concrete and name != relation.name:
+                # an attname like `division_id`, which `get_field` also
+                # finds: just the key's own column, never a relation
+                columns.add(relation.name)
+                continue
+            if relation.concrete:
+                columns.add(relation.name)
+            if not relation.is_relation:
+                continue
+            if not isinstance(spec, dict) or relation.related_model is None:
+                # a callable may follow a reverse relation anywhere
+                prunable = prunable and relation.concrete
+                continue
+
+            path = prefix + name
+            related = relation.related_model
+            if is_single(relation):
+                self.select_related.append(path)
+                child = None
+                if 'fields' in spec:
+                    child = self._walk(related, spec['fields'], path + '__')
+                if child is None:
+                    child = all_columns(related)
+                columns.update('%s__%s' % (name, column) for column in child)
+            else:
+                required = ()
+                if not relation.concrete and not relation.many_to_many:
+                    # the key prefetching matches the related rows back on
+                    required = (relation.field.name,)
+                self.prefetch_related.append(
+                    (path, QueryPlan(related, spec.get('fields'), required=required)))
+
+        if not prunable:
+            return None
+        return columns
+
+    def prefetches(self):
+        """
+        `Prefetch` objects for the plan's prefetched relations. Like plain
+        `prefetch_related`, these are only ordered if the model has a
+        `Meta.ordering`; ordering others by a random (UUID) primary key
+        would only cost a sort.
+        """
+        return [Prefetch(path, queryset=plan.apply(plan.model._default_manager.all()))
+                for path, plan in self.prefetch_related]
+
+    def queryset(self, data, columns=()):
+        """
+        Add the plan's joins and columns to the query set `data`. Pass
+        `columns` (`order_by` style keys are fine) to load other columns
+        of the root too.
+        """
+        if self.select_related:
+            data = data.select_related(*self.select_related)
+        if self.only is not None:
+            only = set(self.only)
+            for column in columns:
+                field = get_field(self.model, column.lstrip('-').split('__')[0])
+                if field is not None and field.concrete:
+                    only.add(field.name)
+            data = data.only(*only)
+        return data
+
+    def apply(self, data, columns=()):
+        """ Add all of the plan's lookups to the query set `data`. """
+        data = self.queryset(data, columns)
+        if self.prefetch_related:
+            data = data.prefetch_related(*self.prefetches())
+        return data
+
+    def load(self, objects):
+        """
+        Run the batch loaders of the spec's functions on `objects`, the
+        root objects about to be serialized. Loaders below prefetched
+        relations aren't run; their functions load data one object at a
+        time, as they would without a plan.
+        """
+        for loader in self.loaders:
+            loader(objects)
+
+    def describe(self):
+        """ The plan as a nested dict, for debug output. """
+        return {
+            "select_related": self.select_related,
+            "only": self.only,
+            "loaders": [loader.__name__ for loader in self.loaders],
+            "prefetch": dict((path, plan.describe())
+                             for path, plan in self.prefetch_related),
+        }
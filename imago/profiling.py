@@ -0,0 +1,240 @@
+"""
+Profiles of production requests, to tell whether a slow one was waiting
+on SQL, fanning out prefetches or serializing.
+
+With `IMAGO_PROFILE_DIR` set, the public endpoints profile:
+
+     - a random `IMAGO_PROFILE_SAMPLE_RATE` fraction of requests with
+       cProfile, which sees every call, at a cost of making the request
+       a few times slower. Only one thread is profiled this way at once.
+
+     - with `IMAGO_PROFILE_SLOW_SECONDS` set, every other request with a
+       stack sampler, which looks at the request's thread every
+       `IMAGO_PROFILE_INTERVAL` seconds from a background thread. Only the
+       profiles of requests slower than the threshold are kept.
+
+Each profile is written to the directory as JSON, along with the endpoint,
+the request's normalized parameters, the field list and the timings from
+`imago.metrics`; cProfile's own stats are saved next to it as `.prof`.
+`imago-profiles <directory>` adds up the hottest functions across them.
+"""
+
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+
+def directory():
+    return getattr(settings, 'IMAGO_PROFILE_DIR', None)
+
+
+def sample_rate():
+    return getattr(settings, 'IMAGO_PROFILE_SAMPLE_RATE', 0)
+
+
+def slow_seconds():
+    return getattr(settings, 'IMAGO_PROFILE_SLOW_SECONDS', None)
+
+
+def interval():
+    return getattr(settings, 'IMAGO_PROFILE_INTERVAL', 0.005)
+
+
+# how many functions to keep per profile, hottest first
+MAX_FUNCTIONS = 500
+
+
+def _function_name(filename, lineno, name):
+    # the same format `pstats` prints
+    return '{}:{}({})'.format(filename, lineno, name)
+
+
+class Sampler(object):
+    """
+    A background thread counting the stacks of the threads it's been
+    asked to `watch`, every `interval` seconds. It sleeps while there's
+    nothing to watch.
+    """
+
+    def __init__(self):
+        self.watched = {}
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def watch(self, thread_id):
+        stacks = Counter()
+        with self._lock:
+            self.watched[thread_id] = stacks
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='imago-sampler')
+                self._thread.daemon = True
+                self._thread.start()
+            self._lock.notify()
+        return stacks
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            self.watched.pop(thread_id, None)
+
+    def run(self):
+        while True:
+            # held throughout, so no stacks are added once `unwatch` returns
+            with self._lock:
+                while not self.watched:
+                    self._lock.wait()
+                frames = sys._current_frames()
+                for thread_id, stacks in self.watched.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(_function_name(code.co_filename, code.co_firstlineno,
+                                                    code.co_name))
+                        frame = frame.f_back
+                    if stack:
+                        stacks[tuple(reversed(stack))] += 1
+                del frames
+            time.sleep(interval())
+
+
+_sampler = Sampler()
+_cprofile_lock = threading.Lock()
+_counter = itertools.count()
+
+
+class Profile(object):
+    """
+    One request's profile: call `stop`, then `save`. Subclasses gather
+    the profile, and give `functions()`: (function, self seconds, total
+    seconds, calls) tuples.
+    """
+
+    always_save = True
+    mode = None
+
+    def __init__(self):
+        self.start = time.time()
+        self.seconds = None
+
+    def stop(self):
+        self.seconds = time.time() - self.start
+
+    def save(self, endpoint, path, params, fields, timer=None):
+        """
+        Write the profile to `IMAGO_PROFILE_DIR`, if it's worth keeping.
+        `params` should be the request's parameters and `timer` the
+        request's `imago.metrics.RequestTimer`, if there is one.
+        """
+        if not self.always_save and self.seconds < (slow_seconds() or 0):
+            return None
+        functions = sorted(self.functions(), key=lambda x: -x[2])[:MAX_FUNCTIONS]
+        data = {
+            "endpoint": endpoint,
+            "path": path,
+            "params": dict((key, value) for key, value in params.items()
+                           if key not in ('apikey', '_')),
+            "fields": list(fields),
+            "mode": self.mode,
+            "started": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.start)),
+            "seconds": self.seconds,
+            "functions": [{"function": function, "self": self_, "total": total,
+                           "calls": calls}
+                          for function, self_, total, calls in functions],
+        }
+        if timer is not None:
+            data.update({
+                "stages": dict(timer.stages),
+                "queries": timer.queries,
+                "query_seconds": timer.query_seconds,
+            })
+
+        os.makedirs(directory(), exist_ok=True)
+        name = '{}-{}-{}ms-{}-{}'.format(
+            time.strftime('%Y%m%dT%H%M%S', time.gmtime(self.start)), endpoint,
+            int(self.seconds * 1000), os.getpid(), next(_counter))
+        filename = os.path.join(directory(), name + '.json')
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        self.dump(os.path.join(directory(), name))
+        return filename
+
+    def dump(self, basename):
+        pass
+
+
+class CProfile(Profile):
+    mode = 'cprofile'
+
+    def __init__(self):
+        super(CProfile, self).__init__()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        _cprofile_lock.release()
+        super(CProfile, self).stop()
+
+    def functions(self):
+        stats = pstats.Stats(self.profiler).stats
+        return [(_function_name(*function), tt, ct, nc)
+                for function, (cc, nc, tt, ct, callers) in stats.items()]
+
+    def dump(self, basename):
+        self.profiler.dump_stats(basename + '.prof')
+
+
+class SampledProfile(Profile):
+    always_save = False
+    mode = 'sample'
+
+    def __init__(self):
+        super(SampledProfile, self).__init__()
+        self.thread_id = threading.current_thread().ident
+        self.stacks = _sampler.watch(self.thread_id)
+
+    def stop(self):
+        _sampler.unwatch(self.thread_id)
+        super(SampledProfile, self).stop()
+
+    def functions(self):
+        # each sample stands for an equal share of the request's time
+        samples = sum(self.stacks.values())
+        if not samples:
+            return []
+        share = self.seconds / samples
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack[-1]] += count
+            for function in set(stack):
+                total_counts[function] += count
+        return [(function, self_counts[function] * share, count * share, None)
+                for function, count in total_counts.items()]
+
+
+def start():
+    """
+    Start profiling the current request, if it's picked; returns the
+    `Profile`, or None.
+    """
+    if not directory():
+        return None
+    if random.random() < sample_rate() and _cprofile_lock.acquire(False):
+        try:
+            return CProfile()
+        except ValueError:
+            # another profiler is already running
+            _cprofile_lock.release()
+    if slow_seconds() is not None:
+        return SampledProfile()
+    return None
@@ -3,8 +3,14 @@
 #    - Paul R. Tagliamonte <paultag@sunlightfoundation.com>
 
 import copy
+import functools
+import operator
 import pytz
+from collections import defaultdict
+from django.db.models import Prefetch, prefetch_related_objects
 from opencivicdata.models import Division
+from .models import DivisionGeometry
+from .encoders import RawJSON
 
 """
 The following specs in this file are used to limit exactly what we can
@@ -36,6 +42,29 @@ def dout(obj):
     return pytz.UTC.localize(obj).isoformat()
 
 
+def dout_attr(name):
+    """
+    Spec helper for a datetime attribute that should go through `dout`.
+    The attribute name is kept on the function, so `imago.codegen` can
+    skip `dout` when the JSON encoder formats datetimes the same way.
+    """
+    fn = lambda obj: dout(getattr(obj, name))
+    fn.dout_attr = name
+    return fn
+
+
+def batched(loader):
+    """
+    Decorator for a spec function that can have its data loaded for a
+    whole page of objects at once: `loader` is called with the list of
+    objects before any of them are serialized (see `imago.plan`).
+    """
+    def wrap(fn):
+        fn.batch = loader
+        return fn
+    return wrap
+
+
 def sfilter(obj, blacklist):
     """
     Helper function to deep copy a dict, and pop elements off.
@@ -248,8 +277,8 @@ BILL_SERIALIZE = dict([
     ('from_organization', ORGANIZATION_SERIALIZE),
     ('from_organization_id', {}),
 
-    ('created_at', lambda x: dout(x.created_at)),
-    ('updated_at', lambda x: dout(x.updated_at)),
+    ('created_at', dout_attr('created_at')),
+    ('updated_at', dout_attr('updated_at')),
 
     ('classification', lambda x: x.classification),
     ('subject', lambda x: x.subject),
@@ -287,8 +316,8 @@ VOTE_SERIALIZE = dict([
     ("motion_text", {}),
     ("motion_classification", {}),
 
-    ('created_at', lambda x: dout(x.created_at)),
-    ('updated_at', lambda x: dout(x.updated_at)),
+    ('created_at', dout_attr('created_at')),
+    ('updated_at', dout_attr('updated_at')),
 
     ('start_date', {}),
     ('end_date', {}),
@@ -345,8 +374,8 @@ EVENT_SERIALIZE = dict([
     ('created_at', {}),
     ('updated_at', {}),
 
-    ('start_time', lambda x: dout(x.start_time)),
-    ('end_time', lambda x: dout(x.end_time)),
+    ('start_time', dout_attr('start_time')),
+    ('end_time', dout_attr('end_time')),
     ('timezone', {}),
 
     ('all_day', {}),
@@ -365,17 +394,70 @@ def boundary_to_dict(boundary):
     d['boundary_set'] = {'start_date': boundary.set.start_date,
                          'end_date': boundary.set.end_date,
                          'name': boundary.set.name}
+    # see imago.shapes
+    geojson = getattr(boundary, '_geojson', None)
+    if geojson is not None:
+        d['shape'] = RawJSON(geojson)
     return d
 
 
+def _parent_key(division_id, depth=0):
+    fields, n = Division.subtypes_from_id(division_id)
+    for i in range(n - depth, n):
+        del fields['subtype{0}'.format(i)]
+        del fields['subid{0}'.format(i)]
+    return tuple(sorted(fields.items()))
+
+
+def load_division_children(divisions):
+    """
+    Look up the children of all `divisions` in one query, rather than one
+    `children_of` query each.
+    """
+    if not divisions:
+        return
+    query = functools.reduce(operator.or_, [
+        Division.objects.children_of(division.id) for division in divisions
+    ])
+    children = defaultdict(list)
+    for child in query.only('id', 'name').order_by('id'):
+        children[_parent_key(child.id, depth=1)].append(child)
+    for division in divisions:
+        division._children = children[_parent_key(division.id)]
+
+
+def load_division_geometries(divisions):
+    """
+    Load the geometries of all `divisions`, with their boundaries and
+    boundary sets, in one query. The shapes themselves aren't serialized,
+    so they're left in the database.
+    """
+    prefetch_related_objects(divisions, Prefetch(
+        'geometries',
+        queryset=DivisionGeometry.objects.select_related('boundary__set').defer(
+            'boundary__shape', 'boundary__simple_shape')
+    ))
+
+
+@batched(load_division_children)
+def division_children(division):
+    children = getattr(division, '_children', None)
+    if children is None:
+        children = Division.objects.children_of(division.id)
+    return [{'id': d.id, 'name': d.name} for d in children]
+
+
+@batched(load_division_geometries)
+def division_geometries(division):
+    return [boundary_to_dict(dg.boundary) for dg in division.geometries.all()]
+
+
 DIVISION_SERIALIZE = {
     'id': {},
     'name': {},
     'country': {},
     'jurisdictions': JURISDICTION_SERIALIZE,
-    'children': lambda division: [{'id': d.id, 'name': d.name}
-                                   for d in Division.objects.children_of(division.id)],
-    'geometries': lambda division: [boundary_to_dict(dg.boundary)
-                                    for dg in division.geometries.all()],
+    'children': division_children,
+    'geometries': division_geometries,
     'posts' : POST_SERIALIZE
 }
@@ -0,0 +1,116 @@
+"""
+Pre-encoded boundary shapes.
+
+Encoding a state's boundary as GeoJSON means walking megabytes of
+coordinates through GEOS, so rather than doing that on every request,
+`loadmappings` stores the shape of every mapped boundary as GeoJSON text,
+both as it is and simplified at each of the `IMAGO_SHAPE_TOLERANCES`.
+The division endpoints add them to their geometries when asked to with
+`simplify=<tolerance>`, and put the stored text into the response as it is.
+"""
+
+from collections import defaultdict
+
+from boundaries.models import Boundary
+from django.conf import settings
+from django.db import transaction
+from restless.http import HttpError
+
+from .models import BoundaryShape
+
+
+DEFAULT_TOLERANCES = (0, 0.0001, 0.001, 0.01)
+
+
+def tolerances():
+    return tuple(float(tolerance) for tolerance in
+                 getattr(settings, 'IMAGO_SHAPE_TOLERANCES', DEFAULT_TOLERANCES))
+
+
+def parse_tolerance(value):
+    """
+    The tolerance asked for by a `simplify` param, or None without one.
+    Only the stored tolerances are allowed.
+    """
+    if value is None:
+        return None
+    try:
+        tolerance = float(value)
+    except ValueError:
+        tolerance = None
+    if tolerance not in tolerances():
+        raise HttpError(400, "Error: `simplify` must be one of: {}".format(
+            ", ".join(str(x) for x in tolerances())))
+    return tolerance
+
+
+def encode(shape, tolerance):
+    if tolerance:
+        shape = shape.simplify(tolerance, preserve_topology=True)
+    return shape.json
+
+
+def prune():
+    """ Drop the stored shapes of boundaries that are no longer mapped. """
+    BoundaryShape.objects.filter(boundary__geometries=None).delete()
+
+
+def unencoded():
+    """ The ids of mapped boundaries with no stored shapes. """
+    return (Boundary.objects.filter(geometries__isnull=False, encoded_shapes=None)
+            .values_list('id', flat=True).distinct())
+
+
+def refresh(boundary_ids=None, chunk_size=100, quiet=False):
+    """
+    Re-encode the stored shapes of the boundaries in `boundary_ids`, or of
+    every mapped boundary, after a `prune`. Boundaries are done
+    `chunk_size` at a time, each in its own transaction. Returns how many
+    boundaries were encoded.
+    """
+    if boundary_ids is None:
+        prune()
+        boundary_ids = (Boundary.objects.filter(geometries__isnull=False)
+                        .values_list('id', flat=True).distinct())
+    boundary_ids = sorted(boundary_ids)
+    levels = tolerances()
+
+    for start in range(0, len(boundary_ids), chunk_size):
+        chunk = boundary_ids[start:start + chunk_size]
+        shapes = []
+        for boundary in Boundary.objects.filter(pk__in=chunk).only('id', 'shape'):
+            shapes.extend(BoundaryShape(boundary_id=boundary.id, tolerance=tolerance,
+                                        geojson=encode(boundary.shape, tolerance))
+                          for tolerance in levels)
+        with transaction.atomic():
+            BoundaryShape.objects.filter(boundary_id__in=chunk).delete()
+            BoundaryShape.objects.bulk_create(shapes)
+        if not quiet:
+            print('encoded {} of {} boundary shapes'.format(
+                start + len(chunk), len(boundary_ids)))
+    return len(boundary_ids)
+
+
+def attach(boundaries, tolerance):
+    """
+    Set `_geojson` on each of `boundaries` to its shape at `tolerance`, in
+    one query. Shapes missing from the store are encoded on the spot.
+    """
+    by_id = defaultdict(list)
+    for boundary in boundaries:
+        by_id[boundary.id].append(boundary)
+
+    found = {}
+    if by_id:
+        found = dict(BoundaryShape.objects.filter(
+            boundary_id__in=list(by_id), tolerance=tolerance
+        ).values_list('boundary_id', 'geojson'))
+
+    missing = [id_ for id_ in by_id if id_ not in found]
+    if missing:
+        for boundary in Boundary.objects.filter(pk__in=missing).only('id', 'shape'):
+            found[boundary.id] = encode(boundary.shape, tolerance)
+
+    for id_, geojson in found.items():
+        for boundary in by_id[id_]:
+            boundary._geojson = geojson
@@ -0,0 +1,170 @@
+"""
+A small legislature saved to the test database: one of nearly everything
+the endpoints' default fields follow.
+"""
+
+import datetime
+
+from boundaries.models import Boundary, BoundarySet
+from django.contrib.gis.geos import MultiPolygon
+from django.utils import timezone
+from opencivicdata.models import (Bill, BillAbstract, BillAction, BillActionRelatedEntity,
+                                  BillDocument, BillDocumentLink, BillIdentifier,
+                                  BillSource, BillSponsorship, BillTitle, BillVersion,
+                                  BillVersionLink, Division, Event, EventAgendaItem,
+                                  EventLocation, EventParticipant, EventRelatedEntity,
+                                  EventSource, Jurisdiction, LegislativeSession,
+                                  Membership, Organization, OrganizationIdentifier,
+                                  OrganizationSource, Person, PersonContactDetail,
+                                  PersonIdentifier, PersonSource, PersonVote, Post,
+                                  RelatedBill, VoteCount, VoteEvent, VoteSource)
+
+from ..models import DivisionGeometry
+
+
+class World(object):
+    """
+    `size` people, bills and vote events, in one state with two chambers
+    and a committee.
+    """
+
+    def __init__(self, size=3):
+        self.state = Division.objects.create('ocd-division/country:us/state:ex', 'Example')
+        self.jurisdiction = Jurisdiction.objects.create(
+            id='ocd-jurisdiction/country:us/state:ex/government', name='Example State',
+            url='http://example.com/', classification='government',
+            feature_flags=['subjects'], division=self.state)
+        self.session = LegislativeSession.objects.create(
+            jurisdiction=self.jurisdiction, identifier='2017', name='2017 Regular Session',
+            classification='primary', start_date='2017-01-09', end_date='2017-06-30')
+
+        self.legislature = self.organization('Example State Legislature', 'legislature')
+        self.chambers = [
+            self.organization('Example State Senate', 'upper', parent=self.legislature),
+            self.organization('Example State House', 'lower', parent=self.legislature),
+        ]
+        self.committee = self.organization('Committee on Topics', 'committee',
+                                           parent=self.chambers[0])
+
+        self.posts = []
+        for n, chamber in enumerate(self.chambers):
+            for district in range(1, size + 1):
+                post_division = Division.objects.create('{}/sld{}:{}'.format(
+                    self.state.id, 'ul'[n], district), 'District {}'.format(district))
+                self.posts.append(Post.objects.create(
+                    organization=chamber, label=str(district), role='member',
+                    division=post_division))
+
+        self.people = [self.person(i) for i in range(size)]
+        self.bills = []
+        for i in range(size):
+            self.bills.append(self.bill(i))
+        self.votes = [self.vote(bill, i) for i, bill in enumerate(self.bills)]
+        self.events = [self.event(i) for i in range(size)]
+
+    def boundary(self, division, polygon, boundary_set='example'):
+        """
+        Map `division` to a new boundary shaped like `polygon`, in lon/lat,
+        in the `boundary_set` with that slug. None of the divisions have
+        one unless a test adds it.
+        """
+        name = boundary_set.title()
+        boundary_set, _ = BoundarySet.objects.get_or_create(slug=boundary_set, defaults=dict(
+            name='{} Districts'.format(name), singular='{} District'.format(name),
+            authority='Example', domain='Example', last_updated=datetime.date(2017, 1, 1)))
+        shape = MultiPolygon(polygon, srid=4326)
+        boundary = Boundary.objects.create(
+            set=boundary_set, set_name=boundary_set.singular,
+            slug=division.id.split('/')[-1].replace(':', '-'), external_id=division.id,
+            name=division.name, shape=shape, simple_shape=shape, centroid=shape.centroid)
+        DivisionGeometry.objects.create(division=division, boundary=boundary)
+        return boundary
+
+    def organization(self, name, classification, parent=None):
+        org = Organization.objects.create(name=name, classification=classification,
+                                          jurisdiction=self.jurisdiction, parent=parent)
+        OrganizationIdentifier.objects.create(organization=org, scheme='example',
+                                              identifier=name.lower())
+        OrganizationSource.objects.create(organization=org, url='http://example.com/org')
+        return org
+
+    def person(self, i):
+        person = Person.objects.create(name='Legislator {}'.format(i),
+                                       sort_name='{}, Legislator'.format(i),
+                                       birth_date='1970-01-01')
+        PersonIdentifier.objects.create(person=person, scheme='example', identifier=str(i))
+        PersonContactDetail.objects.create(person=person, type='voice', value='555-0101')
+        PersonSource.objects.create(person=person, url='http://example.com/p')
+        Membership.objects.create(person=person, organization=self.chambers[i % 2],
+                                  post=self.posts[i], role='member', start_date='2017-01-09')
+        Membership.objects.create(person=person, organization=self.committee,
+                                  role='member')
+        return person
+
+    def bill(self, i):
+        chamber = self.chambers[i % 2]
+        bill = Bill.objects.create(identifier='HB {}'.format(i + 1),
+                                   title='An act concerning topic {}'.format(i),
+                                   legislative_session=self.session,
+                                   from_organization=chamber,
+                                   classification=['bill'], subject=['Topic'])
+        BillAbstract.objects.create(bill=bill, abstract='Concerns a topic.')
+        BillTitle.objects.create(bill=bill, title='Topic act', note='short title')
+        BillIdentifier.objects.create(bill=bill, scheme='', identifier='HB{}'.format(i + 1))
+        for order in range(2):
+            action = BillAction.objects.create(
+                bill=bill, order=order, organization=self.chambers[order],
+                description='Action {}'.format(order), date='2017-02-0{}'.format(order + 1),
+                classification=['committee-passage'])
+            BillActionRelatedEntity.objects.create(
+                action=action, entity_type='person', name=self.people[0].name,
+                person=self.people[0])
+            BillActionRelatedEntity.objects.create(
+                action=action, entity_type='organization', name=self.committee.name,
+                organization=self.committee)
+        BillSponsorship.objects.create(bill=bill, primary=True, classification='primary',
+                                       entity_type='person', name=self.people[0].name,
+                                       person=self.people[0])
+        document = BillDocument.objects.create(bill=bill, note='Fiscal note',
+                                               date='2017-02-01')
+        BillDocumentLink.objects.create(document=document, media_type='application/pdf',
+                                        url='http://example.com/note.pdf')
+        version = BillVersion.objects.create(bill=bill, note='Introduced', date='2017-02-01')
+        BillVersionLink.objects.create(version=version, media_type='text/html',
+                                       url='http://example.com/hb.html')
+        BillSource.objects.create(bill=bill, url='http://example.com/bill')
+        if i > 0:
+            RelatedBill.objects.create(bill=bill, related_bill=self.bills[0],
+                                       identifier=self.bills[0].identifier,
+                                       legislative_session='2017', relation_type='companion')
+        return bill
+
+    def vote(self, bill, i):
+        vote = VoteEvent.objects.create(
+            identifier='vote {}'.format(i), motion_text='passage',
+            motion_classification=['passage'], start_date='2017-03-01', result='pass',
+            organization=bill.from_organization, legislative_session=self.session,
+            bill=bill)
+        VoteCount.objects.create(vote_event=vote, option='yes', value=len(self.people))
+        for person in self.people:
+            PersonVote.objects.create(vote_event=vote, option='yes', voter_name=person.name,
+                                      voter=person)
+        VoteSource.objects.create(vote_event=vote, url='http://example.com/vote')
+        return vote
+
+    def event(self, i):
+        location = EventLocation.objects.create(name='Capitol', jurisdiction=self.jurisdiction)
+        event = Event.objects.create(
+            name='Hearing {}'.format(i), jurisdiction=self.jurisdiction,
+            description='A hearing.', classification='committee-meeting',
+            start_time=timezone.now() + datetime.timedelta(days=i),
+            timezone='America/New_York', status='confirmed', location=location)
+        EventParticipant.objects.create(event=event, name=self.committee.name,
+                                        entity_type='organization',
+                                        organization=self.committee, note='host')
+        item = EventAgendaItem.objects.create(event=event, description='HB 1', order='1')
+        EventRelatedEntity.objects.create(agenda_item=item, name=self.committee.name,
+                                          entity_type='organization',
+                                          organization=self.committee, note='')
+        EventSource.objects.create(event=event, url='http://example.com/event')
+        return event
@@ -0,0 +1,82 @@
+import json
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .data import World
+
+
+def unordered(data):
+    """ `data` with its lists sorted, for relations without an ordering. """
+    if isinstance(data, dict):
+        return {key: unordered(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return sorted((unordered(value) for value in data),
+                      key=lambda value: json.dumps(value, sort_keys=True))
+    return data
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class BatchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def detail(self, pk, **params):
+        response = self.client.get('/{}/'.format(pk), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        data.pop('debug', None)
+        return data
+
+    def test_like_detail_views(self):
+        ids = [bill.pk for bill in reversed(self.world.bills)]
+        response = self.client.get('/batch/', {'ids': ','.join(ids)})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['meta'], {"count": 3, "missing": []})
+        self.assertEqual(list(data['results']), ids)
+        for pk in ids:
+            self.assertEqual(unordered(data['results'][pk]), unordered(self.detail(pk)))
+
+    def test_queries(self):
+        ids = [person.pk for person in self.world.people]
+        with CaptureQueriesContext(connection) as one:
+            self.client.get('/{}/'.format(ids[0]))
+        with CaptureQueriesContext(connection) as batch:
+            self.client.get('/batch/', {'ids': ','.join(ids)})
+        # each relation is prefetched once for the lot
+        self.assertEqual(len(batch), len(one))
+
+    def test_post(self):
+        ids = [person.pk for person in self.world.people]
+        for body in (ids, {"ids": ids, "fields": ["id", "name"]}):
+            with self.subTest(body=body):
+                response = self.client.post('/batch/', json.dumps(body),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                results = response.json()['results']
+                self.assertEqual(list(results), ids)
+                if isinstance(body, dict):
+                    self.assertEqual(results[ids[0]], {"id": ids[0], "name": "Legislator 0"})
+
+    def test_missing(self):
+        pk = self.world.committee.pk
+        missing = 'ocd-organization/00000000-0000-0000-0000-000000000000'
+        response = self.client.get('/batch/', {'ids': '{0},{1},{0}'.format(pk, missing),
+                                               'fields': 'id,name'})
+        data = response.json()
+        self.assertEqual(data['meta'], {"count": 1, "missing": [missing]})
+        self.assertEqual(data['results'], {pk: {"id": pk, "name": self.world.committee.name},
+                                           missing: None})
+
+    @override_settings(IMAGO_BATCH_MAX_IDS=2)
+    def test_errors(self):
+        people = [person.pk for person in self.world.people]
+        for ids in ('', ' , ', ','.join(people), people[0] + ',' + self.world.bills[0].pk,
+                    'ocd-thing/1'):
+            with self.subTest(ids=ids):
+                response = self.client.get('/batch/', {'ids': ids})
+                self.assertEqual(response.status_code, 400)
@@ -0,0 +1,52 @@
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from opencivicdata.models import Person
+
+from ..cache import response_cache
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls',
+                   IMAGO_RESPONSE_CACHE_TTLS={'PeopleList': 60})
+class ResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        response_cache._backend = None
+
+    def tearDown(self):
+        response_cache._backend = None
+        shutil.rmtree(self.directory)
+
+    def shared_cache(self):
+        return override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                    'responses': {
+                        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                        'LOCATION': self.directory}},
+            IMAGO_RESPONSE_CACHE='responses')
+
+    def names(self):
+        return sorted(person['name'] for person in
+                      self.client.get('/people/').json()['results'])
+
+    def test_invalidatecache(self):
+        with self.shared_cache():
+            names = self.names()
+            Person.objects.filter(pk=self.world.people[0].pk).update(name='Renamed')
+            self.assertEqual(self.names(), names)
+            call_command('invalidatecache', endpoints=['PeopleList'])
+            self.assertIn('Renamed', self.names())
+
+    def test_local_cache_refuses(self):
+        self.assertFalse(response_cache.shared())
+        with self.assertRaises(CommandError):
+            call_command('invalidatecache')
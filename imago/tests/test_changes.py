@@ -0,0 +1,82 @@
+import datetime
+import io
+
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from opencivicdata.models import Organization
+
+from ..models import Tombstone, TombstoneHorizon
+from .data import World
+
+
+# setupchangefeed creates its indexes CONCURRENTLY, which can't run in a
+# transaction
+@override_settings(ROOT_URLCONF='imago.urls')
+class ChangeFeedTest(TransactionTestCase):
+
+    def setUp(self):
+        call_command('setupchangefeed', stdout=io.StringIO())
+        self.started = timezone.now()
+        self.world = World()
+
+    def feed(self, path='/organizations/', status=200, **params):
+        params.setdefault('updated_since', self.started.isoformat())
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_pages(self):
+        ids, cursor = [], ''
+        while cursor is not None:
+            data = self.feed(per_page=2, cursor=cursor, fields='id,updated_at')
+            ids.extend(org['id'] for org in data['results'])
+            cursor = data['meta']['next_cursor']
+        self.assertEqual(sorted(ids), sorted(Organization.objects.values_list('id', flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+
+        # nothing new after the last page's sync cursor, until there is
+        sync = data['meta']['sync_cursor']
+        self.assertEqual(self.feed(cursor=sync)['results'], [])
+        Organization.objects.filter(pk=self.world.committee.pk).update(
+            name='Renamed', updated_at=timezone.now())
+        self.assertEqual([org['name'] for org in self.feed(cursor=sync)['results']],
+                         ['Renamed'])
+
+    def test_deleted(self):
+        party = Organization.objects.create(name='Party', classification='party',
+                                            jurisdiction=self.world.jurisdiction)
+        party_id = party.id
+        party.delete()
+        self.assertEqual(Tombstone.objects.get().object_id, party_id)
+
+        self.assertEqual([d['id'] for d in self.feed()['deleted']], [party_id])
+        self.assertEqual([d['id'] for d in self.feed(classification='party')['deleted']],
+                         [party_id])
+        self.assertEqual(self.feed(classification='committee')['deleted'], [])
+        self.assertEqual(self.feed(jurisdiction_id='elsewhere')['deleted'], [])
+        # not a filter a tombstone can be checked against, so it's listed
+        self.assertEqual([d['id'] for d in self.feed(name__icontains='nothing')['deleted']],
+                         [party_id])
+
+    def test_pruned(self):
+        horizon = TombstoneHorizon.objects.get(table_name=Organization._meta.db_table)
+        self.assertLessEqual(horizon.complete_since, timezone.now())
+        self.feed(updated_since=horizon.complete_since.isoformat())
+        self.feed(status=410, updated_since='2000-01-01')
+
+        sync = self.feed()['meta']['sync_cursor']
+        call_command('setupchangefeed', prune=0, stdout=io.StringIO())
+        self.feed(status=410, cursor=sync)
+        self.feed(updated_since=(timezone.now() + datetime.timedelta(seconds=1)).isoformat())
+
+    def test_not_set_up(self):
+        sync = self.feed()['meta']['sync_cursor']
+        TombstoneHorizon.objects.all().delete()
+        self.feed(status=501)
+        self.feed(status=501, cursor=sync)
+
+    def test_errors(self):
+        self.feed(status=400, page=2)
+        self.feed(status=400, updated_since='yesterday')
+        self.feed(status=400, cursor='nonsense')
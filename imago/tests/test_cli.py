@@ -0,0 +1,23 @@
+import json
+import tempfile
+
+from django.test import SimpleTestCase
+
+from ..cli import load_requests
+
+
+class LoadRequestsTest(SimpleTestCase):
+
+    def test_urls_are_decoded(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as f:
+            f.write(json.dumps({"url": "/bills/?fields=id%2Ctitle&q=health+care&sort="}) + '\n')
+            f.write('\n')
+            f.write(json.dumps({"path": "/people/", "params": {"fields": "id,name"},
+                                "weight": 2}) + '\n')
+            f.flush()
+            mix = load_requests(f.name)
+        # requests encodes them again when they're sent
+        self.assertEqual(mix, [
+            ('/bills/', {'fields': 'id,title', 'q': 'health care', 'sort': ''}, 1.0),
+            ('/people/', {'fields': 'id,name'}, 2.0),
+        ])
@@ -0,0 +1,41 @@
+from django.test import TestCase, override_settings
+from restless.models import serialize
+
+from ..benchmarks import cases
+from ..codegen import compile_serializer
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class CompiledSerializerTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def test_same_as_restless(self):
+        # each endpoint's default fields, and every field the models allow
+        for case in cases():
+            with self.subTest(case=case.name):
+                endpoint = case.endpoint()
+                plan, config = endpoint.resolve_fields(case.fields)
+                compiled = compile_serializer(config, model=endpoint.model)
+                objects = list(plan.apply(endpoint.model.objects.all()))
+                plan.load(objects)
+                self.assertTrue(objects)
+                for obj in objects:
+                    self.assertEqual(compiled(obj), serialize(obj, **config))
+
+    def test_served_as_restless(self):
+        # the serializer the endpoints use, compiled once per field list
+        for case in cases():
+            with self.subTest(case=case.name):
+                endpoint = case.endpoint()
+                plan, config = endpoint.resolve_fields(case.fields)
+                objects = list(plan.apply(endpoint.model.objects.all()))
+                plan.load(objects)
+                with override_settings(IMAGO_COMPILE_SERIALIZERS=False):
+                    expected = [endpoint.get_serializer(case.fields, config)(obj)
+                                for obj in objects]
+                serializer = endpoint.get_serializer(case.fields, config)
+                self.assertEqual([serializer(obj) for obj in objects], expected)
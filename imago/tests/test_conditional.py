@@ -0,0 +1,75 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from opencivicdata.models import Person
+
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class ConditionalTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def test_list_not_modified(self):
+        response = self.client.get('/people/', {'per_page': 2})
+        etag = response['ETag']
+        self.assertNotIn('Last-Modified', response)
+        # the count and the page, but none of the prefetches
+        with self.assertNumQueries(2):
+            response = self.client.get('/people/', {'per_page': 2},
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/people/', {'per_page': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_extra_queries(self):
+        with CaptureQueriesContext(connection) as unconditional:
+            self.client.get('/people/')
+        with CaptureQueriesContext(connection) as conditional:
+            self.client.get('/people/', HTTP_IF_NONE_MATCH='W/"nothing"')
+        self.assertEqual(len(unconditional), len(conditional))
+        self.assertFalse([query for query in unconditional.captured_queries
+                          if 'MAX(' in query['sql']])
+
+    def test_list_changes(self):
+        etag = self.client.get('/people/', {'per_page': 2})['ETag']
+
+        # after the page, which only the count notices
+        Person.objects.filter(pk=self.world.people[2].pk).delete()
+        response = self.client.get('/people/', {'per_page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        Person.objects.filter(pk=self.world.people[0].pk).update(name='Renamed')
+        response = self.client.get('/people/', {'per_page': 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cursor_not_modified(self):
+        response = self.client.get('/bills/', {'cursor': '', 'per_page': 2})
+        response = self.client.get('/bills/', {'cursor': '', 'per_page': 2},
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_not_modified(self):
+        path = '/{}/'.format(self.world.bills[0].pk)
+        response = self.client.get(path)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        # just the bill
+        with self.assertNumQueries(1):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(path, {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_detail(self):
+        response = self.client.get('/ocd-person/00000000-0000-0000-0000-000000000000/',
+                                   HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from opencivicdata.models import Bill
+
+from ..views import BillList, PeopleList, VoteList
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class CountStrategyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+        cls.chambers = [chamber.pk for chamber in cls.world.chambers]
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def meta(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['meta']
+
+    def total(self, path, **params):
+        return self.meta(path, **params)['total_count']
+
+    def test_exact_by_default(self):
+        for endpoint in (BillList, VoteList, PeopleList):
+            self.assertEqual(endpoint().get_count_strategy(), 'exact')
+        self.assertEqual(self.total('/bills/'), 3)
+        Bill.objects.filter(pk=self.world.bills[2].pk).delete()
+        self.assertEqual(self.total('/bills/'), 2)
+
+    @override_settings(IMAGO_COUNT_STRATEGIES={'PeopleList': 'none'})
+    def test_none(self):
+        def page(**params):
+            meta = self.meta('/people/', **params)
+            return meta['total_count'], meta['max_page'], meta['has_next']
+
+        self.assertEqual(page(per_page=2), (None, None, True))
+        self.assertEqual(page(per_page=2, page=2), (None, None, False))
+        # a last page that's exactly full
+        self.assertEqual(page(per_page=3), (None, None, False))
+        self.assertEqual(self.client.get('/people/', {'per_page': 2, 'page': 3}).status_code,
+                         404)
+
+    @override_settings(IMAGO_COUNT_STRATEGIES={'BillList': 'cached'})
+    def test_cached(self):
+        first = {'from_organization_id': self.chambers[0]}
+        self.assertEqual(self.total('/bills/'), 3)
+        self.assertEqual(self.total('/bills/', **first), 2)
+
+        Bill.objects.filter(pk=self.world.bills[2].pk).delete()
+        # the same filters, on any page and in any sort order, keep the count from before
+        self.assertEqual(self.total('/bills/'), 3)
+        self.assertEqual(self.total('/bills/', per_page=1, page=2, sort='-updated_at'), 3)
+        meta = self.meta('/bills/', per_page=1, **first)
+        self.assertEqual((meta['total_count'], meta['max_page']), (2, 2))
+        # new filters are counted afresh
+        self.assertEqual(self.total('/bills/', from_organization_id=self.chambers[1]), 1)
+
+        caches['default'].clear()
+        self.assertEqual(self.total('/bills/'), 2)
+        self.assertEqual(self.total('/bills/', **first), 1)
+
+    @override_settings(IMAGO_COUNT_STRATEGIES={'PeopleList': 'estimate'})
+    def test_estimate(self):
+        with mock.patch('imago.helpers.estimate_count', return_value=1000):
+            meta = self.meta('/people/', per_page=100)
+            self.assertEqual((meta['total_count'], meta['max_page']), (3, 1))
+            with mock.patch.object(PeopleList, 'count_estimate_threshold', 1000):
+                meta = self.meta('/people/', per_page=100)
+                self.assertEqual((meta['total_count'], meta['max_page']), (1000, 10))
@@ -0,0 +1,64 @@
+import json
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .. import encoders
+from ..serialize import dout
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class EncoderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_same_bytes(self):
+        paths = ['/bills/', '/events/', '/people/', '/{}/'.format(self.world.bills[0].pk)]
+        for path in paths:
+            with self.subTest(path=path):
+                with override_settings(IMAGO_JSON_ENCODER='json'):
+                    expected = self.get(path).content
+                with override_settings(IMAGO_JSON_ENCODER='orjson'):
+                    self.assertEqual(self.get(path).json(), json.loads(expected.decode('utf-8')))
+                with override_settings(IMAGO_JSON_ENCODER='compare'), \
+                        mock.patch.object(encoders.log, 'warning') as warning:
+                    self.assertEqual(self.get(path).content, expected)
+                self.assertFalse(warning.called)
+
+    def test_compare_ndjson(self):
+        with override_settings(IMAGO_JSON_ENCODER='compare'), \
+                mock.patch.object(encoders.log, 'warning') as warning:
+            b''.join(self.get('/events/', format='ndjson').streaming_content)
+            self.assertFalse(warning.called)
+            with mock.patch.object(encoders, 'compare') as compare:
+                b''.join(self.get('/events/', format='ndjson').streaming_content)
+            self.assertEqual(compare.call_count, len(self.world.events))
+
+    def test_compare(self):
+        when = timezone.now().replace(microsecond=123456)
+        self.assertTrue(encoders.compare({"at": dout(when), "name": "é"},
+                                         {"at": when, "name": "é"}))
+        with mock.patch.object(encoders.log, 'warning') as warning:
+            # DjangoJSONEncoder drops the microseconds
+            self.assertFalse(encoders.compare({"at": when}, {"at": when}))
+            self.assertFalse(encoders.compare({"n": float('nan')}, {"n": float('nan')}))
+        self.assertEqual(warning.call_count, 2)
+
+    @override_settings(IMAGO_COMPILE_SERIALIZERS=False)
+    def test_needs_compiled_serializers(self):
+        for name in ('orjson', 'compare'):
+            with override_settings(IMAGO_JSON_ENCODER=name):
+                with self.assertRaises(ImproperlyConfigured):
+                    encoders.encoder_name()
+        with override_settings(IMAGO_JSON_ENCODER='json'):
+            self.assertEqual(encoders.encoder_name(), 'json')
@@ -0,0 +1,47 @@
+import json
+
+from django.test import TestCase, override_settings
+
+from .. import metrics
+from .data import World
+
+
+def recorded(endpoint):
+    """ (requests, queries) in the query count histogram for `endpoint`. """
+    series = metrics.query_count._series.get((endpoint,), [None, 0.0, 0])
+    return series[2], series[1]
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class ExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def test_ndjson(self):
+        response = self.client.get('/bills/', {'format': 'ndjson',
+                                               'fields': 'id,identifier,actions.description'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        bills = [json.loads(line.decode('utf-8'))
+                 for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(bill['id'] for bill in bills),
+                         sorted(bill.id for bill in self.world.bills))
+        self.assertEqual([len(bill['actions']) for bill in bills], [2] * len(bills))
+
+    def test_ndjson_errors(self):
+        response = self.client.get('/bills/', {'format': 'ndjson', 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+
+    def test_streamed_queries_are_counted(self):
+        requests, queries = recorded('PeopleList')
+        response = self.client.get('/people/', {'format': 'ndjson',
+                                                'fields': 'id,memberships.role'})
+        # not until it's been sent
+        self.assertEqual(recorded('PeopleList')[0], requests)
+        with self.assertNumQueries(2):
+            b''.join(response.streaming_content)
+        self.assertEqual(recorded('PeopleList')[0], requests + 1)
+        self.assertGreaterEqual(recorded('PeopleList')[1] - queries, 2)
@@ -0,0 +1,130 @@
+import uuid
+
+from django.contrib.gis.geos import Point, Polygon
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .. import geo
+from ..models import DivisionGeometry
+from .data import World
+
+
+class CachePrecisionTest(SimpleTestCase):
+
+    def test_default(self):
+        # a cell miss costs more queries than it saves without the index
+        with override_settings(IMAGO_SPATIAL_INDEX=False):
+            self.assertIsNone(geo.cache_precision())
+        with override_settings(IMAGO_SPATIAL_INDEX=True):
+            self.assertEqual(geo.cache_precision(), 3)
+
+    @override_settings(IMAGO_GEO_CACHE_PRECISION=2)
+    def test_setting(self):
+        for spatial_index in (False, True):
+            with override_settings(IMAGO_SPATIAL_INDEX=spatial_index):
+                self.assertEqual(geo.cache_precision(), 2)
+
+
+# (lat, lon) pairs around the boundaries below
+POINTS = [
+    (39.75, -75.25),    # in the state and the square district
+    (40.5, -75.8),      # only in the state
+    (42.0, -75.0),      # outside every boundary
+    (39.75, -75.0),     # on the square's edge
+    (40.0, -75.0),      # on a corner of both districts
+    (40.4, -74.7),      # in the triangle, across a grid line from its right angle
+    (40.4, -74.5),      # past the triangle's long side
+]
+
+
+@override_settings(IMAGO_SPATIAL_INDEX=True, IMAGO_GEO_VERSION_CHECK_INTERVAL=60)
+class DivisionIdsAtTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+        cls.state = cls.world.state.pk
+        cls.square, cls.triangle, cls.north = [post.division_id for post in cls.world.posts[:3]]
+        cls.world.boundary(cls.world.state, Polygon.from_bbox((-76, 39, -74, 41)))
+        cls.world.boundary(cls.world.posts[0].division,
+                           Polygon.from_bbox((-75.5, 39.5, -75, 40)))
+        # its long side runs along lat + lon = -34.2
+        cls.world.boundary(cls.world.posts[1].division,
+                           Polygon(((-75, 40), (-74.2, 40), (-75, 40.8), (-75, 40))))
+
+    def setUp(self):
+        geo._state.reset()
+
+    def tearDown(self):
+        geo._state.reset()
+
+    def postgis(self, lat, lon):
+        """ The answer of the query the lat/lon filters fall back to. """
+        return set(DivisionGeometry.objects.filter(
+            boundary__shape__contains=Point(lon, lat, srid=4326)
+        ).values_list('division_id', flat=True))
+
+    def test_points(self):
+        self.assertEqual(self.postgis(39.75, -75.25), {self.state, self.square})
+        self.assertEqual(self.postgis(40.4, -74.7), {self.state, self.triangle})
+        self.assertEqual(self.postgis(42.0, -75.0), set())
+
+    @override_settings(IMAGO_GEO_CACHE_PRECISION=None)
+    def test_spatial_index(self):
+        for cell_size in (0.5, 0.1, 10):
+            with self.subTest(cell_size=cell_size), \
+                    override_settings(IMAGO_SPATIAL_INDEX_CELL_SIZE=cell_size):
+                geo._state.reset()
+                for lat, lon in POINTS:
+                    self.assertEqual(geo.division_ids_at(lat, lon), self.postgis(lat, lon),
+                                     (lat, lon))
+        self.assertEqual(geo.stats()['spatial_index'], 3)
+
+    @override_settings(IMAGO_GEO_CACHE_PRECISION=1)
+    def test_cached_edges(self):
+        # the first two share a 0.1 degree cell the triangle's long side crosses
+        for lat, lon in [(40.37, -74.6), (40.43, -74.6)] * 2 + POINTS:
+            self.assertEqual(geo.division_ids_at(lat, lon), self.postgis(lat, lon),
+                             (lat, lon))
+        stats = geo.stats()
+        self.assertGreater(stats['edge_checks'], 0)
+        # the index checks them in memory
+        self.assertEqual(stats['edge_queries'], 0)
+
+    def test_one_cell_either_side(self):
+        # 0.0004 degrees either side of the triangle's long side, in one cell
+        inside, outside = (40.3996, -74.6), (40.4004, -74.6)
+        self.assertEqual(geo.cell_box(*inside, precision=3)[0],
+                         geo.cell_box(*outside, precision=3)[0])
+        for spatial_index in (True, False):
+            with self.subTest(spatial_index=spatial_index), override_settings(
+                    IMAGO_SPATIAL_INDEX=spatial_index, IMAGO_GEO_CACHE_PRECISION=3):
+                geo._state.reset()
+                self.assertEqual(geo.division_ids_at(*inside), {self.state, self.triangle})
+                self.assertEqual(geo.division_ids_at(*outside), {self.state})
+                self.assertEqual(geo.division_ids_at(*inside), self.postgis(*inside))
+                self.assertEqual(geo.division_ids_at(*outside), self.postgis(*outside))
+                stats = geo.stats()
+                self.assertEqual((stats['size'], stats['misses'], stats['hits']), (1, 1, 3))
+                # each lookup checks the triangle: in memory with the index,
+                # in PostGIS without it
+                self.assertEqual(stats['edge_checks'], 4)
+                self.assertEqual(stats['edge_queries'], 0 if spatial_index else 4)
+
+    def test_invalidate(self):
+        self.assertEqual(geo.division_ids_at(42.0, -75.0), set())
+        self.world.boundary(self.world.posts[2].division,
+                            Polygon.from_bbox((-75.5, 41.5, -74.5, 42.5)))
+        # still the index and cell loaded before
+        self.assertEqual(geo.division_ids_at(42.0, -75.0), set())
+        geo.invalidate()
+        self.assertEqual(geo.division_ids_at(42.0, -75.0), {self.north})
+
+    def test_invalidated_elsewhere(self):
+        index = geo.get_spatial_index()
+        # as if another process' loadmappings had called invalidate()
+        DivisionGeometry.objects.filter(division_id=self.square).delete()
+        geo._cache().set(geo.VERSION_KEY, uuid.uuid4().hex, None)
+        self.assertIs(geo.get_spatial_index(), index)
+        with override_settings(IMAGO_GEO_VERSION_CHECK_INTERVAL=0):
+            self.assertIsNot(geo.get_spatial_index(), index)
+            self.assertEqual(geo.division_ids_at(39.75, -75.25), {self.state})
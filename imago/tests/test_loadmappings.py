@@ -0,0 +1,160 @@
+import contextlib
+import io
+import os
+import tempfile
+import types
+from unittest import mock
+
+from django.contrib.gis.geos import Polygon
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..management.commands.loadmappings import (MappingSpool, _init_worker,
+                                                _match_set_to_file, index_key, insert_spool,
+                                                match_mapping, save_mapping)
+from .. import shapes
+from ..models import BoundaryShape, DivisionGeometry
+from .data import World
+
+
+class MappingSpoolTest(SimpleTestCase):
+
+    def test_round_trip(self):
+        pairs = [('ocd-division/country:us/state:ex', 1),
+                 ('ocd-division/country:us/state:ex/place:a\\b\tc', 2)]
+        spool = MappingSpool()
+        try:
+            spool.extend(pairs[:1])
+            spool.extend(iter(pairs[1:]))
+            self.assertEqual(spool.count, 2)
+            spool.file.seek(0)
+            self.assertEqual(spool.file.read().splitlines()[1],
+                             'ocd-division/country:us/state:ex/place:a\\\\b\\tc\t2')
+            self.assertEqual(list(spool), pairs)
+            self.assertEqual(list(spool), pairs)
+        finally:
+            spool.close()
+
+    def test_between_processes(self):
+        named = MappingSpool.named()
+        named.extend([('ocd-division/country:us', 1)])
+        path, count = named.detach()
+        spool = MappingSpool.attach(path, count)
+        try:
+            self.assertFalse(os.path.exists(path))
+            spool.append(MappingSpool.attach(*self.detached([('ocd-division/country:ca', 2)])))
+            self.assertEqual(spool.count, 2)
+            self.assertEqual(list(spool), [('ocd-division/country:us', 1),
+                                           ('ocd-division/country:ca', 2)])
+        finally:
+            spool.close()
+
+    def detached(self, pairs):
+        spool = MappingSpool.named()
+        spool.extend(pairs)
+        return spool.detach()
+
+
+class SaveMappingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+        cls.divisions = [cls.world.state] + [post.division for post in cls.world.posts[:3]]
+        cls.boundaries = [cls.world.boundary(division, Polygon.from_bbox((0, 0, 1, 1)))
+                          for division in cls.divisions[:3]]
+        cls.other = cls.world.boundary(cls.divisions[3], Polygon.from_bbox((0, 0, 1, 1)),
+                                       boundary_set='other')
+
+    def mappings(self):
+        return set(DivisionGeometry.objects.values_list('division_id', 'boundary_id'))
+
+    def spool(self, pairs):
+        spool = MappingSpool()
+        self.addCleanup(spool.close)
+        spool.extend(pairs)
+        return spool
+
+    def test_match(self):
+        geoid_mapping = dict(('x' + division.id, division.id) for division in self.divisions[1:])
+        pairs = match_mapping('example', geoid_mapping, 'x', quiet=True)
+        # yielded as they're matched
+        self.assertIsInstance(pairs, types.GeneratorType)
+        with contextlib.redirect_stdout(io.StringIO()):
+            spool = self.spool(pairs)
+        expected = [(division.id, boundary.id) for division, boundary in
+                    zip(self.divisions[1:3], self.boundaries[1:])]
+        self.assertEqual(list(spool), expected)
+
+        # as a worker process would, handing the pairs back in a file
+        _init_worker({'key': geoid_mapping}, True)
+        self.addCleanup(_init_worker, None, False)
+        with override_settings(IMAGO_BOUNDARY_MAPPINGS={'example': {'key': 'key',
+                                                                    'prefix': 'x'}}), \
+                contextlib.redirect_stdout(io.StringIO()):
+            set_id, path, count = _match_set_to_file('example')
+        spool = MappingSpool.attach(path, count)
+        self.addCleanup(spool.close)
+        self.assertEqual((set_id, list(spool)), ('example', expected))
+
+    def test_save(self):
+        state, first, second = [(d.id, b.id) for d, b in zip(self.divisions, self.boundaries)]
+        moved = (self.divisions[1].id, self.boundaries[2].id)
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(save_mapping('example', self.spool([state, moved, second])), (1, 1))
+            self.assertEqual(save_mapping('example', self.spool([state, moved, second])), (0, 0))
+        self.assertIn('example: 1 added, 1 removed, 2 unchanged', out.getvalue())
+        # the other set's are left alone
+        self.assertEqual(self.mappings(), {state, moved, second,
+                                           (self.divisions[3].id, self.other.id)})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(save_mapping('example', self.spool([])), (0, 3))
+        self.assertEqual(self.mappings(), {(self.divisions[3].id, self.other.id)})
+
+    def test_insert_in_batches(self):
+        DivisionGeometry.objects.all().delete()
+        pairs = [(d.id, b.id) for d, b in zip(self.divisions, self.boundaries)]
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.assertEqual(insert_spool(self.spool(pairs), batch_size=2), 3)
+        self.assertEqual(self.mappings(), set(pairs))
+        self.assertIn('inserted 2 of 3 mappings\ninserted 3 of 3 mappings\n', out.getvalue())
+
+    def test_command(self):
+        index = {'key': dict(('x' + division.id, division.id) for division in self.divisions)}
+        expected = self.mappings()
+        other = DivisionGeometry.objects.filter(boundary=self.other)
+        with override_settings(IMAGO_BOUNDARY_MAPPINGS={
+                'example': {'key': 'key', 'prefix': 'x'},
+                'other': {'key': 'key', 'prefix': 'x'}}), \
+                mock.patch('imago.management.commands.loadmappings.load_index',
+                           return_value=index), \
+                contextlib.redirect_stdout(io.StringIO()):
+            DivisionGeometry.objects.all().delete()
+            call_command('loadmappings', quiet=True)
+            self.assertEqual(self.mappings(), expected)
+            self.assertEqual(BoundaryShape.objects.count(), 4 * len(shapes.tolerances()))
+
+            other.delete()
+            shapes.prune()
+            call_command('loadmappings', incremental=True, quiet=True)
+            self.assertEqual(self.mappings(), expected)
+            self.assertEqual(BoundaryShape.objects.filter(boundary=self.other).count(),
+                             len(shapes.tolerances()))
+
+
+@override_settings(IMAGO_COUNTRY='us')
+class IndexKeyTest(SimpleTestCase):
+
+    def test_missing_csv(self):
+        with mock.patch.dict(os.environ, {'OCD_DIVISION_CSV': '/nonexistent/{}.csv'}):
+            with self.assertRaisesMessage(CommandError, '/nonexistent/us.csv'):
+                index_key(['census_geoid'])
+
+    def test_csv(self):
+        with tempfile.NamedTemporaryFile(suffix='.csv') as f:
+            with mock.patch.dict(os.environ, {'OCD_DIVISION_CSV': f.name}):
+                key = index_key(['census_geoid'])
+            self.assertEqual(key[1:5], ['us', ['census_geoid'], f.name,
+                                        os.stat(f.name).st_mtime])
@@ -0,0 +1,62 @@
+from django.test import TestCase, override_settings
+from opencivicdata.models import Person
+
+from ..helpers import encode_cursor
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class PaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World(size=5)
+
+    def pages(self, path, **params):
+        """ Every page of a cursor paginated list, followed to the end. """
+        pages, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(path, dict(params, cursor=cursor))
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            pages.append(data['results'])
+            cursor = data['meta']['next_cursor']
+        return pages
+
+    def test_cursor(self):
+        pages = self.pages('/people/', per_page=2, fields='id,name', sort='-name')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        names = [person['name'] for page in pages for person in page]
+        self.assertEqual(names, sorted(Person.objects.values_list('name', flat=True),
+                                       reverse=True))
+
+    def test_ties_and_nulls(self):
+        # every person has the same birth date, and no death date
+        for sort in ('birth_date', 'death_date', '-death_date,name'):
+            with self.subTest(sort=sort):
+                pages = self.pages('/people/', per_page=2, fields='id', sort=sort)
+                ids = [person['id'] for page in pages for person in page]
+                self.assertEqual(sorted(ids), sorted(p.pk for p in self.world.people))
+
+    def test_matches_pages(self):
+        by_page = []
+        for page in (1, 2, 3):
+            response = self.client.get('/bills/', {'per_page': 2, 'page': page,
+                                                   'fields': 'id', 'sort': 'identifier'})
+            by_page.append(response.json()['results'])
+        self.assertEqual(self.pages('/bills/', per_page=2, fields='id', sort='identifier'),
+                         by_page)
+
+    def test_errors(self):
+        response = self.client.get('/people/', {'cursor': '', 'page': 2})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/people/', {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, 400)
+        # made for another sort order
+        cursor = encode_cursor(['name', 'id'], ['Legislator 1', self.world.people[1].pk])
+        response = self.client.get('/people/', {'cursor': cursor, 'sort': '-name'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/people/', {'cursor': cursor, 'sort': 'name'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([person['name'] for person in response.json()['results']],
+                         ['Legislator 2', 'Legislator 3', 'Legislator 4'])
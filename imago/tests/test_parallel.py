@@ -0,0 +1,49 @@
+from unittest import mock
+
+from django.db.models import Prefetch
+from django.test import TransactionTestCase, override_settings
+from opencivicdata.models import Membership
+
+from .. import parallel
+from .data import World
+
+
+# the pool's threads have connections of their own, so the data has to be
+# committed for them to see it
+@override_settings(ROOT_URLCONF='imago.urls', IMAGO_QUERY_WORKERS=4)
+class ParallelTest(TransactionTestCase):
+
+    def setUp(self):
+        self.world = World()
+
+    def test_prefetches_through_a_join(self):
+        memberships = list(Membership.objects.select_related('organization'))
+        with mock.patch.object(parallel, 'submit', wraps=parallel.submit) as submit:
+            parallel.prefetch(None, memberships, [
+                Prefetch('organization__posts'),
+                Prefetch('person__memberships'),
+                Prefetch('organization__children'),
+            ])
+        # one thread per relation of the memberships
+        self.assertEqual([[lookup.prefetch_through for lookup in call[0][3:]]
+                          for call in submit.call_args_list],
+                         [['organization__posts', 'organization__children'],
+                          ['person__memberships']])
+        for membership in memberships:
+            cache = membership.organization._prefetched_objects_cache
+            self.assertEqual(sorted(cache), ['children', 'posts'])
+
+    def test_list_and_detail(self):
+        response = self.client.get('/people/')
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(response.json()['meta']['total_count'], len(self.world.people))
+        self.assertEqual([len(person['memberships']) for person in results],
+                         [2] * len(results))
+
+        response = self.client.get('/people/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/{}/'.format(self.world.bills[1].pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['actions']), 2)
@@ -0,0 +1,80 @@
+from django.test import TestCase, override_settings
+
+from ..benchmarks import cases
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class QueryPlanTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def test_every_plan_runs(self):
+        # each endpoint's default fields, and every field the models allow
+        for case in cases():
+            with self.subTest(case=case.name):
+                endpoint = case.endpoint()
+                plan, config = endpoint.resolve_fields(case.fields)
+                serializer = endpoint.get_serializer(case.fields, config)
+                objects = list(plan.apply(endpoint.model.objects.all()))
+                plan.load(objects)
+                self.assertTrue(objects)
+                for obj in objects:
+                    serializer(obj)
+
+    def test_attnames_are_columns(self):
+        endpoint = [case.endpoint for case in cases() if case.name == 'BillDetail'][0]()
+        plan, _ = endpoint.resolve_fields(['id', 'from_organization_id',
+                                           'actions.related_entities.person_id'])
+        self.assertEqual(plan.select_related, [])
+        self.assertIn('from_organization', plan.only)
+        bill = plan.apply(endpoint.model.objects.all()).get(pk=self.world.bills[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(bill.from_organization_id, self.world.chambers[0].pk)
+            entities = [entity for action in bill.actions.all()
+                        for entity in action.related_entities.all()]
+            self.assertIn(self.world.people[0].pk, [e.person_id for e in entities])
+
+    def test_attnames_in_prefetches(self):
+        endpoint = [case.endpoint for case in cases() if case.name == 'OrganizationDetail'][0]()
+        plan, _ = endpoint.resolve_fields(['id', 'posts.division_id', 'posts.label'])
+        posts = dict(plan.prefetch_related)['posts']
+        self.assertEqual(posts.select_related, [])
+        self.assertEqual(posts.only, ['division', 'id', 'label', 'organization'])
+        org = plan.apply(endpoint.model.objects.all()).get(pk=self.world.chambers[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(set(post.division_id for post in org.posts.all()),
+                             set(post.division_id for post in self.world.posts[:3]))
+
+    def test_default_fields_over_http(self):
+        w = self.world
+        paths = ['/jurisdictions/', '/people/', '/votes/', '/events/', '/organizations/',
+                 '/bills/', '/divisions/']
+        paths += ['/{}/'.format(obj.pk) for obj in (
+            w.jurisdiction, w.people[0], w.votes[0], w.events[0], w.chambers[0],
+            w.bills[1], w.state)]
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200, response.content)
+
+    def test_fields_param(self):
+        response = self.client.get('/organizations/', {
+            'fields': 'id,jurisdiction_id,posts.division_id,parent.name'})
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()['results']
+        self.assertEqual(set(org['jurisdiction_id'] for org in results),
+                         {self.world.jurisdiction.pk})
+
+    def test_prefetch_ordering(self):
+        endpoint = [case.endpoint for case in cases() if case.name == 'BillDetail'][0]()
+        plan, _ = endpoint.resolve_fields(['id', 'actions.order', 'sources.url'])
+        prefetches = dict((prefetch.prefetch_through, prefetch.queryset)
+                          for prefetch in plan.prefetches())
+        # the model's own ordering, and none for a model without one
+        self.assertTrue(prefetches['actions'].ordered)
+        self.assertFalse(prefetches['sources'].ordered)
+        bill = plan.apply(endpoint.model.objects.all()).get(pk=self.world.bills[0].pk)
+        self.assertEqual([action.order for action in bill.actions.all()], [0, 1])
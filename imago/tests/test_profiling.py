@@ -0,0 +1,46 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class ProfilingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def profiles(self):
+        profiles = []
+        for filename in sorted(glob.glob(os.path.join(self.directory, '*.json'))):
+            with open(filename) as f:
+                profiles.append(json.load(f))
+        return profiles
+
+    def test_profilers(self):
+        for mode, rate in (('cprofile', 1), ('sample', 0)):
+            with self.subTest(mode=mode), override_settings(
+                    IMAGO_PROFILE_DIR=self.directory, IMAGO_PROFILE_SAMPLE_RATE=rate,
+                    IMAGO_PROFILE_SLOW_SECONDS=0, IMAGO_PROFILE_INTERVAL=0.0001):
+                response = self.client.get('/bills/', {'fields': 'id,actions.description'})
+                self.assertEqual(response.status_code, 200)
+                profile, = [profile for profile in self.profiles()
+                            if profile['mode'] == mode]
+                self.assertEqual(profile['endpoint'], 'BillList')
+                self.assertEqual(profile['fields'], ['id', 'actions.description'])
+                for function in profile['functions']:
+                    self.assertGreaterEqual(function['total'], function['self'])
+        self.assertTrue([profile for profile in self.profiles()
+                         if profile['mode'] == 'cprofile'][0]['functions'])
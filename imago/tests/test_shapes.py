@@ -0,0 +1,91 @@
+import json
+
+from boundaries.models import Boundary
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
+from django.test import TestCase, override_settings
+
+from .. import shapes
+from ..models import BoundaryShape, DivisionGeometry
+from .data import World
+
+
+@override_settings(ROOT_URLCONF='imago.urls')
+class ShapeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.world = World()
+        # a 128 sided circle, which the larger tolerances simplify
+        cls.state = cls.world.boundary(cls.world.state, Point(-75, 40).buffer(1, 32))
+        cls.district = cls.world.boundary(cls.world.posts[0].division,
+                                          Polygon.from_bbox((-75.5, 39.5, -75, 40)))
+        shapes.refresh(quiet=True)
+
+    def expected(self, boundary, tolerance):
+        shape = Boundary.objects.get(pk=boundary.pk).shape
+        return json.loads(shapes.encode(shape, tolerance))
+
+    def test_simplify(self):
+        response = self.client.get('/divisions/', {'simplify': 'lots'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_shapes(self):
+        path = '/{}/'.format(self.world.state.pk)
+        self.assertNotIn('shape', self.client.get(path).json()['geometries'][0])
+
+        points = []
+        for tolerance in shapes.tolerances():
+            with self.subTest(tolerance=tolerance):
+                response = self.client.get(path, {'simplify': tolerance})
+                self.assertEqual(response.status_code, 200, response.content)
+                shape = response.json()['geometries'][0]['shape']
+                self.assertEqual(shape, self.expected(self.state, tolerance))
+                points.append(GEOSGeometry(json.dumps(shape)).num_points)
+        self.assertEqual(points, sorted(points, reverse=True))
+        self.assertLess(points[-1], points[0])
+
+        response = self.client.get('/divisions/', {'simplify': 0.01,
+                                                   'fields': 'id,geometries'})
+        shapes_by_id = dict((division['id'], [g['shape'] for g in division['geometries']])
+                            for division in response.json()['results'])
+        self.assertEqual(shapes_by_id[self.world.state.pk],
+                         [self.expected(self.state, 0.01)])
+        self.assertEqual(shapes_by_id[self.world.posts[0].division_id],
+                         [self.expected(self.district, 0.01)])
+
+    def test_attach(self):
+        boundary = Boundary.objects.only('id').get(pk=self.state.pk)
+        with self.assertNumQueries(1):
+            shapes.attach([boundary], 0.01)
+        self.assertEqual(boundary._geojson, BoundaryShape.objects.get(
+            boundary=self.state, tolerance=0.01).geojson)
+
+        # encoded on the spot when it isn't stored
+        BoundaryShape.objects.all().delete()
+        with self.assertNumQueries(2):
+            shapes.attach([boundary], 0.01)
+        self.assertEqual(json.loads(boundary._geojson), self.expected(self.state, 0.01))
+
+    def test_refresh(self):
+        def stored(boundary):
+            return sorted(BoundaryShape.objects.filter(boundary=boundary).values_list(
+                'tolerance', flat=True))
+
+        self.assertEqual(stored(self.state), sorted(shapes.tolerances()))
+        with override_settings(IMAGO_SHAPE_TOLERANCES=(0, 0.1)):
+            self.assertEqual(shapes.refresh([self.state.pk], quiet=True), 1)
+        self.assertEqual(stored(self.state), [0, 0.1])
+        self.assertEqual(stored(self.district), sorted(shapes.tolerances()))
+
+        # dropped once the boundary isn't mapped to a division
+        DivisionGeometry.objects.filter(boundary=self.state).delete()
+        self.assertEqual(shapes.refresh(quiet=True), 1)
+        self.assertEqual(stored(self.state), [])
+        self.assertEqual(stored(self.district), sorted(shapes.tolerances()))
+
+    @override_settings(USE_LOCKSMITH=True, LOCKSMITH_REGISTRATION_URL='http://example.com/')
+    def test_authorization_first(self):
+        for path in ('/divisions/', '/{}/'.format(self.world.state.pk)):
+            with self.subTest(path=path):
+                response = self.client.get(path, {'simplify': 'lots'})
+                self.assertEqual(response.status_code, 403)
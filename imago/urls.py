@@ -13,7 +13,11 @@ from imago.views import (JurisdictionList,
                          VoteDetail,
                          BillDetail,
                          OrganizationDetail,
-                         DivisionDetail
+                         DivisionDetail,
+
+                         BatchDetail,
+
+                         metrics_view
                         )
 
 urlpatterns = [
@@ -24,6 +28,8 @@ urlpatterns = [
     url(r'^organizations/$', OrganizationList.as_view()),
     url(r'^bills/$', BillList.as_view()),
     url(r'^divisions/$', DivisionList.as_view()),
+    url(r'^batch/$', BatchDetail.as_view()),
+    url(r'^metrics/$', metrics_view),
 
     # detail views
     url(r'^(?P<pk>ocd-jurisdiction/.+)/$', JurisdictionDetail.as_view()),
@@ -14,6 +14,8 @@ from opencivicdata.models import (Jurisdiction,
 
 from .helpers import (PublicListEndpoint,
                       PublicDetailEndpoint,
+                      PublicBatchEndpoint,
+                      authenticated,
                       get_field_list)
 
 from .serialize import (JURISDICTION_SERIALIZE,
@@ -22,11 +24,15 @@ from .serialize import (JURISDICTION_SERIALIZE,
                         VOTE_SERIALIZE,
                         BILL_SERIALIZE,
                         EVENT_SERIALIZE,
-                        DIVISION_SERIALIZE
+                        DIVISION_SERIALIZE,
+                        load_division_geometries
                        )
+from .geo import division_ids_at, stats as geo_stats
+from . import metrics, shapes
 from restless.http import HttpError
 import datetime
 from django.db.models import Q
+from django.http import Http404, HttpResponse
 
 """
 This module contains the class-based views that we expose over the API.
@@ -35,6 +41,46 @@ The common logic for these views are in imago.helpers.*Endpoint
 """
 
 
+def parse_point(lat, lon):
+    try:
+        return float(lat), float(lon)
+    except ValueError:
+        raise HttpError(400, "lat & lon must be numbers")
+
+
+class GeoDebugMixin(object):
+    """ Add the geo lookup cache's hit rates to the debug output. """
+
+    def get_debug(self):
+        debug = super(GeoDebugMixin, self).get_debug()
+        if debug is not None:
+            debug['geo_cache'] = geo_stats()
+        return debug
+
+
+class ShapeMixin(object):
+    """
+    With a `simplify=<tolerance>` param, add each geometry's shape at that
+    tolerance, from the pre-encoded store in `imago.shapes`.
+    """
+
+    tolerance = None
+
+    # checked here too, so an unauthorized request gets its 403 before a bad
+    # `simplify` could get a 400
+    @authenticated
+    def get(self, request, *args, **kwargs):
+        # left in the params, so the response cache keys on it
+        self.tolerance = shapes.parse_tolerance(request.params.get('simplify'))
+        return super(ShapeMixin, self).get(request, *args, **kwargs)
+
+    def load(self, plan, objects):
+        super(ShapeMixin, self).load(plan, objects)
+        if self.tolerance is not None and load_division_geometries in plan.loaders:
+            shapes.attach([dg.boundary for division in objects
+                           for dg in division.geometries.all()], self.tolerance)
+
+
 class JurisdictionList(PublicListEndpoint):
     model = Jurisdiction
     serialize_config = JURISDICTION_SERIALIZE
@@ -106,7 +152,7 @@ class OrganizationDetail(PublicDetailEndpoint):
 
 
 
-class PeopleList(PublicListEndpoint):
+class PeopleList(GeoDebugMixin, PublicListEndpoint):
     model = Person
     serialize_config = PERSON_SERIALIZE
     default_fields = [
@@ -127,7 +173,11 @@ class PeopleList(PublicListEndpoint):
         lat = params.pop('lat', None)
         lon = params.pop('lon', None)
         if lat and lon:
-            params['memberships__post__division__geometries__boundary__shape__contains'] = 'POINT({} {})'.format(lon, lat)
+            division_ids = division_ids_at(*parse_point(lat, lon))
+            if division_ids is None:
+                params['memberships__post__division__geometries__boundary__shape__contains'] = 'POINT({} {})'.format(lon, lat)
+            else:
+                params['memberships__post__division_id__in'] = division_ids
         elif lat or lon:
             raise HttpError(400, "must specify lat & lon together")
         return params
@@ -281,7 +331,7 @@ class EventDetail(PublicDetailEndpoint):
     ])
 
 
-class DivisionList(PublicListEndpoint):
+class DivisionList(GeoDebugMixin, ShapeMixin, PublicListEndpoint):
     model = Division
     serialize_config = DIVISION_SERIALIZE
     default_fields = ['id', 'name', 'country']
@@ -299,6 +349,9 @@ class DivisionList(PublicListEndpoint):
             raise HttpError(400, "If date specified, must also provide lat & lon")
 
         if (lat and lon):
+            division_ids = division_ids_at(*parse_point(lat, lon), date=date)
+            if division_ids is not None:
+                return data.filter(id__in=division_ids)
             data = data.filter(
                 Q(geometries__boundary__set__start_date__lte=date) | Q(geometries__boundary__set__start_date=None),
                 Q(geometries__boundary__set__end_date__gte=date) | Q(geometries__boundary__set__end_date=None),
@@ -310,7 +363,7 @@ class DivisionList(PublicListEndpoint):
         return data
 
 
-class DivisionDetail(PublicDetailEndpoint):
+class DivisionDetail(ShapeMixin, PublicDetailEndpoint):
     model = Division
     serialize_config = DIVISION_SERIALIZE
     default_fields = ['id', 
@@ -325,3 +378,26 @@ class DivisionDetail(PublicDetailEndpoint):
                       'posts.organization.classification',
                       'posts.label',
                       'posts.role']
+
+
+class BatchDetail(PublicBatchEndpoint):
+    details = {
+        'ocd-jurisdiction': JurisdictionDetail,
+        'ocd-person': PersonDetail,
+        'ocd-event': EventDetail,
+        'ocd-vote': VoteDetail,
+        'ocd-organization': OrganizationDetail,
+        'ocd-bill': BillDetail,
+        'ocd-division': DivisionDetail,
+    }
+
+
+def metrics_view(request):
+    """
+    The request histograms from `imago.metrics`, in the Prometheus text
+    format, for a scraper running alongside.
+    """
+    if not metrics.enabled() or request.META.get('REMOTE_ADDR') not in metrics.allowed_ips():
+        raise Http404
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -14,7 +14,8 @@ setup(name='imago',
       platforms=['any'],
       entry_points={
           'console_scripts': [
-              'imago-debug = imago.cli:debug',
+              'imago-bench = imago.cli:bench',
+              'imago-profiles = imago.cli:profiles',
           ]
       },
       install_requires=[